@@ -0,0 +1,555 @@
+#!/usr/bin/env python
+"""Simulate months or years of boots, to see how changes affect battery life and
+display wear.
+
+Each simulated boot runs `moon_pi.main()`, the same as when the Pi wakes up: syncing
+the clock, reading and recording the battery, picking a power plan, computing the
+moon's phase, picking a quote, rendering and updating the display. Like a new
+process, each boot starts without anything `moon_pi` keeps in memory (see
+`clear_process_caches()`), only what it saved in its cache directory. But the clock
+is virtual, the display is emulated (see `epd_emulator`) and waited for on its
+emulated clock, and the PiSugar is a fake whose battery drains according to a
+`DischargeModel`. The PiSugar wakes the Pi up according to its scheduled wake up, as
+set by `moon_pi`, until the battery runs out.
+
+The energy used by each boot is estimated from the CPU time it took, the emulated
+time spent waiting for the display, and the number of display refreshes (see
+`EnergyModel`). Rendering a frame takes most of the CPU time, so by default only a
+sample of the frames is really rendered, and the others are blank and charged the
+average CPU time of those (see `RenderSampler`), which simulates years in seconds.
+
+Usage:
+
+    python boot_simulator.py --days 1095
+    python boot_simulator.py --days 365 --capacity 600 --recharge-at 10
+"""
+
+import argparse
+import contextlib
+import datetime
+import tempfile
+import time
+import typing as t
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import cached_property, partial, wraps
+from pathlib import Path
+from unittest import mock
+
+import arrow
+from loguru import logger
+from PIL import Image
+
+import epd_busy
+import epd_emulator
+import lunar_model
+import moon_pi
+
+DEFAULT_WAKE_TIME = datetime.time(1, 0)
+"""Time of day of the scheduled wake up, as suggested in the README."""
+
+EVERY_DAY = 0b1111111
+"""PiSugar wake up repeat mask for every day of the week."""
+
+
+@dataclass
+class DischargeModel:
+    """How the simulated battery drains and recovers."""
+
+    capacity_mah: float = 1200.0
+    """Capacity of the battery, e.g. 1200 mAh for the PiSugar 2."""
+    standby_ma: float = 0.2
+    """Current drawn while the Pi is off, by the PiSugar and its RTC. This is a
+    guess, and varies between boards.
+    """
+    voltage_curve: tuple[tuple[float, float], ...] = (
+        (0, 3.3),
+        (10, 3.6),
+        (50, 3.75),
+        (90, 4.05),
+        (100, 4.2),
+    )
+    """Battery voltage at a few charge levels (percent, volts), interpolated."""
+    recharge_at_percent: t.Optional[float] = None
+    """Charge level at which the battery gets recharged to full, e.g. once the low
+    battery indicator has been seen. If None, the battery is never recharged, and the
+    simulation carries on with a flat battery.
+    """
+
+    def voltage(self, charge_percent: float) -> float:
+        points = self.voltage_curve
+        for i in range(1, len(points)):
+            (p0, v0), (p1, v1) = points[i - 1], points[i]
+            if charge_percent <= p1:
+                return v0 + (v1 - v0) * max(charge_percent - p0, 0) / (p1 - p0)
+        return points[-1][1]
+
+
+@dataclass
+class EnergyModel:
+    """Rough battery charge used by a boot. The defaults for the fixed costs are
+    `moon_pi.RUN_COSTS_MAH`.
+    """
+
+    boot_mah: float = moon_pi.RUN_COSTS_MAH["boot"]
+    """Booting, syncing the clock and shutting down."""
+    refresh_mah: float = moon_pi.RUN_COSTS_MAH["display"]
+    clear_mah: float = moon_pi.RUN_COSTS_MAH["clear"]
+    active_ma: float = 250.0
+    """Current drawn while the Pi is computing."""
+    cpu_slowdown: float = 20.0
+    """How many times slower the Pi is than the machine running the simulation."""
+    waiting_ma: float = 80.0
+    """Current drawn by the Pi while it waits for the display, i.e. while the
+    display is busy, during SPI transfers and the drivers' delays.
+    """
+
+    def boot_cost_mah(
+        self,
+        cpu_seconds: float,
+        refreshes: int,
+        clears: int,
+        display_seconds: float = 0.0,
+    ) -> float:
+        return (
+            self.boot_mah
+            + cpu_seconds * self.cpu_slowdown * self.active_ma / 3600
+            + display_seconds * self.waiting_ma / 3600
+            + refreshes * self.refresh_mah
+            + clears * self.clear_mah
+        )
+
+
+class VirtualClock:
+    """Replaces `arrow.now()` and `arrow.utcnow()` while it's running."""
+
+    def __init__(self, now: arrow.Arrow):
+        self.now = now.to("utc")
+
+    def _now(self, tz: t.Any = None) -> arrow.Arrow:
+        return self.now.to(tz if tz is not None else "local")
+
+    def _utcnow(self) -> arrow.Arrow:
+        return self.now
+
+    @contextlib.contextmanager
+    def running(self) -> t.Iterator["VirtualClock"]:
+        with mock.patch.object(arrow, "now", self._now):
+            with mock.patch.object(arrow, "utcnow", self._utcnow):
+                yield self
+
+
+class FakePiSugar:
+    """Stands in for `pisugar.PiSugarServer`, with a battery that drains according
+    to a `DischargeModel`.
+    """
+
+    def __init__(self, model: DischargeModel, charge_percent: float = 100.0):
+        self.model = model
+        self.charge_percent = charge_percent
+        self.current_ma = 0.0
+        """Current reported while the Pi is running."""
+        self.alarm_enabled = True
+        self.alarm_time = datetime.datetime.combine(
+            datetime.date.today(), DEFAULT_WAKE_TIME
+        )
+        self.alarm_repeat = EVERY_DAY
+        self.queries = 0
+        self.recharges = 0
+
+    @property
+    def flat(self) -> bool:
+        return self.charge_percent <= 0
+
+    def drain(self, mah: float) -> None:
+        self.charge_percent = max(
+            0.0, self.charge_percent - 100 * mah / self.model.capacity_mah
+        )
+        recharge_at = self.model.recharge_at_percent
+        if recharge_at is not None and self.charge_percent <= recharge_at:
+            self.charge_percent = 100.0
+            self.recharges += 1
+
+    def next_wake_up(self, after: arrow.Arrow) -> t.Optional[arrow.Arrow]:
+        """First time after `after` when the scheduled wake up goes off."""
+        if not self.alarm_enabled or not self.alarm_repeat:
+            return None
+        local = after.to("local")
+        day = local.floor("day")
+        for _ in range(8):
+            wake_up = day.replace(
+                hour=self.alarm_time.hour,
+                minute=self.alarm_time.minute,
+                second=self.alarm_time.second,
+            )
+            # bit 0 is Sunday
+            if wake_up > local and self.alarm_repeat & (1 << (day.isoweekday() % 7)):
+                return wake_up
+            day = day.shift(days=1)
+        return None
+
+    # The parts of `pisugar.PiSugarServer` used by `moon_pi`
+    def get_model(self) -> str:
+        return "PiSugar 2 (simulated)"
+
+    def rtc_rtc2pi(self) -> None:
+        self.queries += 1
+
+    def get_battery_level(self) -> float:
+        self.queries += 1
+        return self.charge_percent
+
+    def get_battery_voltage(self) -> float:
+        self.queries += 1
+        return self.model.voltage(self.charge_percent)
+
+    def get_battery_charging(self) -> bool:
+        self.queries += 1
+        return False
+
+    def get_battery_full_charge_duration(self) -> None:
+        return None
+
+    def get_battery_current(self) -> float:
+        self.queries += 1
+        return -self.current_ma / 1000
+
+    def get_rtc_alarm_enabled(self) -> bool:
+        self.queries += 1
+        return self.alarm_enabled
+
+    def get_rtc_alarm_repeat(self) -> int:
+        self.queries += 1
+        return self.alarm_repeat
+
+    def get_rtc_alarm_time(self) -> datetime.datetime:
+        self.queries += 1
+        return self.alarm_time
+
+    def rtc_alarm_set(self, time: datetime.datetime, weekday_repeat: int) -> None:
+        self.queries += 1
+        self.alarm_time = time
+        self.alarm_repeat = weekday_repeat
+
+
+def clear_process_caches() -> None:
+    """Forget everything `moon_pi` keeps in memory, as when the Pi boots: its
+    `lru_cache`s (and `lunar_model`'s), the fonts and the display profiles' cached
+    properties. The frame writer, if any, is closed first.
+    """
+    if moon_pi.get_frame_writer.cache_info().currsize:
+        moon_pi.get_frame_writer().close()
+    for module in (moon_pi, lunar_model):
+        for value in vars(module).values():
+            if hasattr(value, "cache_info") and hasattr(value, "cache_clear"):
+                value.cache_clear()
+    moon_pi._thread_fonts = moon_pi._ThreadFonts()
+    properties = [
+        name
+        for name, value in vars(moon_pi.DisplayProfile).items()
+        if isinstance(value, cached_property)
+    ]
+    for profile in moon_pi.DISPLAY_PROFILES.values():
+        for name in properties:
+            vars(profile).pop(name, None)
+
+
+class RenderSampler:
+    """Really renders one in every `every` frames, and returns a blank frame
+    otherwise, charging the average CPU time of the real renders instead.
+
+    Blank frames are still shown on the emulated display, so that its refreshes are
+    counted, but they aren't archived (see `is_blank()`). Reusing another day's
+    frame instead would show, pre-render and archive the wrong frame.
+
+    The first frame with each moon image is always rendered, since it also saves the
+    dithered moon image in the cache directory (see `moon_pi._load_base_layer()`),
+    which makes it much slower than the others. Only the other real renders are
+    averaged.
+    """
+
+    def __init__(self, every: t.Optional[int]):
+        self.every = every
+        self.renders = 0
+        self.real_renders = 0
+        self.cached_cpu_seconds = 0.0
+        """CPU time of the real renders whose moon image was already cached."""
+        self.cached_renders = 0
+        self.charged_cpu_seconds = 0.0
+        self._moon_images: set[Path] = set()
+        self._blanks: dict[t.Callable, t.Any] = {}
+        self._rendering = False
+
+    @staticmethod
+    def moon_image(args: tuple) -> t.Optional[Path]:
+        """Moon image of the frame rendered with `args`."""
+        for arg in args:
+            if isinstance(arg, moon_pi.ImageSettings):
+                moon = arg.moon
+                break
+            if isinstance(arg, arrow.Arrow):
+                moon = moon_pi.get_moon_phase(arg)
+                break
+        else:
+            return None
+        return moon_pi.get_moon_img_path(moon.normalized_age, moon.text)
+
+    @staticmethod
+    def blank(frame: t.Any) -> t.Any:
+        """Blank frame of the same kind and size as `frame`: an image, or a packed
+        frame buffer.
+        """
+        if isinstance(frame, Image.Image):
+            blank = Image.new(frame.mode, frame.size)
+            if frame.mode == "P":
+                blank.putpalette(frame.getpalette())
+            return blank
+        return type(frame)(len(frame))
+
+    @staticmethod
+    def is_blank(epd_buf: t.Union[bytes, bytearray]) -> bool:
+        """Whether a packed frame buffer is blank, i.e. wasn't really rendered."""
+        return not epd_buf.strip(b"\0")
+
+    def wrap(self, func: t.Callable) -> t.Callable:
+        @wraps(func)
+        def render(*args, **kwargs):
+            if self._rendering:
+                return func(*args, **kwargs)
+            moon_image = self.moon_image(args)
+            cached = moon_image in self._moon_images
+            self.renders += 1
+            sampled = self.every is None or self.renders % self.every == 0
+            if cached and not sampled and self.cached_renders and func in self._blanks:
+                self.charged_cpu_seconds += (
+                    self.cached_cpu_seconds / self.cached_renders
+                )
+                return self.blank(self._blanks[func])
+
+            self._rendering = True
+            start = time.process_time()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                self._rendering = False
+            self.real_renders += 1
+            if cached:
+                self.cached_cpu_seconds += time.process_time() - start
+                self.cached_renders += 1
+            self._moon_images.add(moon_image)
+            self._blanks[func] = self.blank(result)
+            return result
+
+        return render
+
+    @contextlib.contextmanager
+    def patching(self) -> t.Iterator["RenderSampler"]:
+        with contextlib.ExitStack() as stack:
+            for name in ("generate_image", "render_banded", "render_frame_buffer"):
+                wrapped = self.wrap(getattr(moon_pi, name))
+                stack.enter_context(mock.patch.object(moon_pi, name, wrapped))
+            yield self
+
+
+@dataclass
+class SimulationResult:
+    days: int
+    boots: int = 0
+    cpu_seconds: float = 0.0
+    """CPU time of the boots on this machine, including the time charged for the
+    frames that weren't really rendered.
+    """
+    refreshes: int = 0
+    clears: int = 0
+    display_seconds: float = 0.0
+    """Emulated time spent waiting for the display (see `EnergyModel.waiting_ma`)."""
+    boot_mah: float = 0.0
+    standby_mah: float = 0.0
+    frames_skipped: int = 0
+    """Days on which the display wasn't updated."""
+    recharges: int = 0
+    final_charge_percent: float = 0.0
+    plans: Counter = field(default_factory=Counter)
+    """Number of boots with each power plan."""
+    flat_after_days: t.Optional[float] = None
+    """When the battery ran out, if it did."""
+
+    @property
+    def energy_mah(self) -> float:
+        return self.boot_mah + self.standby_mah
+
+    def summary(self) -> str:
+        plans = ", ".join(f"{name} {count}" for name, count in self.plans.items())
+        flat = (
+            f", flat after {self.flat_after_days:.1f} days"
+            if self.flat_after_days is not None
+            else ""
+        )
+        return (
+            f"{self.days} days: {self.boots} boots ({plans or 'none'}), "
+            f"{self.cpu_seconds:.1f}s CPU, {self.refreshes} refreshes, "
+            f"{self.clears} clears, {self.display_seconds:.0f}s waiting for the "
+            f"display, {self.energy_mah:.0f} mAh "
+            f"({self.boot_mah:.0f} mAh booted, {self.standby_mah:.0f} mAh standby), "
+            f"{self.frames_skipped} days not updated, {self.recharges} recharges, "
+            f"{self.final_charge_percent:.0f}% left{flat}"
+        )
+
+
+def simulate(
+    days: int,
+    start: t.Optional[arrow.Arrow] = None,
+    discharge: t.Optional[DischargeModel] = None,
+    energy: t.Optional[EnergyModel] = None,
+    render_every: t.Optional[int] = 16,
+    charge_percent: float = 100.0,
+) -> SimulationResult:
+    """Simulate `days` days of boots, starting at `start` (by default, the beginning
+    of today), with an empty cache directory.
+
+    Args:
+        render_every: really render one in every this many frames (see
+            `RenderSampler`), or None to render all of them.
+        charge_percent: initial charge of the battery.
+    """
+    start = start or arrow.now().floor("day")
+    end = start.shift(days=days)
+    discharge = discharge or DischargeModel()
+    energy = energy or EnergyModel()
+    pisugar = FakePiSugar(discharge, charge_percent)
+    pisugar.current_ma = energy.active_ma
+    library = epd_emulator.EmulatedEpaperLibrary()
+    controller = library.epaper(moon_pi.WAVESHARE_DISPLAY).controller
+    busy_waiter = partial(
+        epd_busy.BusyWaiter, clock=lambda: controller.clock, sleep=controller.delay
+    )
+    clears = 0
+    sampler = RenderSampler(render_every)
+    clock = VirtualClock(start)
+    result = SimulationResult(days)
+    updated_days = set()
+
+    choose_power_plan = moon_pi.choose_power_plan
+
+    def record_plan(*args, **kwargs) -> moon_pi.PowerPlan:
+        plan = choose_power_plan(*args, **kwargs)
+        result.plans[plan.name] += 1
+        return plan
+
+    epd_clear = moon_pi.epd_clear
+    archive_frame = moon_pi.archive_frame
+
+    def archive_rendered(epd_buf) -> None:
+        if not sampler.is_blank(epd_buf):
+            archive_frame(epd_buf)
+
+    def count_clear(epd) -> None:
+        nonlocal clears
+        epd_clear(epd)
+        clears += 1
+
+    with contextlib.ExitStack() as stack:
+        cache_dir = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        for name, value in (
+            ("CACHE_DIR", cache_dir),
+            ("epaper", library),
+            ("get_pisugar_server", lambda: pisugar),
+            ("choose_power_plan", record_plan),
+            ("epd_clear", count_clear),
+            ("archive_frame", archive_rendered),
+        ):
+            stack.enter_context(mock.patch.object(moon_pi, name, value))
+        stack.enter_context(mock.patch.object(epd_busy, "BusyWaiter", busy_waiter))
+        stack.enter_context(clock.running())
+        stack.enter_context(sampler.patching())
+        stack.callback(clear_process_caches)
+
+        now = start
+        while True:
+            wake_up = pisugar.next_wake_up(now)
+            until = min(wake_up, end) if wake_up else end
+            standby_mah = discharge.standby_ma * (until - now).total_seconds() / 3600
+            result.standby_mah += standby_mah
+            pisugar.drain(standby_mah)
+            now = until
+            if wake_up is None or wake_up >= end:
+                break
+            if pisugar.flat:
+                if result.flat_after_days is None:
+                    result.flat_after_days = (now - start).total_seconds() / 86400
+                continue
+
+            clock.now = wake_up.to("utc")
+            clear_process_caches()
+            boot_refreshes, boot_clears = controller.refreshes, clears
+            display_start = controller.clock
+            charged = sampler.charged_cpu_seconds
+            cpu_start = time.process_time()
+            moon_pi.main()
+            library.finish()
+            cpu_seconds = time.process_time() - cpu_start
+            cpu_seconds += sampler.charged_cpu_seconds - charged
+
+            # clearing the display is a refresh too, as far as the display knows
+            boot_clears = clears - boot_clears
+            boot_refreshes = controller.refreshes - boot_refreshes - boot_clears
+            display_seconds = controller.clock - display_start
+            boot_mah = energy.boot_cost_mah(
+                cpu_seconds, boot_refreshes, boot_clears, display_seconds
+            )
+            pisugar.drain(boot_mah)
+            result.boots += 1
+            result.cpu_seconds += cpu_seconds
+            result.refreshes += boot_refreshes
+            result.clears += boot_clears
+            result.display_seconds += display_seconds
+            result.boot_mah += boot_mah
+            if boot_refreshes:
+                updated_days.add(wake_up.date())
+
+    result.recharges = pisugar.recharges
+    result.final_charge_percent = pisugar.charge_percent
+    result.frames_skipped = days - len(updated_days)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--start", help="start date, e.g. 2025-01-01")
+    parser.add_argument("--capacity", type=float, default=DischargeModel.capacity_mah)
+    parser.add_argument("--standby-ma", type=float, default=DischargeModel.standby_ma)
+    parser.add_argument("--recharge-at", type=float)
+    parser.add_argument("--charge", type=float, default=100.0)
+    parser.add_argument(
+        "--render-every",
+        type=int,
+        default=16,
+        help="really render one in every this many frames, or 0 to render all",
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logger.remove()
+        logger.add(lambda message: print(message, end=""), level="ERROR")
+    start = arrow.get(args.start, tzinfo="local") if args.start else None
+    discharge = DischargeModel(
+        capacity_mah=args.capacity,
+        standby_ma=args.standby_ma,
+        recharge_at_percent=args.recharge_at,
+    )
+    wall_start = time.perf_counter()
+    result = simulate(
+        args.days,
+        start,
+        discharge,
+        render_every=args.render_every or None,
+        charge_percent=args.charge,
+    )
+    print(result.summary())
+    print(f"Simulated in {time.perf_counter() - wall_start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
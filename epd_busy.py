@@ -0,0 +1,359 @@
+"""Waiting for the e-Paper display while it's busy.
+
+The Waveshare drivers wait for the display in `EPD.ReadBusyH()`, which polls the
+BUSY pin every 5 ms in a Python loop, for the whole 20-30 seconds of a refresh. This
+module replaces it with a wait that blocks until the BUSY line's rising edge (when
+the GPIO library supports it), or else polls at an interval that adapts to how long
+the display has been busy (never more slowly than the drivers), and records how long
+each command kept the display busy.
+
+Usage:
+
+    waiter = BusyWaiter(busy_line_from_epdconfig(epdconfig, epd.busy_pin))
+    install(epd, waiter)
+    ...
+    logger.info(waiter.summary())
+"""
+
+import abc
+import threading
+import time
+import typing as t
+from dataclasses import dataclass, field
+
+from loguru import logger
+
+DEFAULT_TIMEOUT = 90.0
+"""Longest the display may stay busy, in seconds."""
+
+DRIVER_POLL_INTERVAL = 0.005
+"""Interval at which the Waveshare drivers poll the BUSY line, in seconds."""
+
+DRIVER_LATENCY = DRIVER_POLL_INTERVAL / 2
+"""Average time the drivers take to notice that the BUSY line went high: the line
+goes high at any time during one of their polling intervals.
+"""
+
+COMMAND_NAMES = {
+    0x02: "power off",
+    0x04: "power on",
+    0x07: "deep sleep",
+    0x10: "data start",
+    0x12: "refresh",
+}
+"""Names of the commands that make the display busy."""
+
+REFRESH_COMMAND = 0x12
+
+
+def command_name(command: t.Optional[int]) -> str:
+    """Name of a command that makes the display busy, or "reset" for None."""
+    if command is None:
+        return "reset"
+    return COMMAND_NAMES.get(command, f"command 0x{command:02X}")
+
+
+class BusyLine(abc.ABC):
+    """The display's BUSY line, which is low while the display is busy."""
+
+    @abc.abstractmethod
+    def is_busy(self) -> bool: ...
+
+    def wait_for_idle(self, timeout: float) -> t.Optional[bool]:
+        """Block until the line goes high, for at most `timeout` seconds.
+
+        Returns:
+            Whether the display is idle, or None if the line can't be waited on, in
+            which case it has to be polled.
+        """
+        return None
+
+    def release_latency(self) -> t.Optional[float]:
+        """Time since the line went high, if its edge was seen by the last
+        `wait_for_idle()`.
+        """
+        return None
+
+
+class PolledBusyLine(BusyLine):
+    """BUSY line read through `epdconfig.digital_read()`, as the drivers do."""
+
+    def __init__(self, digital_read: t.Callable[[int], int], pin: int):
+        self.digital_read = digital_read
+        self.pin = pin
+
+    def is_busy(self) -> bool:
+        return self.digital_read(self.pin) == 0
+
+
+class GpiozeroBusyLine(BusyLine):
+    """BUSY line as a `gpiozero.Button`, as in waveshare-epaper 1.3 and later."""
+
+    def __init__(self, button: t.Any):
+        self.button = button
+
+    def is_busy(self) -> bool:
+        return not self.button.value
+
+    def wait_for_idle(self, timeout: float) -> t.Optional[bool]:
+        return bool(self.button.wait_for_active(timeout))
+
+    def release_latency(self) -> t.Optional[float]:
+        return getattr(self.button, "active_time", None)
+
+
+class RPiGPIOBusyLine(BusyLine):
+    """BUSY line read with `RPi.GPIO`, as in waveshare-epaper 1.2."""
+
+    def __init__(self, gpio: t.Any, pin: int):
+        self.gpio = gpio
+        self.pin = pin
+        self._rising = threading.Event()
+        self._released_at: t.Optional[float] = None
+        self._detecting = False
+
+    def is_busy(self) -> bool:
+        return self.gpio.input(self.pin) == 0
+
+    def wait_for_idle(self, timeout: float) -> t.Optional[bool]:
+        if not self._detecting:
+            # the pin is only set up once the driver has called `module_init()`
+            try:
+                self.gpio.add_event_detect(
+                    self.pin, self.gpio.RISING, callback=self._on_rising
+                )
+            except RuntimeError:
+                logger.exception("Unable to detect edges on the BUSY line")
+                return None
+            self._detecting = True
+        # clear before checking the line, so that an edge in between isn't missed
+        self._rising.clear()
+        self._released_at = None
+        if not self.is_busy():
+            return True
+        return self._rising.wait(timeout) or not self.is_busy()
+
+    def release_latency(self) -> t.Optional[float]:
+        if self._released_at is None:
+            return None
+        return time.monotonic() - self._released_at
+
+    def _on_rising(self, _pin: int):
+        self._released_at = time.monotonic()
+        self._rising.set()
+
+
+class FakeBusyLine(BusyLine):
+    """Simulated BUSY line, for testing without a display.
+
+    Args:
+        edges: whether to simulate a GPIO library that can wait for edges. If not,
+            the line has to be polled.
+    """
+
+    def __init__(self, edges: bool = True):
+        self.edges = edges
+        self.reads = 0
+        self._idle_at = 0.0
+        self._released_at: t.Optional[float] = None
+
+    def busy_for(self, seconds: float):
+        """Make the display busy, starting now."""
+        self._idle_at = time.monotonic() + seconds
+
+    def is_busy(self) -> bool:
+        self.reads += 1
+        return time.monotonic() < self._idle_at
+
+    def wait_for_idle(self, timeout: float) -> t.Optional[bool]:
+        if not self.edges:
+            return None
+        busy = self.is_busy()
+        time.sleep(max(0.0, min(self._idle_at - time.monotonic(), timeout)))
+        idle = not self.is_busy()
+        self._released_at = self._idle_at if busy and idle else None
+        return idle
+
+    def release_latency(self) -> t.Optional[float]:
+        if self._released_at is None:
+            return None
+        return time.monotonic() - self._released_at
+
+
+def busy_line_from_epdconfig(epdconfig: t.Any, pin: int) -> BusyLine:
+    """Get the best way to wait on the BUSY line for the driver's GPIO library."""
+    implementation = getattr(epdconfig, "implementation", None)
+    button = getattr(implementation, "GPIO_BUSY_PIN", None)
+    if button is not None and hasattr(button, "wait_for_active"):
+        return GpiozeroBusyLine(button)
+    gpio = getattr(implementation, "GPIO", None)
+    if gpio is not None and hasattr(gpio, "add_event_detect"):
+        return RPiGPIOBusyLine(gpio, pin)
+    return PolledBusyLine(epdconfig.digital_read, pin)
+
+
+@dataclass(frozen=True)
+class BusyPeriod:
+    command: t.Optional[int]
+    """Last command sent before the display became busy, or None after a reset."""
+    seconds: float
+    """How long the wait took."""
+    cpu_seconds: float
+    """CPU time used while waiting."""
+    edge: bool
+    """Whether the wait was for the BUSY line's edge, rather than polling."""
+    poll_interval: float = 0.0
+    """Last polling interval, if the line was polled."""
+    latency: t.Optional[float] = None
+    """Time from the BUSY line going high to the end of the wait, if the line's edge
+    was seen. When polling, when the line went high isn't known.
+    """
+
+    @property
+    def name(self) -> str:
+        return command_name(self.command)
+
+    @property
+    def recovered_seconds(self) -> t.Optional[float]:
+        """Time saved compared to the drivers' polling, from the measured latency,
+        if it was measured.
+        """
+        return None if self.latency is None else DRIVER_LATENCY - self.latency
+
+
+@dataclass
+class BusyWaiter:
+    """Waits for the display to be idle, and records each busy period.
+
+    Args:
+        min_poll_interval, max_poll_interval: bounds of the polling interval, when
+            the line can't be waited on. The interval grows with the time the
+            display has been busy, so that short busy periods are noticed quickly,
+            up to the drivers' interval, so that the display is never noticed to be
+            idle later than the drivers would.
+        poll_backoff: the polling interval is the time the display has been busy
+            divided by this (within the bounds above). The drivers' interval is
+            reached after `poll_backoff` times it, so a long refresh is polled
+            only a few more times than by the drivers.
+        clock, sleep: how time is measured and waited for, e.g. the emulated
+            display's clock (see `epd_emulator.Controller`) instead of wall time.
+
+    Raises:
+        ValueError: if `max_poll_interval` is longer than `DRIVER_POLL_INTERVAL`.
+    """
+
+    line: BusyLine
+    timeout: float = DEFAULT_TIMEOUT
+    min_poll_interval: float = 0.0005
+    max_poll_interval: float = DRIVER_POLL_INTERVAL
+    poll_backoff: float = 4.0
+    clock: t.Callable[[], float] = time.monotonic
+    sleep: t.Callable[[float], None] = time.sleep
+    periods: list[BusyPeriod] = field(default_factory=list)
+    last_command: t.Optional[int] = None
+
+    def __post_init__(self):
+        if self.max_poll_interval > DRIVER_POLL_INTERVAL:
+            msg = (
+                f"max_poll_interval ({self.max_poll_interval}s) is longer than the "
+                f"drivers' polling interval ({DRIVER_POLL_INTERVAL}s)"
+            )
+            raise ValueError(msg)
+
+    def wait(self) -> BusyPeriod:
+        """Block until the display isn't busy.
+
+        Raises:
+            TimeoutError: if the display is still busy after `timeout` seconds.
+        """
+        start, cpu_start = self.clock(), time.process_time()
+        idle = self.line.wait_for_idle(self.timeout)
+        edge = idle is not None
+        poll_interval = 0.0
+        latency = self.line.release_latency() if idle else None
+        if idle is None:
+            idle, poll_interval = self._poll(start)
+        seconds = self.clock() - start
+        period = BusyPeriod(
+            self.last_command,
+            seconds,
+            time.process_time() - cpu_start,
+            edge,
+            poll_interval,
+            # the line may have gone high before the wait
+            None if latency is None else min(latency, seconds),
+        )
+        if not idle:
+            msg = f"display still busy after {period.seconds:.1f}s ({period.name})"
+            raise TimeoutError(msg)
+        logger.debug(f"Display busy for {period.seconds:.3f}s ({period.name})")
+        self.periods.append(period)
+        return period
+
+    def _poll(self, start: float) -> tuple[bool, float]:
+        """Poll the line until it's idle, returning whether it is, and the last
+        polling interval.
+        """
+        deadline = start + self.timeout
+        interval = 0.0
+        while self.line.is_busy():
+            now = self.clock()
+            if now >= deadline:
+                return False, interval
+            interval = min(self.max_poll_interval, (now - start) / self.poll_backoff)
+            interval = max(self.min_poll_interval, interval)
+            self.sleep(min(interval, deadline - now))
+        return True, interval
+
+    @property
+    def refreshes(self) -> int:
+        return sum(period.command == REFRESH_COMMAND for period in self.periods)
+
+    def summary(self) -> str:
+        """Describe the busy periods, the CPU time spent waiting, and the time
+        recovered compared to the drivers' polling, where the latency was measured.
+        """
+        busy = ", ".join(f"{p.name} {p.seconds:.3f}s" for p in self.periods)
+        cpu = sum(p.cpu_seconds for p in self.periods)
+        summary = (
+            f"Display busy periods: {busy or 'none'}. "
+            f"{cpu * 1000:.1f}ms CPU time spent waiting"
+        )
+        measured = [p for p in self.periods if p.latency is not None]
+        if measured:
+            recovered = sum(p.recovered_seconds for p in measured)
+            per_refresh = recovered / max(self.refreshes, 1)
+            latency = max(p.latency for p in measured)
+            summary += (
+                f", {per_refresh * 1000:.2f}ms recovered per refresh compared to "
+                f"polling every {DRIVER_POLL_INTERVAL * 1000:.0f}ms (waits ended "
+                f"{latency * 1000:.2f}ms at most after the BUSY line went high, "
+                f"{len(measured)} of {len(self.periods)} measured)"
+            )
+        return summary
+
+
+def install(epd: t.Any, waiter: BusyWaiter) -> None:
+    """Make the driver wait for the display with `waiter`, and record the command
+    that made the display busy.
+    """
+    send_command = epd.send_command
+    reset = epd.reset
+
+    def send_command_recorded(command: int):
+        waiter.last_command = command
+        send_command(command)
+
+    def reset_recorded():
+        waiter.last_command = None
+        reset()
+
+    epd.send_command = send_command_recorded
+    epd.reset = reset_recorded
+    epd.ReadBusyH = waiter.wait
+    epd.busy_waiter = waiter
+
+
+def get_waiter(epd: t.Any) -> t.Optional[BusyWaiter]:
+    """Get the waiter installed on the driver, if any."""
+    return vars(epd).get("busy_waiter")
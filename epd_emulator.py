@@ -0,0 +1,599 @@
+"""Emulation of the Waveshare e-Paper display, for running without one.
+
+`EmulatedEpaperLibrary` stands in for the waveshare-epaper package. Its `EPD`
+drives an emulated display controller through an emulated `epdconfig`, the same
+way the real driver drives the hardware: pins are written, commands and data are
+clocked out over SPI, and the BUSY line is low while the display is working. The
+controller:
+
+- decodes the frame buffer back into an image at each refresh
+- keeps an emulated clock, which is advanced by delays, by SPI transfers, and by the
+  time the display stays busy after each command. Refreshes take as long as they
+  would on the hardware, without actually waiting.
+- raises `ProtocolError` when the display is driven in a way that the hardware
+  doesn't allow, e.g. a command sent while the display is busy, a refresh before
+  it's initialized or powered on, or a refresh that isn't followed by deep sleep
+  by the end of the run (see `EmulatedEpaperLibrary.finish()`)
+
+Only the epd7in3f is emulated.
+
+Usage:
+
+    with EmulatedEpaperLibrary() as library:
+        epd = library.epaper("epd7in3f").EPD()
+        epd.init()
+        epd.display(epd.getbuffer(image))
+        epd.sleep()
+    controller = library.epaper("epd7in3f").controller
+    logger.info(controller.summary())
+"""
+
+import types
+import typing as t
+from dataclasses import dataclass
+
+from loguru import logger
+from PIL import Image
+
+import epd_busy
+
+SPI_HZ = 4_000_000
+"""SPI clock set by the drivers' `epdconfig`, in Hz."""
+
+DRIVER_POLL_MS = 5
+"""Interval at which the driver's `ReadBusyH()` polls the BUSY line."""
+
+RST_PIN = 17
+DC_PIN = 25
+CS_PIN = 8
+BUSY_PIN = 24
+PWR_PIN = 18
+"""GPIO pins, as in the drivers' `epdconfig` for the Raspberry Pi."""
+
+PANEL_SETTING = 0x00
+POWER_OFF = 0x02
+POWER_ON = 0x04
+DEEP_SLEEP = 0x07
+DATA_START = 0x10
+REFRESH = 0x12
+RESOLUTION = 0x61
+DEEP_SLEEP_CHECK = 0xA5
+"""Data that must follow the deep sleep command."""
+
+
+class ProtocolError(RuntimeError):
+    """The display was driven in a way that the hardware doesn't allow."""
+
+
+@dataclass(frozen=True)
+class PanelSpec:
+    """Describes an emulated display."""
+
+    name: str
+    width: int
+    height: int
+    palette: tuple[tuple[int, int, int], ...]
+    """RGB colors, in the order of the color codes the display expects."""
+    busy_seconds: dict[t.Optional[int], float]
+    """How long the display stays busy after each command (None for a reset), in
+    seconds.
+    """
+    init_sequence: tuple[tuple[int, tuple[int, ...]], ...]
+    """Commands, and their data, sent by the driver's `init()` after the reset."""
+    bits_per_pixel: int = 4
+
+    @property
+    def frame_bytes(self) -> int:
+        return self.width * self.height * self.bits_per_pixel // 8
+
+
+PANELS = {
+    spec.name: spec
+    for spec in (
+        PanelSpec(
+            name="epd7in3f",
+            width=800,
+            height=480,
+            palette=(
+                (0, 0, 0),
+                (255, 255, 255),
+                (0, 255, 0),
+                (0, 0, 255),
+                (255, 0, 0),
+                (255, 255, 0),
+                (255, 128, 0),
+            ),
+            # typical durations at room temperature. Refreshes are slower in the
+            # cold. See `measured_busy_seconds()` to use your own display's.
+            busy_seconds={None: 0.01, POWER_ON: 0.1, REFRESH: 27.0, POWER_OFF: 0.03},
+            init_sequence=(
+                (0xAA, (0x49, 0x55, 0x20, 0x08, 0x09, 0x18)),  # CMDH
+                (0x01, (0x3F, 0x00, 0x32, 0x2A, 0x0E, 0x2A)),
+                (PANEL_SETTING, (0x5F, 0x69)),
+                (0x03, (0x00, 0x54, 0x00, 0x44)),
+                (0x05, (0x40, 0x1F, 0x1F, 0x2C)),
+                (0x06, (0x6F, 0x1F, 0x1F, 0x22)),
+                (0x08, (0x6F, 0x1F, 0x1F, 0x22)),
+                (0x13, (0x00, 0x04)),  # IPC
+                (0x30, (0x3C,)),
+                (0x41, (0x00,)),  # TSE
+                (0x50, (0x3F,)),
+                (0x60, (0x02, 0x00)),
+                (RESOLUTION, (0x03, 0x20, 0x01, 0xE0)),
+                (0x82, (0x1E,)),
+                (0x84, (0x00,)),
+                (0x86, (0x00,)),  # AGID
+                (0xE3, (0x2F,)),
+                (0xE0, (0x00,)),  # CCSET
+                (0xE6, (0x00,)),  # TSSET
+            ),
+        ),
+    )
+}
+"""Emulated displays, by name."""
+
+
+def measured_busy_seconds(
+    periods: t.Iterable[epd_busy.BusyPeriod],
+) -> dict[t.Optional[int], float]:
+    """Average busy duration of each command, from the periods recorded by an
+    `epd_busy.BusyWaiter` on the hardware, to be used as the controller's
+    `busy_seconds`.
+    """
+    durations: dict[t.Optional[int], list[float]] = {}
+    for period in periods:
+        durations.setdefault(period.command, []).append(period.seconds)
+    return {command: sum(d) / len(d) for command, d in durations.items()}
+
+
+@dataclass(frozen=True)
+class EmulatedBusyPeriod:
+    command: t.Optional[int]
+    """Command that made the display busy, or None for a reset."""
+    start: float
+    """Emulated time at which the display became busy."""
+    seconds: float
+
+    @property
+    def name(self) -> str:
+        return epd_busy.command_name(self.command)
+
+
+class Controller:
+    """Emulates the display's controller, as seen from its pins and SPI bus.
+
+    Args:
+        busy_seconds: busy durations overriding those in `spec`.
+        export: called with the image at each refresh, e.g. to save it (see
+            `frame_export.FrameWriter.write()`).
+    """
+
+    def __init__(
+        self,
+        spec: PanelSpec,
+        busy_seconds: t.Optional[dict[t.Optional[int], float]] = None,
+        export: t.Optional[t.Callable[[Image.Image], None]] = None,
+    ):
+        self.spec = spec
+        self.busy_seconds = {**spec.busy_seconds, **(busy_seconds or {})}
+        self.export = export
+        self.clock = 0.0
+        """Emulated time, in seconds."""
+        self.spi_seconds = 0.0
+        """Emulated time spent on SPI transfers."""
+        self.busy_periods: list[EmulatedBusyPeriod] = []
+        self.refreshes = 0
+        self.image: t.Optional[Image.Image] = None
+        """Image shown on the display, which is kept through resets."""
+        self.pins = {RST_PIN: 1, DC_PIN: 0, CS_PIN: 1, PWR_PIN: 0}
+        self.spi_open = False
+        self.busy_until = 0.0
+        self.refreshed = False
+        """Whether the display was refreshed since it last went into deep sleep,
+        which resets don't change.
+        """
+        self._in_reset = False
+        self._reset_state()
+
+    def _reset_state(self) -> None:
+        self.registers: dict[int, bytearray] = {}
+        self.ram = bytearray()
+        self.command: t.Optional[int] = None
+        self.powered = False
+        self.asleep = False
+
+    @property
+    def busy(self) -> bool:
+        return self.clock < self.busy_until
+
+    def _busy_for(self, command: t.Optional[int]) -> None:
+        seconds = self.busy_seconds.get(command, 0.0)
+        if seconds:
+            self.busy_until = self.clock + seconds
+            self.busy_periods.append(EmulatedBusyPeriod(command, self.clock, seconds))
+
+    def delay(self, seconds: float) -> None:
+        self.clock += seconds
+
+    def wait_for_idle(self, timeout: float) -> bool:
+        """Advance the clock until the display isn't busy, for at most `timeout`
+        seconds, returning whether it's idle.
+        """
+        if self.busy_until - self.clock > timeout:
+            self.clock += timeout
+            return False
+        self.clock = max(self.clock, self.busy_until)
+        return True
+
+    # pins
+
+    def write_pin(self, pin: int, value: int) -> None:
+        previous = self.pins.get(pin)
+        self.pins[pin] = value
+        if pin != RST_PIN or value == previous:
+            return
+        if not value:
+            self._in_reset = True
+        elif self._in_reset:
+            # the display resets, and wakes up from deep sleep, once RST is released
+            self._in_reset = False
+            self._reset_state()
+            self._busy_for(None)
+
+    def read_pin(self, pin: int) -> int:
+        if pin == BUSY_PIN:
+            return 0 if self.busy else 1
+        return self.pins.get(pin, 0)
+
+    # SPI
+
+    def transfer(self, data: t.Union[bytes, bytearray, list[int]]) -> None:
+        if not self.spi_open:
+            msg = "SPI transfer before module_init(), or after module_exit()"
+            raise ProtocolError(msg)
+        seconds = len(data) * 8 / SPI_HZ
+        self.clock += seconds
+        self.spi_seconds += seconds
+        if self.pins[CS_PIN]:
+            return  # the display isn't selected
+        if self._in_reset:
+            msg = "SPI transfer while the display is held in reset"
+            raise ProtocolError(msg)
+        if self.pins[DC_PIN]:
+            self._data(data)
+        else:
+            for command in data:
+                self._command(command)
+
+    def _command(self, command: int) -> None:
+        name = epd_busy.command_name(command)
+        if self.asleep:
+            msg = f"{name} sent in deep sleep. Reset the display to wake it up."
+            raise ProtocolError(msg)
+        if self.busy:
+            msg = f"{name} sent while the display is busy"
+            raise ProtocolError(msg)
+        self.command = command
+        if command == DATA_START:
+            self.ram = bytearray()
+        elif command == REFRESH:
+            self._refresh()
+        elif command == DEEP_SLEEP and self.powered:
+            msg = "deep sleep while powered on. Power the display off first."
+            raise ProtocolError(msg)
+        else:
+            self.registers[command] = bytearray()
+        if command in (POWER_ON, POWER_OFF):
+            self.powered = command == POWER_ON
+        self._busy_for(command)
+
+    def _data(self, data: t.Union[bytes, bytearray, list[int]]) -> None:
+        if self.asleep:
+            msg = "data sent in deep sleep. Reset the display to wake it up."
+            raise ProtocolError(msg)
+        if self.command is None:
+            msg = "data sent before any command"
+            raise ProtocolError(msg)
+        if self.command == DATA_START:
+            self.ram.extend(data)
+        elif self.command != REFRESH:
+            self.registers[self.command].extend(data)
+        if self.command == DEEP_SLEEP:
+            if self.registers[DEEP_SLEEP][0] != DEEP_SLEEP_CHECK:
+                msg = f"deep sleep must be followed by 0x{DEEP_SLEEP_CHECK:02X}"
+                raise ProtocolError(msg)
+            self.asleep = True
+            self.refreshed = False
+
+    def _refresh(self) -> None:
+        if not self.powered:
+            msg = "refresh while powered off. Power the display on first."
+            raise ProtocolError(msg)
+        resolution = self.registers.get(RESOLUTION, b"")
+        if len(resolution) != 4 or PANEL_SETTING not in self.registers:
+            msg = "refresh before the display was initialized"
+            raise ProtocolError(msg)
+        size = (resolution[0] << 8 | resolution[1], resolution[2] << 8 | resolution[3])
+        if size != (self.spec.width, self.spec.height):
+            msg = f"resolution set to {size}, but {self.spec.name} is {self.spec.width}x{self.spec.height}"
+            raise ProtocolError(msg)
+        if len(self.ram) != self.spec.frame_bytes:
+            msg = f"frame buffer is {len(self.ram)} bytes, expected {self.spec.frame_bytes}"
+            raise ProtocolError(msg)
+        image = Image.frombytes(
+            "P", size, bytes(self.ram), "raw", f"P;{self.spec.bits_per_pixel}"
+        )
+        color = image.getextrema()[1]
+        if color >= len(self.spec.palette):
+            msg = f"color code {color} isn't one of the display's {len(self.spec.palette)} colors"
+            raise ProtocolError(msg)
+        image.putpalette([value for rgb in self.spec.palette for value in rgb])
+        self.image = image
+        self.refreshes += 1
+        self.refreshed = True
+        if self.export:
+            self.export(image)
+        logger.debug(f"Emulated display refreshed at {self.clock:.3f}s")
+
+    # module
+
+    def module_init(self) -> int:
+        self.spi_open = True
+        self.pins[PWR_PIN] = 1
+        return 0
+
+    def module_exit(self) -> None:
+        self.check_finished()
+        self.spi_open = False
+        self.pins[DC_PIN] = 0
+        self.pins[PWR_PIN] = 0
+        logger.info(self.summary())
+
+    def check_finished(self) -> None:
+        """Check that the display was put in deep sleep after it was refreshed, as
+        it can be damaged if it's left powered. This is checked when the driver
+        shuts down, and at the end of each run (see `EmulatedEpaperLibrary.finish()`),
+        since a driver that forgets deep sleep usually doesn't shut down either.
+
+        Raises:
+            ProtocolError: if it wasn't.
+        """
+        if self.refreshed:
+            msg = "the display was refreshed, but not put in deep sleep"
+            raise ProtocolError(msg)
+
+    def summary(self) -> str:
+        busy = ", ".join(f"{p.name} {p.seconds:.3f}s" for p in self.busy_periods)
+        return (
+            f"Emulated {self.spec.name}: {self.refreshes} refreshes in "
+            f"{self.clock:.3f}s, busy periods: {busy or 'none'}, "
+            f"{self.spi_seconds:.3f}s of SPI transfers"
+        )
+
+
+class EmulatedBusyButton:
+    """The BUSY line as a `gpiozero.Button`, so that `epd_busy` waits for its edge,
+    which advances the emulated clock instead of polling in real time.
+    """
+
+    def __init__(self, controller: Controller):
+        self.controller = controller
+
+    @property
+    def value(self) -> int:
+        return self.controller.read_pin(BUSY_PIN)
+
+    @property
+    def active_time(self) -> t.Optional[float]:
+        """Emulated time since the line went high, or None while it's low."""
+        if not self.value:
+            return None
+        return self.controller.clock - self.controller.busy_until
+
+    def wait_for_active(self, timeout: t.Optional[float] = None) -> bool:
+        return self.controller.wait_for_idle(
+            epd_busy.DEFAULT_TIMEOUT if timeout is None else timeout
+        )
+
+
+class EmulatedEpdConfig:
+    """Stands in for the drivers' `epdconfig` module, wired to the controller."""
+
+    RST_PIN = RST_PIN
+    DC_PIN = DC_PIN
+    CS_PIN = CS_PIN
+    BUSY_PIN = BUSY_PIN
+    PWR_PIN = PWR_PIN
+
+    def __init__(self, controller: Controller):
+        self.controller = controller
+        self.implementation = types.SimpleNamespace(
+            GPIO_BUSY_PIN=EmulatedBusyButton(controller)
+        )
+
+    def digital_write(self, pin: int, value: int) -> None:
+        self.controller.write_pin(pin, value)
+
+    def digital_read(self, pin: int) -> int:
+        return self.controller.read_pin(pin)
+
+    def delay_ms(self, delaytime: float) -> None:
+        self.controller.delay(delaytime / 1000)
+
+    def spi_writebyte(self, data: list[int]) -> None:
+        self.controller.transfer(data)
+
+    def spi_writebyte2(self, data: t.Union[bytes, bytearray, list[int]]) -> None:
+        self.controller.transfer(data)
+
+    def module_init(self) -> int:
+        return self.controller.module_init()
+
+    def module_exit(self) -> None:
+        self.controller.module_exit()
+
+
+class EPD:
+    """The waveshare-epaper driver for the epd7in3f, on an emulated `epdconfig`."""
+
+    # B,G,R
+    BLACK = 0x000000
+    WHITE = 0xFFFFFF
+    GREEN = 0x00FF00
+    BLUE = 0xFF0000
+    RED = 0x0000FF
+    YELLOW = 0x00FFFF
+    ORANGE = 0x0080FF
+
+    def __init__(self, epdconfig: EmulatedEpdConfig):
+        self.epdconfig = epdconfig
+        self.spec = epdconfig.controller.spec
+        self.width = self.spec.width
+        self.height = self.spec.height
+        self.reset_pin = epdconfig.RST_PIN
+        self.dc_pin = epdconfig.DC_PIN
+        self.busy_pin = epdconfig.BUSY_PIN
+        self.cs_pin = epdconfig.CS_PIN
+
+    def reset(self):
+        self.epdconfig.digital_write(self.reset_pin, 1)
+        self.epdconfig.delay_ms(20)
+        self.epdconfig.digital_write(self.reset_pin, 0)
+        self.epdconfig.delay_ms(2)
+        self.epdconfig.digital_write(self.reset_pin, 1)
+        self.epdconfig.delay_ms(20)
+
+    def send_command(self, command: int):
+        self.epdconfig.digital_write(self.dc_pin, 0)
+        self.epdconfig.digital_write(self.cs_pin, 0)
+        self.epdconfig.spi_writebyte([command])
+        self.epdconfig.digital_write(self.cs_pin, 1)
+
+    def send_data(self, data: int):
+        self.epdconfig.digital_write(self.dc_pin, 1)
+        self.epdconfig.digital_write(self.cs_pin, 0)
+        self.epdconfig.spi_writebyte([data])
+        self.epdconfig.digital_write(self.cs_pin, 1)
+
+    def send_data2(self, data: t.Union[bytes, bytearray, list[int]]):
+        self.epdconfig.digital_write(self.dc_pin, 1)
+        self.epdconfig.digital_write(self.cs_pin, 0)
+        self.epdconfig.spi_writebyte2(data)
+        self.epdconfig.digital_write(self.cs_pin, 1)
+
+    def ReadBusyH(self):  # noqa: N802
+        while self.epdconfig.digital_read(self.busy_pin) == 0:
+            self.epdconfig.delay_ms(DRIVER_POLL_MS)
+
+    def TurnOnDisplay(self):  # noqa: N802
+        self.send_command(POWER_ON)
+        self.ReadBusyH()
+        self.send_command(REFRESH)
+        self.send_data(0x00)
+        self.ReadBusyH()
+        self.send_command(POWER_OFF)
+        self.send_data(0x00)
+        self.ReadBusyH()
+
+    def init(self) -> int:
+        if self.epdconfig.module_init() != 0:
+            return -1
+        self.reset()
+        self.ReadBusyH()
+        self.epdconfig.delay_ms(30)
+        for command, data in self.spec.init_sequence:
+            self.send_command(command)
+            for value in data:
+                self.send_data(value)
+        return 0
+
+    def getbuffer(self, image: Image.Image) -> bytearray:
+        palette = Image.new("P", (1, 1))
+        palette.putpalette([value for rgb in self.spec.palette for value in rgb])
+        if image.size == (self.height, self.width):
+            image = image.rotate(90, expand=True)
+        elif image.size != (self.width, self.height):
+            logger.warning(
+                f"Invalid image dimensions: {image.size[0]} x {image.size[1]}, "
+                f"expected {self.width} x {self.height}"
+            )
+        image = image.convert("RGB").quantize(palette=palette)
+        return bytearray(image.tobytes("raw", f"P;{self.spec.bits_per_pixel}"))
+
+    def display(self, image: t.Union[bytes, bytearray]):
+        self.send_command(DATA_START)
+        self.send_data2(image)
+        self.TurnOnDisplay()
+
+    def Clear(self, color: int = 0x11):  # noqa: N802
+        self.send_command(DATA_START)
+        self.send_data2([color] * self.spec.frame_bytes)
+        self.TurnOnDisplay()
+
+    def sleep(self):
+        self.send_command(DEEP_SLEEP)
+        self.send_data(DEEP_SLEEP_CHECK)
+        self.epdconfig.delay_ms(2000)
+        self.epdconfig.module_exit()
+
+
+class EmulatedEPaper:
+    """Stands in for a display's module in the epaper library."""
+
+    def __init__(
+        self,
+        spec: PanelSpec,
+        busy_seconds: t.Optional[dict[t.Optional[int], float]] = None,
+        export: t.Optional[t.Callable[[Image.Image], None]] = None,
+    ):
+        self.controller = Controller(spec, busy_seconds, export)
+        self.epdconfig = EmulatedEpdConfig(self.controller)
+
+    def EPD(self) -> EPD:  # noqa: N802
+        return EPD(self.epdconfig)
+
+
+class EmulatedEpaperLibrary:
+    """Stands in for the epaper library, emulating the displays in `PANELS`.
+
+    Args:
+        busy_seconds: busy durations overriding those of each display.
+        export: called with the image at each refresh, e.g. to save it (see
+            `frame_export.FrameWriter.write()`).
+    """
+
+    def __init__(
+        self,
+        busy_seconds: t.Optional[dict[t.Optional[int], float]] = None,
+        export: t.Optional[t.Callable[[Image.Image], None]] = None,
+    ):
+        self.busy_seconds = busy_seconds
+        self.export = export
+        self.modules: dict[str, EmulatedEPaper] = {}
+
+    def epaper(self, display_id: str) -> EmulatedEPaper:
+        if display_id not in PANELS:
+            msg = f"{display_id} isn't emulated. Emulated displays: {', '.join(PANELS)}"
+            raise ValueError(msg)
+        if display_id not in self.modules:
+            self.modules[display_id] = EmulatedEPaper(
+                PANELS[display_id], self.busy_seconds, self.export
+            )
+        return self.modules[display_id]
+
+    def finish(self) -> None:
+        """Check that the displays were left in deep sleep, at the end of a run, e.g.
+        of a boot (see `Controller.check_finished()`).
+
+        Raises:
+            ProtocolError: if one wasn't.
+        """
+        for module in self.modules.values():
+            module.controller.check_finished()
+
+    def __enter__(self) -> "EmulatedEpaperLibrary":
+        return self
+
+    def __exit__(self, exc_type: t.Any, *_: t.Any) -> None:
+        if exc_type is None:
+            self.finish()
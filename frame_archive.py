@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+"""Archive of every frame shown on the display, to look back at what it showed on any
+day.
+
+Frames are archived as the packed buffers sent to the display (palette indices, see
+`moon_pi.epd_getbuffer()`). Each one is stored as its XOR with an earlier frame (its
+reference), compressed with zlib, so that only what changed takes any room. The
+dithering of the moon changes all over from one day to the next, but the moon looks
+the same a lunation later, so the reference is whichever is closest of the previous
+frame and the frames shown about one synodic month before. If the difference takes
+more room than the frame itself, or if getting the frame back would take applying
+more than `MAX_DELTAS` differences, the whole frame is stored instead (a keyframe).
+
+The archive is a directory with two files, which are only ever appended to:
+
+- frames.bin: the compressed frames, one after the other.
+- index.bin: a record per frame (see `_INDEX_RECORD`), in the order they were shown,
+  to find the frame shown at any time by binary search.
+
+A frame that can't be got back, e.g. because the archive is corrupt, raises
+`ArchiveError`. Frames are still appended to a corrupt archive, as keyframes if
+their reference can't be got back.
+
+Usage:
+
+    python frame_archive.py frame-archive
+    python frame_archive.py frame-archive --date 2024-09-18 frame.png
+"""
+
+import argparse
+import bisect
+import struct
+import typing as t
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+
+import arrow
+
+MAX_DELTAS = 30
+"""Most differences applied to get a frame back. This bounds the time that takes."""
+
+COMPRESS_LEVEL = 6
+"""zlib compression level, from 0 (none) to 9 (smallest)."""
+
+SYNODIC_MONTH_SECONDS = round(29.530589 * 24 * 3600)
+"""Mean time from one new moon to the next."""
+
+_INDEX_RECORD = struct.Struct("<qQIII")
+"""Index record: Unix time the frame was shown, offset and length of the compressed
+frame in frames.bin, size of the frame, and number of its reference frame.
+"""
+
+
+class ArchiveError(Exception):
+    """A frame can't be got back from the archive, or appended to it."""
+
+
+@dataclass(frozen=True)
+class ArchiveEntry:
+    number: int
+    """Position of the frame in the archive, from 0."""
+    time: int
+    """Unix time the frame was shown."""
+    offset: int
+    length: int
+    """Length of the compressed frame in frames.bin."""
+    size: int
+    """Size of the frame itself."""
+    reference: int
+    """Number of the frame this one is stored as a difference with, which is
+    `number` for keyframes.
+    """
+
+    @property
+    def is_keyframe(self) -> bool:
+        return self.reference == self.number
+
+
+@dataclass(frozen=True)
+class ArchiveStats:
+    frames: int
+    keyframes: int
+    frame_bytes: int
+    """Total size of the frames."""
+    stored_bytes: int
+    """Size of the archive's files."""
+
+    @property
+    def ratio(self) -> float:
+        """How many times smaller the archive is than the frames."""
+        return self.frame_bytes / self.stored_bytes if self.stored_bytes else 0.0
+
+
+def _xor(a: bytes, b: bytes) -> bytes:
+    return (int.from_bytes(a, "little") ^ int.from_bytes(b, "little")).to_bytes(
+        len(a), "little"
+    )
+
+
+def _chain(entry: ArchiveEntry, entries: list[ArchiveEntry]) -> list[ArchiveEntry]:
+    """Get the frames whose differences are applied to get `entry`'s frame back,
+    from its keyframe to itself.
+    """
+    chain = [entry]
+    while not chain[-1].is_keyframe:
+        link = chain[-1]
+        # references are to earlier frames, so the chain always ends
+        if link.reference > link.number:
+            msg = f"frame {link.number} refers to a later frame ({link.reference})"
+            raise ArchiveError(msg)
+        chain.append(entries[link.reference])
+    return chain[::-1]
+
+
+class FrameArchive:
+    """Archive of frames in `directory`, which is created by the first `append()`.
+
+    Args:
+        max_deltas: most differences applied to get a frame back.
+        compress_level: zlib compression level.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        max_deltas: int = MAX_DELTAS,
+        compress_level: int = COMPRESS_LEVEL,
+    ):
+        self.directory = Path(directory)
+        self.frames_path = self.directory / "frames.bin"
+        self.index_path = self.directory / "index.bin"
+        self.max_deltas = max_deltas
+        self.compress_level = compress_level
+
+    def entries(self) -> list[ArchiveEntry]:
+        try:
+            data = self.index_path.read_bytes()
+        except FileNotFoundError:
+            return []
+        # ignore a record that was only partly written
+        data = data[: len(data) - len(data) % _INDEX_RECORD.size]
+        return [
+            ArchiveEntry(number, *record)
+            for number, record in enumerate(_INDEX_RECORD.iter_unpack(data))
+        ]
+
+    def find(
+        self, time: int, entries: t.Optional[list[ArchiveEntry]] = None
+    ) -> t.Optional[ArchiveEntry]:
+        """Find the frame that was showing at Unix time `time`, i.e. the last one
+        shown at or before then.
+        """
+        entries = self.entries() if entries is None else entries
+        i = bisect.bisect_right([entry.time for entry in entries], time)
+        return entries[i - 1] if i else None
+
+    def frame(
+        self, entry: ArchiveEntry, entries: t.Optional[list[ArchiveEntry]] = None
+    ) -> bytes:
+        """Get the frame of an entry back.
+
+        Raises:
+            ArchiveError: if the frame, or one it's stored as a difference with, is
+                missing or corrupt.
+        """
+        entries = self.entries() if entries is None else entries
+        frame = b""
+        try:
+            f = self.frames_path.open("rb")
+        except FileNotFoundError:
+            msg = f"{self.frames_path} is missing"
+            raise ArchiveError(msg) from None
+        with f:
+            for link in _chain(entry, entries):
+                f.seek(link.offset)
+                compressed = f.read(link.length)
+                if len(compressed) != link.length:
+                    msg = f"frame {link.number} is missing from {self.frames_path}"
+                    raise ArchiveError(msg)
+                try:
+                    stored = zlib.decompress(compressed)
+                except zlib.error as e:
+                    msg = f"frame {link.number} is corrupt in {self.frames_path}"
+                    raise ArchiveError(msg) from e
+                if len(stored) != link.size or (
+                    not link.is_keyframe and len(frame) != link.size
+                ):
+                    msg = f"frame {link.number} is the wrong size in {self.frames_path}"
+                    raise ArchiveError(msg)
+                frame = stored if link.is_keyframe else _xor(frame, stored)
+        return frame
+
+    def get(self, time: int) -> t.Optional[bytes]:
+        """Get the frame that was showing at Unix time `time`, if any.
+
+        Raises:
+            ArchiveError: if the frame can't be got back.
+        """
+        entries = self.entries()
+        entry = self.find(time, entries)
+        return None if entry is None else self.frame(entry, entries)
+
+    def references(
+        self, time: int, size: int, entries: list[ArchiveEntry]
+    ) -> list[ArchiveEntry]:
+        """Get the frames that a frame shown at `time` can be stored as a difference
+        with: the previous frame, and the frames on either side of one synodic month
+        before, as long as they're the same size and their chains aren't too long
+        (or broken).
+        """
+
+        def short_chain(entry: ArchiveEntry) -> bool:
+            try:
+                return len(_chain(entry, entries)) <= self.max_deltas
+            except ArchiveError:
+                return False
+
+        i = bisect.bisect_right(
+            [entry.time for entry in entries], time - SYNODIC_MONTH_SECONDS
+        )
+        candidates = {len(entries) - 1, i - 1, i}
+        return [
+            entries[n]
+            for n in sorted(candidates)
+            if 0 <= n < len(entries)
+            and entries[n].size == size
+            and short_chain(entries[n])
+        ]
+
+    def append(self, frame: bytes, time: int) -> ArchiveEntry:
+        """Add a frame shown at Unix time `time`.
+
+        Raises:
+            ArchiveError: if `time` is before the last frame's.
+        """
+        entries = self.entries()
+        if entries and time < entries[-1].time:
+            msg = f"frame shown at {time}, before the last archived frame ({entries[-1].time})"
+            raise ArchiveError(msg)
+        number = len(entries)
+        reference, data = number, frame
+        deltas = []
+        for candidate in self.references(time, len(frame), entries):
+            try:
+                deltas.append(
+                    (candidate.number, _xor(self.frame(candidate, entries), frame))
+                )
+            except ArchiveError:
+                continue  # a corrupt frame can't be a reference
+        if deltas:
+            # the fewer bytes changed, the smaller the difference compresses
+            reference, data = max(deltas, key=lambda delta: delta[1].count(0))
+        compressed = zlib.compress(data, self.compress_level)
+        if reference != number:
+            whole = zlib.compress(frame, self.compress_level)
+            if len(whole) <= len(compressed):
+                reference, compressed = number, whole
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self.frames_path.open("ab") as f:
+            offset = f.tell()
+            f.write(compressed)
+        with self.index_path.open("ab") as f:
+            # drop a record that was only partly written
+            size = f.tell()
+            if size % _INDEX_RECORD.size:
+                f.truncate(size - size % _INDEX_RECORD.size)
+            record = (time, offset, len(compressed), len(frame), reference)
+            f.write(_INDEX_RECORD.pack(*record))
+        return ArchiveEntry(number, *record)
+
+    def stats(self) -> ArchiveStats:
+        entries = self.entries()
+        stored = sum(
+            path.stat().st_size
+            for path in (self.frames_path, self.index_path)
+            if path.exists()
+        )
+        return ArchiveStats(
+            len(entries),
+            sum(entry.is_keyframe for entry in entries),
+            sum(entry.size for entry in entries),
+            stored,
+        )
+
+
+def main():
+    import frame_export
+    import moon_pi
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("archive", type=Path, help="archive directory")
+    parser.add_argument("--date", help="day (YYYY-MM-DD) of the frame to export")
+    parser.add_argument("output", nargs="?", help="file the frame is exported to")
+    args = parser.parse_intermixed_args()
+
+    archive = FrameArchive(args.archive)
+    stats = archive.stats()
+    print(
+        f"{stats.frames} frames ({stats.keyframes} keyframes), "
+        f"{stats.stored_bytes / 1000:.0f} kB, {stats.ratio:.1f}x smaller"
+    )
+    if not (args.date and args.output):
+        return
+    end_of_day = arrow.get(args.date, tzinfo="local").ceil("day")
+    try:
+        frame = archive.get(end_of_day.int_timestamp)
+    except ArchiveError as e:
+        parser.error(str(e))
+    if frame is None:
+        parser.error(f"no frame was shown by {args.date}")
+    profile = moon_pi.get_display_profile()
+    image = moon_pi.epd_unpack_image(frame, profile)
+    image.putpalette(profile.tables.palette)
+    exporter = frame_export.get_exporter(Path(args.output).suffix.lstrip("."))
+    with frame_export.FrameWriter(exporter) as writer:
+        writer.write(image, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+"""Export frames from headless runs, i.e. without an e-Paper display.
+
+Frames are the palette images shown on the display (`moon_pi.ImageBuilder` images,
+or the emulated display's image). A `FrameWriter` encodes and writes them on a
+background thread, so that rendering never waits on encoding or on the disk. Formats:
+
+- "raw": the palette index of each pixel, one byte per pixel, with no header.
+- "ppm" and "pgm": binary Netpbm, in color or in shades of gray.
+- "png": with a tunable compression level. Level 1 is several times faster to
+  encode than PIL's default (6), for files about a third bigger.
+
+Each frame is written to its own file, or they're concatenated onto a stream such as
+stdout or a pipe. Since raw frames all have the same size, and Netpbm and PNG files
+carry their own, the frames can be split up again by the reader.
+
+Usage:
+
+    python frame_export.py --days 30 preview/{n:03}.png
+    python frame_export.py --days 365 --format ppm - | ffmpeg -f ppm_pipe -i - moon.mp4
+"""
+
+import argparse
+import atexit
+import io
+import queue
+import sys
+import threading
+import typing as t
+from dataclasses import dataclass
+from pathlib import Path
+
+import arrow
+from loguru import logger
+from PIL import Image
+
+DEFAULT_QUEUE_SIZE = 4
+"""Frames waiting to be written, after which `FrameWriter.write()` blocks."""
+
+
+class Exporter(t.Protocol):
+    """Encodes frames into one of the export formats."""
+
+    suffix: str
+
+    def encode(self, image: Image.Image) -> bytes: ...
+
+
+def _check_palette_image(image: Image.Image) -> None:
+    if image.mode != "P":
+        msg = f"frames must be palette images, not {image.mode}"
+        raise ValueError(msg)
+
+
+@dataclass(frozen=True)
+class RawExporter:
+    """Palette index of each pixel, one byte per pixel, row by row."""
+
+    suffix = ".raw"
+
+    def encode(self, image: Image.Image) -> bytes:
+        _check_palette_image(image)
+        return image.tobytes()
+
+
+@dataclass(frozen=True)
+class PpmExporter:
+    """Binary PPM (P6) with the color of each pixel."""
+
+    suffix = ".ppm"
+
+    def encode(self, image: Image.Image) -> bytes:
+        _check_palette_image(image)
+        header = b"P6\n%d %d\n255\n" % image.size
+        return header + image.convert("RGB").tobytes()
+
+
+@dataclass(frozen=True)
+class PgmExporter:
+    """Binary PGM (P5) with the luminance of each pixel."""
+
+    suffix = ".pgm"
+
+    def encode(self, image: Image.Image) -> bytes:
+        _check_palette_image(image)
+        header = b"P5\n%d %d\n255\n" % image.size
+        return header + image.convert("L").tobytes()
+
+
+@dataclass(frozen=True)
+class PngExporter:
+    """PNG with the palette of the frame.
+
+    Args:
+        compress_level: zlib compression level, from 0 (none) to 9 (smallest).
+    """
+
+    compress_level: int = 1
+    suffix = ".png"
+
+    def __post_init__(self):
+        if not 0 <= self.compress_level <= 9:
+            msg = (
+                f"PNG compression level must be from 0 to 9, not {self.compress_level}"
+            )
+            raise ValueError(msg)
+
+    def encode(self, image: Image.Image) -> bytes:
+        _check_palette_image(image)
+        data = io.BytesIO()
+        image.save(data, "PNG", compress_level=self.compress_level)
+        return data.getvalue()
+
+
+EXPORTERS: dict[str, t.Callable[[], Exporter]] = {
+    "raw": RawExporter,
+    "ppm": PpmExporter,
+    "pgm": PgmExporter,
+    "png": PngExporter,
+}
+
+
+def get_exporter(name: str, compress_level: t.Optional[int] = None) -> Exporter:
+    """Get the exporter for the format called `name`. `compress_level` is only used
+    for PNG, and defaults to `PngExporter.compress_level`.
+    """
+    if name not in EXPORTERS:
+        msg = f"unknown export format {name!r}. Formats: {', '.join(EXPORTERS)}"
+        raise ValueError(msg)
+    if name == "png" and compress_level is not None:
+        return PngExporter(compress_level)
+    return EXPORTERS[name]()
+
+
+class FrameWriter:
+    """Encodes and writes frames, in order, on a background thread.
+
+    Errors in the background thread are raised by the next call to `write()`,
+    `flush()` or `close()`. Frames still queued when the program exits are written
+    first.
+
+    Args:
+        exporter: how frames are encoded.
+        path: file each frame is written to, unless another is given to `write()`.
+            "{n}" in the path is replaced by the frame number, so that frames
+            don't overwrite each other, e.g. "frames/{n:04}.ppm".
+        stream: binary stream (e.g. `sys.stdout.buffer`) frames are written onto,
+            one after the other, instead of to `path`. It isn't closed by `close()`.
+        queue_size: frames waiting to be written, after which `write()` blocks.
+    """
+
+    def __init__(
+        self,
+        exporter: Exporter,
+        path: t.Union[str, Path, None] = None,
+        stream: t.Optional[t.BinaryIO] = None,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+    ):
+        if path is not None and stream is not None:
+            msg = "frames can be written to a path or to a stream, not both"
+            raise ValueError(msg)
+        self.exporter = exporter
+        self.path = path
+        self.stream = stream
+        self.frames = 0
+        """Frames written, or waiting to be written."""
+        self._queue: queue.Queue[t.Optional[tuple[Image.Image, t.Optional[Path]]]]
+        self._queue = queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._thread: t.Optional[threading.Thread] = None
+        self._error: t.Optional[BaseException] = None
+        self._closed = False
+
+    def write(self, image: Image.Image, path: t.Union[str, Path, None] = None) -> None:
+        """Queue `image` to be written to `path`, or to the writer's path or stream.
+        `image` must not be changed afterwards.
+        """
+        self._raise_error()
+        with self._lock:
+            if self._closed:
+                msg = "write to a closed FrameWriter"
+                raise ValueError(msg)
+            if path is None and self.path is not None:
+                path = str(self.path).format(n=self.frames)
+            if path is None and self.stream is None:
+                msg = "frame written without a path, to a FrameWriter without one"
+                raise ValueError(msg)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="frame-writer", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.close)
+            self.frames += 1
+            # queued while holding the lock, so that frames are written in order
+            self._queue.put((image, None if path is None else Path(path)))
+
+    def flush(self) -> None:
+        """Wait until every frame queued so far has been written."""
+        self._queue.join()
+        self._raise_error()
+
+    def close(self) -> None:
+        """Write the frames still queued, and stop the background thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            atexit.unregister(self.close)
+        self._raise_error()
+
+    def __enter__(self) -> "FrameWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _raise_error(self) -> None:
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                # frames queued after an error are dropped, until it's raised
+                if self._error is None:
+                    self._write(*item)
+            except Exception as e:  # noqa: BLE001
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(self, image: Image.Image, path: t.Optional[Path]) -> None:
+        data = self.exporter.encode(image)
+        if path is None:
+            self.stream.write(data)
+            self.stream.flush()
+            return
+        # written to a temporary file first, so that readers never see half a frame
+        temp_file = path.with_name(f".{path.name}.{threading.get_ident()}")
+        temp_file.write_bytes(data)
+        temp_file.replace(path)
+
+
+def main():
+    import moon_pi
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "output",
+        help='file each frame is written to, with "{n}" for the frame number, '
+        'or "-" to write the frames one after the other to stdout',
+    )
+    parser.add_argument("--start", help="first day (YYYY-MM-DD), today by default")
+    parser.add_argument("--days", type=int, default=1, help="number of frames")
+    parser.add_argument(
+        "--format",
+        choices=EXPORTERS,
+        help="format, from the output's suffix by default",
+    )
+    parser.add_argument(
+        "--compress-level", type=int, help="PNG compression level, from 0 to 9"
+    )
+    parser.add_argument("--low-battery", action="store_true")
+    parser.add_argument("--threads", type=int, help="rendering threads")
+    args = parser.parse_args()
+
+    stream = None
+    path = args.output
+    if args.output == "-":
+        stream, path = sys.stdout.buffer, None
+    name = args.format or Path(args.output).suffix.lstrip(".") or "png"
+    exporter = get_exporter(name, args.compress_level)
+    start = arrow.get(args.start, tzinfo="local") if args.start else arrow.now()
+    days = arrow.Arrow.range("day", start.replace(hour=12), limit=args.days)
+    settings = (moon_pi.frame_settings(day, args.low_battery) for day in days)
+
+    renderer = moon_pi.Renderer()
+    with FrameWriter(exporter, path, stream) as writer:
+        for image in renderer.render_many(settings, args.threads):
+            writer.write(image)
+    logger.info(f"Exported {writer.frames} frames")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+"""Frame server for a fleet of Moon Pi displays.
+
+Rendering a frame takes a while on a Pi Zero, so a nearby machine can render frames
+for all the displays instead. Each display asks for its frame by device ID, date,
+display model and time zone (see `moon_pi.fetch_frame()`), and gets back the packed
+buffer ready to be sent to the e-Paper panel, along with an ETag and the display
+model and time zone it was rendered for.
+
+Rendered frames are kept in an in-memory LRU cache, and whenever a frame is
+requested, the frame for the following day is rendered in the background so that
+it's ready by the time the display wakes up again.
+
+Usage:
+
+    python frame_server.py --port 8350
+    python frame_server.py --device moonpi --display epd7in3f --tz Europe/Paris
+    python frame_server.py --unix-socket /run/moonpi/frames.sock
+"""
+
+import argparse
+import datetime
+import hashlib
+import http.server
+import socketserver
+import threading
+import typing as t
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from pathlib import Path
+
+import arrow
+from loguru import logger
+
+import moon_pi
+
+DEFAULT_PORT = 8350
+DEFAULT_CACHE_SIZE = 64
+
+
+@dataclass(frozen=True)
+class FrameKey:
+    device_id: str
+    date: datetime.date
+    low_battery: bool = False
+    display: str = moon_pi.WAVESHARE_DISPLAY
+    """Display model of the device (see `moon_pi.DISPLAY_PROFILES`)."""
+    tz: str = "local"
+    """Time zone of the device, e.g. "Europe/Paris" or "+02:00" (see
+    `moon_pi.timezone_name()`), which the day and the moon's rise and set times are
+    in.
+    """
+
+    def next_day(self) -> "FrameKey":
+        return replace(self, date=self.date + datetime.timedelta(days=1))
+
+
+@dataclass(frozen=True)
+class Frame:
+    data: bytes
+    """Packed frame buffer, as returned by `moon_pi.epd_getbuffer()`."""
+    width: int
+    height: int
+    display: str
+    """Display model the frame was rendered for."""
+    tz: str
+    """Time zone the frame was rendered in."""
+
+    @property
+    def etag(self) -> str:
+        return '"' + hashlib.blake2b(self.data, digest_size=8).hexdigest() + '"'
+
+
+class FrameCache:
+    """Thread-safe LRU cache of rendered frames."""
+
+    def __init__(self, max_entries: int = DEFAULT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._frames: OrderedDict[FrameKey, Frame] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __contains__(self, key: FrameKey):
+        with self._lock:
+            return key in self._frames
+
+    def get(self, key: FrameKey) -> t.Optional[Frame]:
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._frames.move_to_end(key)
+            return frame
+
+    def put(self, key: FrameKey, frame: Frame) -> None:
+        with self._lock:
+            self._frames[key] = frame
+            self._frames.move_to_end(key)
+            while len(self._frames) > self.max_entries:
+                evicted, _ = self._frames.popitem(last=False)
+                logger.debug(f"Evicted frame {evicted}")
+
+
+def render_frame(key: FrameKey) -> Frame:
+    """Render the frame for the given device and day, for its display and in its
+    time zone.
+    """
+    now = arrow.get(key.date, tzinfo=key.tz)
+    profile = moon_pi.get_display_profile(key.display)
+    data = moon_pi.render_frame_buffer(now, key.low_battery, profile, key.device_id)
+    return Frame(data, *profile.native_size, profile.name, key.tz)
+
+
+class FrameServer:
+    """Renders and caches frames, prefetching the next day's frame in the
+    background.
+
+    Args:
+        renderer: function that renders the frame for a key. Mostly useful for
+            testing.
+        max_entries: number of frames to keep in the cache.
+        prefetch: whether to render the next day's frame in the background.
+    """
+
+    def __init__(
+        self,
+        renderer: t.Callable[[FrameKey], Frame] = render_frame,
+        max_entries: int = DEFAULT_CACHE_SIZE,
+        prefetch: bool = True,
+    ):
+        self.renderer = renderer
+        self.cache = FrameCache(max_entries)
+        self.prefetch = prefetch
+        self._pending: dict[FrameKey, Future] = {}
+        self._pending_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="frame-prefetch"
+        )
+
+    def get_frame(self, key: FrameKey) -> Frame:
+        frame = self.cache.get(key)
+        if frame is None:
+            with self._pending_lock:
+                future = self._pending.get(key)
+            # if the frame is already being prefetched, wait for it instead
+            frame = future.result() if future else self._render(key)
+        if self.prefetch:
+            self.precompute(key.next_day())
+        return frame
+
+    def precompute(self, key: FrameKey) -> t.Optional[Future]:
+        """Render the frame for `key` in the background, unless it's already cached
+        or being rendered.
+        """
+        with self._pending_lock:
+            if key in self._pending or key in self.cache:
+                return self._pending.get(key)
+            future = self._executor.submit(self._prefetch, key)
+            self._pending[key] = future
+            return future
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _prefetch(self, key: FrameKey) -> Frame:
+        try:
+            return self._render(key)
+        finally:
+            with self._pending_lock:
+                self._pending.pop(key, None)
+
+    def _render(self, key: FrameKey) -> Frame:
+        logger.info(f"Rendering frame {key}")
+        frame = self.renderer(key)
+        self.cache.put(key, frame)
+        return frame
+
+
+class FrameRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Serves
+    `GET /frames/<device_id>/<YYYY-MM-DD>?low_battery=<0|1>&display=<model>&tz=<tz>`.
+    """
+
+    server: t.Any
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        if len(parts) != 3 or parts[0] != "frames":
+            self.send_error(404)
+            return
+        query = urllib.parse.parse_qs(url.query)
+        if "display" not in query or "tz" not in query:
+            self.send_error(400, "missing display or tz")
+            return
+        try:
+            key = FrameKey(
+                urllib.parse.unquote(parts[1]),
+                datetime.date.fromisoformat(parts[2]),
+                query.get("low_battery", ["0"])[0] == "1",
+                moon_pi.get_display_profile(query["display"][0]).name,
+                query["tz"][0],
+            )
+            arrow.now(key.tz)
+        except ValueError:
+            self.send_error(400, "invalid date, display or tz")
+            return
+
+        frame = self.server.frame_server.get_frame(key)
+        if self.headers.get("If-None-Match") == frame.etag:
+            self.send_response(304)
+            self.send_header("ETag", frame.etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(frame.data)))
+        self.send_header("ETag", frame.etag)
+        self.send_header("X-Frame-Width", str(frame.width))
+        self.send_header("X-Frame-Height", str(frame.height))
+        self.send_header("X-Frame-Display", frame.display)
+        self.send_header("X-Frame-Timezone", frame.tz)
+        self.end_headers()
+        self.wfile.write(frame.data)
+
+    def address_string(self):
+        # Unix sockets have no client address
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format, *args):  # noqa: A002
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+class TCPFrameHTTPServer(http.server.ThreadingHTTPServer):
+    def __init__(self, address: tuple[str, int], frame_server: FrameServer):
+        self.frame_server = frame_server
+        super().__init__(address, FrameRequestHandler)
+
+
+class UnixFrameHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path, frame_server: FrameServer):
+        self.frame_server = frame_server
+        socket_path.unlink(missing_ok=True)
+        super().__init__(str(socket_path), FrameRequestHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")  # noqa: S104
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix-socket", type=Path)
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE)
+    parser.add_argument(
+        "--device",
+        action="append",
+        default=[],
+        help="device ID to pre-render today's and tomorrow's frames for",
+    )
+    parser.add_argument(
+        "--display",
+        default=moon_pi.WAVESHARE_DISPLAY,
+        help="display model of the devices given with --device",
+    )
+    parser.add_argument(
+        "--tz",
+        default=moon_pi.timezone_name(arrow.now()),
+        help="time zone of the devices given with --device",
+    )
+    args = parser.parse_args()
+
+    frame_server = FrameServer(max_entries=args.cache_size)
+    today = arrow.now(args.tz).date()
+    for device_id in args.device:
+        key = FrameKey(device_id, today, display=args.display, tz=args.tz)
+        frame_server.precompute(key)
+        frame_server.precompute(key.next_day())
+
+    if args.unix_socket:
+        httpd = UnixFrameHTTPServer(args.unix_socket, frame_server)
+        logger.info(f"Serving frames on {args.unix_socket}")
+    else:
+        httpd = TCPFrameHTTPServer((args.host, args.port), frame_server)
+        logger.info(f"Serving frames on {args.host}:{args.port}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        frame_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,71 +3,106 @@
 # https://github.com/PiSugar/pisugar-server-py
 # reference: https://svs.gsfc.nasa.gov/5048/
 
+import bisect
+import collections
 import csv
+import datetime
+import hashlib
+import http.client
 import inspect
 import logging
 import math
+import os
+import random
 import secrets
+import socket
+import struct
+import sys
+import threading
+import time
 import types
 import typing as t
-from dataclasses import dataclass
-from functools import lru_cache
+import urllib.parse
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from functools import cached_property, lru_cache
 from pathlib import Path
 from unittest.mock import MagicMock
 
 import arrow
-import ephem
 import pisugar
 from loguru import logger
 from PIL import Image, ImageDraw, ImageFont
 
-try:
-    import epaper
-except ImportError:
+import epd_busy
+import epd_emulator
+import frame_archive
+import frame_export
+import lunar_model
+
 
-    class MockEpaperDisplay:
-        width = 800
-        height = 480
+class MockEpaperDisplay:
+    # B,G,R
+    BLACK = 0x000000
+    WHITE = 0xFFFFFF
+    GREEN = 0x00FF00
+    BLUE = 0xFF0000
+    RED = 0x0000FF
+    YELLOW = 0x00FFFF
+    ORANGE = 0x0080FF
 
-        # B,G,R
-        BLACK = 0x000000
-        WHITE = 0xFFFFFF
-        GREEN = 0x00FF00
-        BLUE = 0xFF0000
-        RED = 0x0000FF
-        YELLOW = 0x00FFFF
-        ORANGE = 0x0080FF
+    def __init__(self, display_id: str):
+        self.name = display_id
+        self.profile = get_display_profile(display_id)
+        self.width, self.height = self.profile.native_size
 
-        def __init__(self, display_id: str):
-            self.name = display_id
+    def __getattr__(self, _):
+        return MagicMock()
 
-        def __getattr__(self, _):
-            return MagicMock()
+    def getbuffer(self, img: Image.Image):
+        palette = self.profile.tables.palette
+        return epd_pack_image(paletize_image(img, palette), self.profile)
 
-        def getbuffer(self, img: Image.Image):
-            return img
+    def display(self, buf: bytes):
+        img = epd_unpack_image(buf, self.profile)
+        img.putpalette(self.profile.tables.palette)
+        export_frame(img)
 
-        def display(self, img: Image.Image):
-            img_fpath = Path(__file__).parent / "test-img.png"
-            img.save(img_fpath)
 
-    class MockEPaper:
-        def __init__(self, display_id):
-            self.name = display_id
+class MockEPaper:
+    def __init__(self, display_id):
+        self.name = display_id
+
+    def EPD(self):
+        return MockEpaperDisplay(self.name)
+
+    @property
+    def epdconfig(self):
+        return MagicMock()
+
 
-        def EPD(self):
-            return MockEpaperDisplay(self.name)
+class MockEpaperLibrary(epd_emulator.EmulatedEpaperLibrary):
+    """Stands in for the epaper library, for debugging on a non-RPi environment.
+    The displays in `epd_emulator.PANELS` are emulated, and the others are mocked.
+    Each frame shown is exported (see `export_frame()`).
+    """
 
-        @property
-        def epdconfig(self):
-            return MagicMock()
+    def __init__(self):
+        super().__init__(export=self.export_frame)
 
-    class epaper:
-        """Mock epaper class, for debugging on a non-RPi environment"""
+    def export_frame(self, image: Image.Image) -> None:
+        export_frame(image)
 
-        @classmethod
-        def epaper(cls, display_id):
+    def epaper(self, display_id):
+        if display_id not in epd_emulator.PANELS:
             return MockEPaper(display_id)
+        return super().epaper(display_id)
+
+
+try:
+    import epaper
+except ImportError:
+    epaper = MockEpaperLibrary()
 
 
 # Replace BIRTHDAY_MONTH w/ recipient's month of birth and BIRTHDAY_DAY w/ day of birth
@@ -91,30 +126,44 @@ Font files are assumed to be in the "fonts" directory.
 WHITE = 0xFFFFFF
 
 IMAGE_DIR = BASE_DIR / "images"
-BACKGROUND_IMAGE = IMAGE_DIR / "screen-template-7in3.png"
 BATTERY_INDICATOR_IMAGE = IMAGE_DIR / "battery.png"  # modified icon from OpenMoji
 
 WAVESHARE_DISPLAY = "epd7in3f"
-"""The display to use. To get a list of possibilities, use:
+"""The display to use. Must be one of the displays in `DISPLAY_PROFILES`, which
+describes the size, colors, margins, etc. of each supported display.
+"""
 
-    >>> import epaper
-    >>> epaper.modules()
+EPD_BUSY_TIMEOUT = 90
+"""Longest the display may stay busy after a command, in seconds, before giving up.
 """
 
-FONT_ANTIALIASING = False
-"""Whether or not to enable antialiasing for fonts. Generally this should be
-False for displays with limited color palettes.
+FRAME_ARCHIVE_DIR: t.Optional[Path] = None
+"""If set, e.g. to BASE_DIR / "frame-archive", every frame shown is added to an
+archive in this directory, to look back at what the display showed on any day. Most
+frames only take a few kB, since they're stored as their difference with the frame
+before. See `frame_archive.py`.
+"""
+
+HEADLESS_EXPORT_FORMAT = "png"
+"""Format of the frames shown when there's no e-Paper display (e.g. when testing on
+another computer): "png", "raw", "ppm" or "pgm". See `frame_export.py`.
 """
 
-DISPLAY_MARGINS = (51, 18)
-"""Margins for the display, in the form x, y, where x is the left and right
-margins, and y is the top and bottom margins.
-This is for cases where the outer edges of the display will not be seen, such
-as when covered by a picture matte.
+HEADLESS_EXPORT_PATH: t.Optional[str] = None
+"""Where frames shown without an e-Paper display are written: a file, which can
+contain "{n}" for the frame number, or "-" for stdout. If None, test-img with the
+suffix of `HEADLESS_EXPORT_FORMAT` in this directory.
 """
 
-MOON_SIZE_PX = 400
-"""Size of the moon image, in pixels."""
+HEADLESS_PNG_COMPRESS_LEVEL = 1
+"""zlib compression level of PNG frames, from 0 to 9. Higher levels make slightly
+smaller files, but take several times as long to encode.
+"""
+
+FONT_ANTIALIASING = False
+"""Whether or not to enable antialiasing for fonts. Generally this should be
+False for displays with limited color palettes.
+"""
 
 
 LOCATION = {"city": "san francisco", "latitude": 37.773972, "longitude": -122.431297}
@@ -125,9 +174,78 @@ own location.
 BATTERY_LOW_THRESHOLD = 20
 """Battery low indicator will be drawn if charge becomes lower than this threshold."""
 
+CACHE_DIR = BASE_DIR / "cache"
+"""Directory for files that can be regenerated at any time (downloaded frames, etc.)"""
+
+BATTERY_HISTORY_FILE = CACHE_DIR / "battery-history.bin"
+"""Battery charge and voltage recorded at each run, to forecast how long the battery
+will last. If it's deleted, forecasts start over.
+"""
+
+BATTERY_HISTORY_SIZE = 512
+"""Number of runs to keep in the battery history."""
+
+BATTERY_FORECAST_DAYS = 14
+"""Battery history used for the forecast, in days."""
+
+RUN_COSTS_MAH = {
+    "boot": 15.0,
+    "render": 3.0,
+    "clear": 6.0,
+    "display": 6.0,
+    "battery_details": 0.2,
+    "battery_check": 0.5,
+}
+"""Rough battery charge used by each step of a run, in mAh, to estimate the cost of
+a power plan. "boot" covers booting, syncing the clock and shutting down. These can
+be tuned with the current reported by the PiSugar.
+"""
+
+RENDER_MEMORY_BUDGET: t.Optional[int] = None
+"""If set, frames are rendered in horizontal bands, using at most about this many
+bytes of memory on top of the frame buffer (e.g. 256_000), instead of rendering the
+whole image at once. See `render_banded()`. Useful for large displays.
+"""
+
+FRAME_SERVER_URL: t.Optional[str] = None
+"""URL of a frame server (see `frame_server.py`) to fetch pre-rendered frames from,
+e.g. "http://192.168.1.10:8350" or "unix:///run/moonpi/frames.sock". If None, or if
+the server can't be reached, the frame is rendered locally.
+"""
+
+FRAME_SERVER_TIMEOUT = 10
+"""Timeout for frame server requests, in seconds."""
+
+DEVICE_ID = socket.gethostname()
+"""Identifies this display to the frame server."""
+
 MOON_QUARTERS = ["New Moon", "First Quarter", "Full Moon", "Third Quarter"]
 MOON_PHASES = ["Waxing Crescent", "Waxing Gibbous", "Waning Gibbous", "Waning Crescent"]
 
+SHOW_MOON_EVENTS = True
+"""Whether to show moonrise, moonset, transit and the moon's altitude at nightfall."""
+
+SUB_DAILY_UPDATES = False
+"""If True, the moon is shown as of the time of each update rather than the middle of
+the day, and the next wake up is scheduled for the next moonrise or midnight (see
+`next_update_time()`), so the display is updated a couple of times a day. This
+needs the PiSugar's scheduled wake up to be enabled. Frames rendered ahead of time
+or by the frame server are for the whole day, so they aren't used.
+"""
+
+LUNAR_MODEL = "ephem"
+"""How the moon's phase and distance are computed: "ephem" for PyEphem, or
+"analytic" for the truncated Meeus series in `lunar_model.py`, which finds the
+phases several times faster and can evaluate many dates at once, but is only within
+a minute of ephem for the times of the quarters. Either way, each lunation is only
+computed once (see `get_lunation()`).
+"""
+
+NIGHTFALL_SUN_ALTITUDE = "-6"
+"""Altitude of the sun (in degrees) that counts as nightfall. -6 is the end of civil
+twilight.
+"""
+
 # No official definition of supermoon -- this is the Sky and Telescope definition
 SUPERMOON_DISTANCE_AU = 358_884_000 / (1.495978707 * 10**11)
 
@@ -144,120 +262,757 @@ class MoonInfo:
     text: str
 
 
-def _arrow_to_ephem(dt: arrow.Arrow) -> ephem.Date:
-    """Convert Arrow date object to ephem.Date."""
-    return ephem.Date(dt.datetime)
+def _arrow_to_ephem(dt: arrow.Arrow) -> float:
+    """Convert Arrow date object to an ephem date."""
+    return lunar_model.from_datetime(dt.datetime)
 
 
-def _get_moon(date: ephem.Date, location: t.Optional[dict[str, t.Any]] = None):
-    earth = ephem.Observer()
-    if location:
-        earth.lat = math.radians(location["latitude"])
-        earth.long = math.radians(location["longitude"])
-    # earth.date = _arrow_to_ephem(dt)
-    earth.date = date
-
-    return ephem.Moon(earth)
-
-
-def _get_moon_cycle_range(date: ephem.Date) -> tuple[ephem.Date, ephem.Date]:
-    """Get the start and end dates for the current lunation."""
-    cycle_start = ephem.previous_new_moon(date)
-    cycle_end = ephem.next_new_moon(cycle_start)
+def _get_moon_cycle_range(date: float, model: t.Any = None) -> tuple[float, float]:
+    """Get the start and end dates for the current lunation, with the given lunar
+    model (by default ephem's).
+    """
+    model = model or get_lunar_model("ephem")
+    cycle_start = model.previous_new_moon(date)
+    cycle_end = model.next_new_moon(cycle_start)
     if round(cycle_end, 5) <= round(date, 5):
-        cycle_start = ephem.next_new_moon(cycle_start)
-        cycle_end = ephem.next_new_moon(cycle_start)
+        cycle_start = model.next_new_moon(cycle_start)
+        cycle_end = model.next_new_moon(cycle_start)
     return (cycle_start, cycle_end)
 
 
-def _within_a_day(first: ephem.Date, second: ephem.Date):
+def _within_a_day(first: float, second: float):
     return abs(second - first) <= 0.5
 
 
-def _is_full_moon(date: ephem.Date) -> bool:
-    cycle_start, _ = _get_moon_cycle_range(date)
-    full_moon_this_cycle = ephem.next_full_moon(cycle_start)
-    return _within_a_day(date, full_moon_this_cycle)
+_LUNATION_COEFFICIENTS = 24
+"""Number of Chebyshev coefficients fitted to the moon's phase and distance over
+each lunation. With 24, the phase is within 0.001% of the lunar model's, and the
+distance within a few hundred meters.
+"""
 
 
-def _is_blue_moon(date: ephem.Date) -> bool:
-    if _is_full_moon(date):
-        cycle_start, _ = _get_moon_cycle_range(date)
-        previous_full = ephem.previous_full_moon(cycle_start).datetime()
-        return date.datetime().month == previous_full.month
-    return False
+def _chebyshev_fit(
+    func: t.Callable[[list[float]], t.Sequence[float]],
+    start: float,
+    end: float,
+    size: int,
+) -> tuple[float, ...]:
+    """Chebyshev coefficients of `func` over [start, end], by interpolating it at the
+    Chebyshev nodes. `func` is given all the nodes at once.
+    """
+    angles = [math.pi * (k + 0.5) / size for k in range(size)]
+    nodes = [start + (math.cos(a) + 1) / 2 * (end - start) for a in angles]
+    values = [float(value) for value in func(nodes)]
+    return tuple(
+        (1 if j == 0 else 2)
+        / size
+        * sum(values[k] * math.cos(j * angles[k]) for k in range(size))
+        for j in range(size)
+    )
 
 
-def _is_super_moon(date: ephem.Date) -> bool:
-    if _is_full_moon(date):
-        moon = _get_moon(date)
-        if moon.earth_distance <= SUPERMOON_DISTANCE_AU:
-            return True
-    return False
+def _chebyshev_eval(coefficients: tuple[float, ...], x: float) -> float:
+    """Evaluate a Chebyshev series at x in [-1, 1] (Clenshaw's algorithm)."""
+    b1 = b2 = 0.0
+    for c in coefficients[:0:-1]:
+        b1, b2 = 2 * x * b1 - b2 + c, b1
+    return x * b1 - b2 + coefficients[0]
 
 
-def _get_moon_phase_text(date: ephem.Date):
-    if _is_super_moon(date):
-        return "Supermoon"
-    if _is_blue_moon(date):
-        return "Blue Moon"
+@dataclass(frozen=True)
+class Lunation:
+    """The moon over one lunation, from one new moon to the next.
 
-    cycle_start, cycle_end = _get_moon_cycle_range(date)
+    The dates of the quarters are exact, and the illuminated fraction and the
+    distance to the earth are Chebyshev series fitted to the lunar model (see
+    `fit_lunation()`), so the moon's phase can be found for any time of the lunation
+    in a few microseconds. Dates are ephem dates, i.e. days since 1899/12/31 12:00
+    UTC.
+    """
 
-    quarter_dates = [
-        cycle_start,
-        ephem.next_first_quarter_moon(cycle_start),
-        ephem.next_full_moon(cycle_start),
-        ephem.next_last_quarter_moon(cycle_start),
-        cycle_end,
-    ]
+    start: float
+    first_quarter: float
+    full: float
+    last_quarter: float
+    end: float
+    previous_full: float
+    """The previous lunation's full moon, to tell blue moons."""
+    phase_coefficients: tuple[float, ...]
+    """Illuminated fraction, in percent."""
+    distance_coefficients: tuple[float, ...]
+    """Distance to the earth, in AU."""
+
+    def __contains__(self, date: float) -> bool:
+        return self.start <= date and round(date, 5) < round(self.end, 5)
+
+    def _x(self, date: float) -> float:
+        return 2 * (date - self.start) / (self.end - self.start) - 1
+
+    def normalized_age(self, date: float) -> float:
+        """0 = new moon, ~1 = close to next new moon"""
+        return ((date - self.start) / (self.end - self.start)) % 1.0
+
+    def phase_percent(self, date: float) -> float:
+        return _chebyshev_eval(self.phase_coefficients, self._x(date))
+
+    def earth_distance(self, date: float) -> float:
+        return _chebyshev_eval(self.distance_coefficients, self._x(date))
+
+    def is_full_moon(self, date: float) -> bool:
+        return _within_a_day(date, self.full)
+
+    def is_blue_moon(self, date: float) -> bool:
+        return (
+            self.is_full_moon(date)
+            and lunar_model.to_datetime(date).month
+            == lunar_model.to_datetime(self.previous_full).month
+        )
 
-    for idx, quarter_date in enumerate(quarter_dates):
-        if _within_a_day(date, quarter_date):
-            return MOON_QUARTERS[idx % 4]
+    def is_super_moon(self, date: float) -> bool:
+        return (
+            self.is_full_moon(date)
+            and self.earth_distance(date) <= SUPERMOON_DISTANCE_AU
+        )
 
-    for idx, quarter_date in enumerate(quarter_dates[1:]):
-        if date < quarter_date:
-            return MOON_PHASES[idx]
+    def phase_text(self, date: float) -> str:
+        if self.is_super_moon(date):
+            return "Supermoon"
+        if self.is_blue_moon(date):
+            return "Blue Moon"
+
+        quarter_dates = [
+            self.start,
+            self.first_quarter,
+            self.full,
+            self.last_quarter,
+            self.end,
+        ]
 
-    return MOON_PHASES[-1]
+        for idx, quarter_date in enumerate(quarter_dates):
+            if _within_a_day(date, quarter_date):
+                return MOON_QUARTERS[idx % 4]
 
+        for idx, quarter_date in enumerate(quarter_dates[1:]):
+            if date < quarter_date:
+                return MOON_PHASES[idx]
 
-def _get_normalized_age(date: ephem.Date):
-    """Get normalized age of the moon for the current lunation.
-    0 = new moon, ~1 = close to next new moon
+        return MOON_PHASES[-1]
+
+
+def _ephem_model() -> types.SimpleNamespace:
+    # ephem is only imported when it's used: importing it is slow on a Pi Zero
+    import ephem
+
+    def moon(attribute: str) -> t.Callable[[list[float]], list[float]]:
+        def get(dates: list[float]) -> list[float]:
+            return [getattr(ephem.Moon(ephem.Date(date)), attribute) for date in dates]
+
+        return get
+
+    return types.SimpleNamespace(
+        previous_new_moon=ephem.previous_new_moon,
+        next_new_moon=ephem.next_new_moon,
+        next_first_quarter_moon=ephem.next_first_quarter_moon,
+        next_full_moon=ephem.next_full_moon,
+        next_last_quarter_moon=ephem.next_last_quarter_moon,
+        previous_full_moon=ephem.previous_full_moon,
+        phase=moon("phase"),
+        earth_distance=moon("earth_distance"),
+    )
+
+
+LUNAR_MODELS: dict[str, t.Callable[[], t.Any]] = {
+    "ephem": _ephem_model,
+    "analytic": lambda: lunar_model,
+}
+"""Ways to compute the moon, for `LUNAR_MODEL`: functions that load a model, with
+ephem's functions to find the phases, and functions that give the moon's illuminated
+percentage and distance (in AU) for a list of dates.
+"""
+
+
+def get_lunar_model(name: t.Optional[str] = None) -> t.Any:
+    name = name or LUNAR_MODEL
+    try:
+        load = LUNAR_MODELS[name]
+    except KeyError:
+        msg = f"Unknown lunar model {name!r}, expected one of {list(LUNAR_MODELS)}"
+        raise ValueError(msg) from None
+    return load()
+
+
+def fit_lunation(date: float, model_name: t.Optional[str] = None) -> Lunation:
+    """Compute the lunation that `date` is in with the given lunar model (by
+    default `LUNAR_MODEL`).
+    """
+    model = get_lunar_model(model_name)
+    cycle_start, cycle_end = _get_moon_cycle_range(date, model)
+    start = lunar_model.to_datetime(cycle_start)
+    logger.info(f"Fitting lunation starting {start:%Y/%m/%d %H:%M:%S} UTC")
+
+    def fit(func: t.Callable[[list[float]], t.Sequence[float]]) -> tuple[float, ...]:
+        return _chebyshev_fit(func, cycle_start, cycle_end, _LUNATION_COEFFICIENTS)
+
+    return Lunation(
+        float(cycle_start),
+        float(model.next_first_quarter_moon(cycle_start)),
+        float(model.next_full_moon(cycle_start)),
+        float(model.next_last_quarter_moon(cycle_start)),
+        float(cycle_end),
+        float(model.previous_full_moon(cycle_start)),
+        fit(model.phase),
+        fit(model.earth_distance),
+    )
+
+
+_LUNATIONS_HEADER = struct.Struct("<5sH")
+_LUNATIONS_MAGIC = b"MPLN1"
+_LUNATION_RECORD = struct.Struct(f"<6d{2 * _LUNATION_COEFFICIENTS}d")
+
+_LUNATIONS_LOCK = threading.Lock()
+"""Held while adding a lunation to those loaded by `_load_lunations()` and saving
+them, which the frame server and the renderer do from several threads.
+"""
+
+
+def _lunations_path(model_name: str) -> Path:
+    return CACHE_DIR / f"lunations-{model_name}.bin"
+
+
+@lru_cache(maxsize=len(LUNAR_MODELS))
+def _load_lunations(lunations_file: Path) -> tuple[list[float], list[Lunation]]:
+    """Load the lunations fitted so far, sorted by start date.
+
+    Returns:
+        The lunations' start dates (for bisecting), and the lunations.
     """
-    cycle_start, cycle_end = _get_moon_cycle_range(date)
-    days_since_new = date - cycle_start
-    logger.debug(f"Moon is {days_since_new:.2f} day(s) since new (as of {date} UTC)")
-    return (days_since_new / (cycle_end - cycle_start)) % 1.0
+    lunations = []
+    try:
+        data = lunations_file.read_bytes()
+    except FileNotFoundError:
+        data = b""
+    if data[: _LUNATIONS_HEADER.size] == _LUNATIONS_HEADER.pack(
+        _LUNATIONS_MAGIC, _LUNATION_COEFFICIENTS
+    ):
+        records = data[_LUNATIONS_HEADER.size :]
+        records = records[: len(records) - len(records) % _LUNATION_RECORD.size]
+        size = _LUNATION_COEFFICIENTS
+        lunations = [
+            Lunation(*values[:6], values[6 : 6 + size], values[6 + size :])
+            for values in _LUNATION_RECORD.iter_unpack(records)
+        ]
+    elif data:
+        logger.info(f"Lunations file {lunations_file} is out of date")
+    lunations.sort(key=lambda lunation: lunation.start)
+    return [lunation.start for lunation in lunations], lunations
+
+
+def _save_lunations(lunations_file: Path, lunations: list[Lunation]) -> None:
+    data = bytearray(_LUNATIONS_HEADER.pack(_LUNATIONS_MAGIC, _LUNATION_COEFFICIENTS))
+    for lunation in lunations:
+        data += _LUNATION_RECORD.pack(
+            lunation.start,
+            lunation.first_quarter,
+            lunation.full,
+            lunation.last_quarter,
+            lunation.end,
+            lunation.previous_full,
+            *lunation.phase_coefficients,
+            *lunation.distance_coefficients,
+        )
+    # saved under another name first, so that it's never read half written
+    temp_file = lunations_file.with_name(
+        f"{lunations_file.name}.{threading.get_ident()}"
+    )
+    try:
+        lunations_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file.write_bytes(data)
+        temp_file.replace(lunations_file)
+    except OSError:
+        logger.exception(f"Unable to save lunations to {lunations_file}")
+
+
+def _find_lunation(
+    starts: list[float], lunations: list[Lunation], date: float
+) -> t.Optional[Lunation]:
+    index = bisect.bisect_right(starts, date) - 1
+    for lunation in lunations[max(index, 0) : index + 2]:
+        if date in lunation:
+            return lunation
+    return None
+
+
+def get_lunation(date: float, model_name: t.Optional[str] = None) -> Lunation:
+    """Get the lunation that `date` is in, as computed by the given lunar model (by
+    default `LUNAR_MODEL`). Each lunation is only computed once, and saved in
+    `CACHE_DIR`.
+    """
+    model_name = model_name or LUNAR_MODEL
+    lunations_file = _lunations_path(model_name)
+    lunation = _find_lunation(*_load_lunations(lunations_file), date)
+    if lunation is not None:
+        return lunation
+
+    with _LUNATIONS_LOCK:
+        # another thread may have fitted it in the meantime
+        starts, lunations = _load_lunations(lunations_file)
+        lunation = _find_lunation(starts, lunations, date)
+        if lunation is not None:
+            return lunation
+        lunation = fit_lunation(date, model_name)
+        index = bisect.bisect_right(starts, lunation.start)
+        starts.insert(index, lunation.start)
+        lunations.insert(index, lunation)
+        _save_lunations(lunations_file, lunations)
+    return lunation
 
 
 def get_moon_phase(dt: arrow.Arrow) -> MoonInfo:
     """Get the moon info for the 24-hour period, centered around the midpoint of the
-    given day.
+    given day, or for the time of `dt` itself with `SUB_DAILY_UPDATES`.
     """
-    middle_of_day = dt.replace(hour=12).floor("hour")
-    date = _arrow_to_ephem(middle_of_day)
-
-    moon = _get_moon(date, LOCATION)
-    text = _get_moon_phase_text(date)
-    normalized_age = _get_normalized_age(date)
-    phase_percent = moon.phase
+    if not SUB_DAILY_UPDATES:
+        dt = dt.replace(hour=12).floor("hour")
+    date = _arrow_to_ephem(dt)
+
+    lunation = get_lunation(date)
+    text = lunation.phase_text(date)
+    normalized_age = lunation.normalized_age(date)
+    phase_percent = lunation.phase_percent(date)
+    logger.debug(
+        f"Moon is {date - lunation.start:.2f} day(s) since new "
+        f"(as of {lunar_model.to_datetime(date):%Y/%m/%d %H:%M:%S} UTC)"
+    )
 
     return MoonInfo(normalized_age, phase_percent, text)
 
 
+# --------------- MOON EVENTS ------------------
+
+
+@dataclass
+class MoonEvents:
+    """Moon events for a day, in the local time zone of that day. Events that don't
+    happen during the day (e.g. the moon doesn't rise) are None.
+    """
+
+    rise: t.Optional[arrow.Arrow]
+    set: t.Optional[arrow.Arrow]
+    transit: t.Optional[arrow.Arrow]
+    nightfall: t.Optional[arrow.Arrow]
+    nightfall_altitude: t.Optional[float]
+    """Altitude of the moon at nightfall, in degrees."""
+
+
+def _ephem_to_arrow(date: float, tzinfo: t.Any) -> arrow.Arrow:
+    return arrow.get(lunar_model.to_datetime(date), tzinfo="UTC").to(tzinfo)
+
+
+def compute_moon_events(
+    day: arrow.Arrow, location: t.Optional[dict[str, t.Any]] = None
+) -> MoonEvents:
+    """Compute the moon events for the given day using ephem's root finders.
+
+    This is slow, especially on a Pi Zero. Use `get_moon_events()` instead, which
+    looks the events up in a table computed a year at a time.
+    """
+    import ephem
+
+    location = location or LOCATION
+    start = day.floor("day")
+    start_date = _arrow_to_ephem(start)
+    end_date = _arrow_to_ephem(start.shift(days=1))
+
+    earth = ephem.Observer()
+    earth.lat = math.radians(location["latitude"])
+    earth.long = math.radians(location["longitude"])
+    moon = ephem.Moon()
+
+    def find(func: t.Callable, body: ephem.Body, **kwargs) -> t.Optional[ephem.Date]:
+        earth.date = start_date
+        try:
+            date = ephem.Date(func(body, **kwargs))
+        except (ephem.AlwaysUpError, ephem.NeverUpError):
+            return None
+        return date if date < end_date else None
+
+    rise = find(earth.next_rising, moon)
+    set_ = find(earth.next_setting, moon)
+    transit = find(earth.next_transit, moon)
+
+    earth.horizon = NIGHTFALL_SUN_ALTITUDE
+    nightfall = find(earth.next_setting, ephem.Sun(), use_center=True)
+    nightfall_altitude = None
+    if nightfall is not None:
+        earth.date = nightfall
+        moon.compute(earth)
+        nightfall_altitude = math.degrees(moon.alt)
+
+    def to_arrow(date: t.Optional[ephem.Date]) -> t.Optional[arrow.Arrow]:
+        return None if date is None else _ephem_to_arrow(date, start.tzinfo)
+
+    return MoonEvents(
+        to_arrow(rise),
+        to_arrow(set_),
+        to_arrow(transit),
+        to_arrow(nightfall),
+        nightfall_altitude,
+    )
+
+
+_MOON_EVENTS_MAGIC = b"MPME1"
+_MOON_EVENTS_HEADER = struct.Struct("<5sddH")
+"""magic, latitude, longitude, year"""
+_MOON_EVENTS_RECORD = struct.Struct("<hHHHHh")
+"""UTC offset of local midnight, then rise, set, transit and nightfall as minutes
+since local midnight, and the altitude at nightfall in hundredths of a degree.
+"""
+_NO_TIME = 0xFFFF
+_NO_ALTITUDE = -0x8000
+
+
+def _utc_offset_minutes(dt: arrow.Arrow) -> int:
+    offset = dt.utcoffset()
+    return int(offset.total_seconds() // 60) if offset else 0
+
+
+def build_moon_events_table(
+    year: int, tzinfo: t.Any, location: t.Optional[dict[str, t.Any]] = None
+) -> bytes:
+    """Compute the moon events for every day of the year, packed into a table with
+    one fixed-size record per day (see `_MOON_EVENTS_RECORD`).
+    """
+    location = location or LOCATION
+    logger.info(f"Computing moon events for {year}")
+    table = bytearray(
+        _MOON_EVENTS_HEADER.pack(
+            _MOON_EVENTS_MAGIC, location["latitude"], location["longitude"], year
+        )
+    )
+    start = arrow.Arrow(year, 1, 1, tzinfo=tzinfo)
+    for day in arrow.Arrow.range("day", start, start.replace(month=12, day=31)):
+        events = compute_moon_events(day, location)
+
+        def minutes(event: t.Optional[arrow.Arrow], day=day) -> int:
+            if event is None:
+                return _NO_TIME
+            return round((event.to("UTC") - day.to("UTC")).total_seconds() / 60)
+
+        altitude = events.nightfall_altitude
+        table += _MOON_EVENTS_RECORD.pack(
+            _utc_offset_minutes(day),
+            minutes(events.rise),
+            minutes(events.set),
+            minutes(events.transit),
+            minutes(events.nightfall),
+            _NO_ALTITUDE if altitude is None else round(altitude * 100),
+        )
+    return bytes(table)
+
+
+def _moon_events_table_path(year: int, location: dict[str, t.Any]) -> Path:
+    lat, lon = location["latitude"], location["longitude"]
+    return CACHE_DIR / "moon-events" / f"{lat:.4f}_{lon:.4f}-{year}.bin"
+
+
+@lru_cache(maxsize=2)
+def _load_moon_events_table(
+    year: int, tzinfo: t.Any, latitude: float, longitude: float
+) -> bytes:
+    """Load the moon events table for the year, building and saving it if needed."""
+    location = {"latitude": latitude, "longitude": longitude}
+    table_file = _moon_events_table_path(year, location)
+    if table_file.exists():
+        table = table_file.read_bytes()
+        header = _MOON_EVENTS_HEADER.unpack_from(table)
+        if header == (_MOON_EVENTS_MAGIC, latitude, longitude, year):
+            # make sure the table was built for the same time zone
+            first_day = arrow.Arrow(year, 1, 1, tzinfo=tzinfo)
+            mid_year = first_day.replace(month=7)
+            offsets = (
+                _MOON_EVENTS_RECORD.unpack_from(table, _moon_events_offset(day))[0]
+                for day in (first_day, mid_year)
+            )
+            if list(offsets) == [
+                _utc_offset_minutes(first_day),
+                _utc_offset_minutes(mid_year),
+            ]:
+                return table
+        logger.info(f"Moon events table {table_file} is out of date")
+
+    table = build_moon_events_table(year, tzinfo, location)
+    try:
+        table_file.parent.mkdir(parents=True, exist_ok=True)
+        table_file.write_bytes(table)
+    except OSError:
+        logger.exception(f"Unable to save moon events table to {table_file}")
+    return table
+
+
+def _moon_events_offset(day: arrow.Arrow) -> int:
+    day_of_year = day.date().timetuple().tm_yday - 1
+    return _MOON_EVENTS_HEADER.size + day_of_year * _MOON_EVENTS_RECORD.size
+
+
+def get_moon_events(
+    dt: arrow.Arrow, location: t.Optional[dict[str, t.Any]] = None
+) -> MoonEvents:
+    """Get the moon events for the day of `dt`, from the table for that year and
+    location (which is computed the first time it's needed).
+    """
+    location = location or LOCATION
+    day = dt.floor("day")
+    table = _load_moon_events_table(
+        day.year, day.tzinfo, location["latitude"], location["longitude"]
+    )
+    _, *minutes, altitude = _MOON_EVENTS_RECORD.unpack_from(
+        table, _moon_events_offset(day)
+    )
+    midnight_utc = day.to("UTC")
+    rise, set_, transit, nightfall = (
+        None if value == _NO_TIME else midnight_utc.shift(minutes=value).to(day.tzinfo)
+        for value in minutes
+    )
+    return MoonEvents(
+        rise,
+        set_,
+        transit,
+        nightfall,
+        None if altitude == _NO_ALTITUDE else altitude / 100,
+    )
+
+
+# --------------- DISPLAY PROFILES -----------------
+
+
+@dataclass(frozen=True)
+class DisplayProfile:
+    """Describes a supported Waveshare e-Paper display."""
+
+    name: str
+    """Name of the display module in the waveshare-epaper package."""
+    width: int
+    height: int
+    """Size of the generated images. Displays that are natively in portrait are
+    still drawn in landscape, and rotated before being sent to the display.
+    """
+    colors: tuple[int, ...]
+    """Colors supported by the display as packed BGR values (as in the waveshare
+    driver), in the order of the color codes the display expects.
+    """
+    bits_per_pixel: int
+    """Bits per pixel in the display's frame buffer, i.e. `epd.getbuffer()`."""
+    margins: tuple[int, int]
+    """Margins for the display, in the form x, y, where x is the left and right
+    margins, and y is the top and bottom margins.
+    This is for cases where the outer edges of the display will not be seen, such
+    as when covered by a picture matte.
+    """
+    moon_size_px: int
+    """Size of the moon image, in pixels."""
+    background_image: Path
+    """Background image. It is resized to the display if needed, but for best
+    results it should be made for the display's size and colors.
+    """
+    portrait: bool = False
+    """Whether the display's native orientation is portrait."""
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return (self.width, self.height)
+
+    @property
+    def native_size(self) -> tuple[int, int]:
+        """Size as reported by the driver, i.e. `(epd.width, epd.height)`."""
+        return (self.height, self.width) if self.portrait else self.size
+
+    @property
+    def buffer_size(self) -> int:
+        """Size of a packed frame buffer, in bytes."""
+        return self.width * self.height * self.bits_per_pixel // 8
+
+    @property
+    def pack_rawmode(self) -> str:
+        """Pillow raw mode that packs palette indices into the display's frame
+        buffer format.
+        """
+        return f"P;{self.bits_per_pixel}"
+
+    @cached_property
+    def tables(self) -> "DisplayTables":
+        return load_display_tables(self)
+
+
+_7_COLORS = (0x000000, 0xFFFFFF, 0x00FF00, 0xFF0000, 0x0000FF, 0x00FFFF, 0x0080FF)
+"""Black, white, green, blue, red, yellow, orange"""
+_6_COLORS = (0x000000, 0xFFFFFF, 0x00FFFF, 0x0000FF, 0x000000, 0xFF0000, 0x00FF00)
+"""Black, white, yellow, red, (unused), blue, green"""
+
+DISPLAY_PROFILES = {
+    profile.name: profile
+    for profile in (
+        DisplayProfile(
+            name="epd7in3f",
+            width=800,
+            height=480,
+            colors=_7_COLORS,
+            bits_per_pixel=4,
+            margins=(51, 18),
+            moon_size_px=400,
+            background_image=IMAGE_DIR / "screen-template-7in3.png",
+        ),
+        DisplayProfile(
+            name="epd7in3e",
+            width=800,
+            height=480,
+            colors=_6_COLORS,
+            bits_per_pixel=4,
+            margins=(51, 18),
+            moon_size_px=400,
+            background_image=IMAGE_DIR / "screen-template-7in3.png",
+        ),
+        DisplayProfile(
+            name="epd5in65f",
+            width=600,
+            height=448,
+            colors=_7_COLORS,
+            bits_per_pixel=4,
+            margins=(24, 12),
+            moon_size_px=360,
+            background_image=IMAGE_DIR / "screen-template-7in3.png",
+        ),
+        DisplayProfile(
+            name="epd13in3e",
+            width=1600,
+            height=1200,
+            colors=_6_COLORS,
+            bits_per_pixel=4,
+            margins=(102, 45),
+            moon_size_px=1000,
+            background_image=IMAGE_DIR / "screen-template-7in3.png",
+            portrait=True,
+        ),
+    )
+}
+"""Supported displays, by name."""
+
+
+def get_display_profile(name: t.Optional[str] = None) -> DisplayProfile:
+    """Get the profile for the given display, or for `WAVESHARE_DISPLAY` if no name
+    is given.
+    """
+    name = name or WAVESHARE_DISPLAY
+    try:
+        return DISPLAY_PROFILES[name]
+    except KeyError:
+        msg = f"unsupported display {name!r}, must be one of {list(DISPLAY_PROFILES)}"
+        raise ValueError(msg) from None
+
+
+_LUT_BITS = 6
+"""Bits per channel used to index the nearest-color lookup table. This matches the
+resolution of the color cache Pillow uses when quantizing to a palette.
+"""
+
+
+@dataclass(frozen=True)
+class DisplayTables:
+    """Data derived from a `DisplayProfile`. This is computed once per profile and
+    saved to `CACHE_DIR`, see `load_display_tables()`.
+    """
+
+    palette: bytes
+    """RGB palette, padded to 256 colors (3 * 256 bytes)."""
+    nearest_lut: bytes
+    """Index of the nearest palette color for each cell of the RGB cube, with
+    `_LUT_BITS` bits per channel (red being the most significant).
+    """
+
+    @cached_property
+    def palette_image(self) -> Image.Image:
+        """A palette image, for `Image.quantize()`"""
+        return _palette_image(self.palette)
+
+    def nearest_index(self, rgb: t.Sequence[int]) -> int:
+        """Get the index of the palette color nearest to the given color, exactly as
+        Pillow picks it when quantizing without dithering.
+        """
+        shift = 8 - _LUT_BITS
+        r, g, b = (v >> shift for v in rgb[:3])
+        return self.nearest_lut[(r << (2 * _LUT_BITS)) | (g << _LUT_BITS) | b]
+
+
+def _compute_nearest_lut(palette: bytes) -> bytes:
+    """Compute the nearest-color LUT for the given palette, by letting Pillow
+    quantize one color from each LUT cell.
+    """
+    levels = 1 << _LUT_BITS
+    shift = 8 - _LUT_BITS
+    cells = bytes(
+        channel << shift
+        for r in range(levels)
+        for g in range(levels)
+        for b in range(levels)
+        for channel in (r, g, b)
+    )
+    cube = Image.frombytes("RGB", (levels * levels, levels), cells)
+    lut = cube.quantize(palette=_palette_image(palette), dither=Image.Dither.NONE)
+    return lut.tobytes()
+
+
+def _profile_palette(profile: DisplayProfile) -> bytes:
+    """RGB palette for the profile, padded to 256 colors with the first color."""
+    rgb_colors = [_packed_bgr_to_rgb(color) for color in profile.colors]
+    padding = rgb_colors[0] * (256 - len(rgb_colors))
+    return bytes([v for color in rgb_colors for v in color]) + bytes(padding)
+
+
+_DISPLAY_TABLES_MAGIC = b"MPDT1"
+
+
+def load_display_tables(profile: DisplayProfile) -> DisplayTables:
+    """Load the derived data for the given profile from `CACHE_DIR`, computing and
+    saving it first if needed.
+    """
+    palette = _profile_palette(profile)
+    digest = hashlib.blake2b(palette, digest_size=8).hexdigest()
+    cache_file = CACHE_DIR / "displays" / f"{profile.name}-{digest}.bin"
+    lut_size = 1 << (3 * _LUT_BITS)
+    header = _DISPLAY_TABLES_MAGIC + palette
+
+    if cache_file.exists():
+        data = cache_file.read_bytes()
+        if len(data) == len(header) + lut_size and data.startswith(header):
+            return DisplayTables(palette, data[len(header) :])
+        logger.warning(f"Ignoring invalid display tables in {cache_file}")
+
+    logger.info(f"Computing display tables for {profile.name}")
+    tables = DisplayTables(palette, _compute_nearest_lut(palette))
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        cache_file.write_bytes(header + tables.nearest_lut)
+    except OSError:
+        logger.exception(f"Unable to save display tables to {cache_file}")
+    return tables
+
+
 # --------------- IMAGES -----------------
 
 
+@lru_cache(maxsize=1)
+def _moon_images(moon_dir: Path) -> list[Path]:
+    return sorted(moon_dir.glob("*.png"))
+
+
 def get_moon_img_path(normalized_age: float, moon_phase_text: str) -> Path:
     moon_dir = IMAGE_DIR / "moon"
+    moon_files = _moon_images(moon_dir)
     if moon_phase_text in MOON_QUARTERS:
         postfix = moon_phase_text.lower().replace(" ", "-")
-        return next(moon_dir.glob(f"*-{postfix}.png"))
+        return next(
+            path for path in moon_files if path.name.endswith(f"-{postfix}.png")
+        )
 
-    moon_files = sorted(moon_dir.glob("*.png"))
     total_files = len(moon_files)
 
     idx = round(normalized_age * total_files) % total_files
@@ -386,8 +1141,17 @@ def patch_epd7in3f(epd):
 @lru_cache
 def get_epd():
     epd = epaper.epaper(WAVESHARE_DISPLAY).EPD()
+    profile = get_display_profile()
+    if (epd.width, epd.height) != profile.native_size:
+        msg = f"{WAVESHARE_DISPLAY} is {epd.width}x{epd.height}, but its profile is {profile.native_size}"
+        raise ValueError(msg)
     if WAVESHARE_DISPLAY == "epd7in3f":
         patch_epd7in3f(epd)
+    if hasattr(type(epd), "ReadBusyH"):
+        epdconfig = epaper.epaper(WAVESHARE_DISPLAY).epdconfig
+        busy_line = epd_busy.busy_line_from_epdconfig(epdconfig, epd.busy_pin)
+        epd_busy.install(epd, epd_busy.BusyWaiter(busy_line, EPD_BUSY_TIMEOUT))
+        logger.info(f"Waiting for the display with {type(busy_line).__name__}")
     logger.info(f"Created display: {epd}")
     logger.info(f"Display {WAVESHARE_DISPLAY} width: {epd.width}, height: {epd.height}")
     logger.info("Initializing display")
@@ -396,6 +1160,25 @@ def get_epd():
     return epd
 
 
+@lru_cache(maxsize=1)
+def get_frame_writer() -> frame_export.FrameWriter:
+    """Get the writer for frames shown without an e-Paper display, as set up by
+    `HEADLESS_EXPORT_FORMAT` and `HEADLESS_EXPORT_PATH`.
+    """
+    exporter = frame_export.get_exporter(
+        HEADLESS_EXPORT_FORMAT, HEADLESS_PNG_COMPRESS_LEVEL
+    )
+    if HEADLESS_EXPORT_PATH == "-":
+        return frame_export.FrameWriter(exporter, stream=sys.stdout.buffer)
+    path = HEADLESS_EXPORT_PATH or BASE_DIR / f"test-img{exporter.suffix}"
+    return frame_export.FrameWriter(exporter, path)
+
+
+def export_frame(image: Image.Image) -> None:
+    """Export a frame shown without an e-Paper display, in the background."""
+    get_frame_writer().write(image)
+
+
 def epd_clear(epd) -> None:
     """Clear the display."""
     logger.info("Clearing display...")
@@ -408,11 +1191,15 @@ def epd_sleep(epd) -> None:
     logger.info("Putting display to sleep...")
     epd.sleep()  # sends sleep command and calls epdconfig.module_exit()
     logger.info("Display is asleep")
+    waiter = epd_busy.get_waiter(epd)
+    if waiter is not None:
+        logger.info(waiter.summary())
 
 
-def epd_update_image(epd, image: Image.Image) -> None:
+def epd_update_image(epd, image: Image.Image, clear: bool = True) -> None:
     """Display the image on the e-Paper display, including
-    clearing the screen beforehand and putting the display to sleep afterwards.
+    clearing the screen beforehand (unless `clear` is False) and putting the display
+    to sleep afterwards.
 
     Note that if you don't pre-convert the image to the display's color palette,
     it will be done automatically. For more control over the conversion, you may
@@ -420,34 +1207,89 @@ def epd_update_image(epd, image: Image.Image) -> None:
     See `paletize_image()`.
     """
     palette = epd_get_palette(epd)
-    image = paletize_image(image, palette, dither=False)
+    if image.mode != "P" or image.getpalette() != palette:
+        image = paletize_image(image, palette, dither=False)
+
+    epd_buf = epd_getbuffer(epd, image)
+    epd_display_buffer(epd, epd_buf, clear)
+
 
-    epd_clear(epd)
-    epd_buf = epd.getbuffer(image)
+def epd_display_buffer(
+    epd, epd_buf: t.Union[bytes, bytearray], clear: bool = True
+) -> None:
+    """Send an already packed frame buffer (see `epd_getbuffer()`) to the display,
+    clearing the screen beforehand (unless `clear` is False) and putting the display
+    to sleep afterwards.
+    """
+    if clear:
+        epd_clear(epd)
     logger.info("Displaying image...")
     epd.display(epd_buf)
     logger.info("Display updated")
     epd_sleep(epd)
+    if FRAME_ARCHIVE_DIR:
+        archive_frame(epd_buf)
+
+
+def epd_getbuffer(epd, image: Image.Image) -> t.Union[bytes, bytearray]:
+    """Convert a paletized image to the buffer format expected by `epd.display()`.
+
+    The color displays take 4 bits per pixel, where each pixel is its index in the
+    palette returned by `epd_get_palette()`. The driver's own `getbuffer()` packs
+    these in a Python loop, which takes several seconds on a Pi Zero, so when the
+    image is already paletized, the packing is done by Pillow instead.
+    """
+    profile = epd_profile(epd)
+    if image.mode == "P" and image.size == profile.size:
+        return epd_pack_image(image, profile)
+    return epd.getbuffer(image)
+
+
+def epd_pack_image(
+    image: Image.Image, profile: t.Optional[DisplayProfile] = None
+) -> bytes:
+    """Pack a "P" mode image into the display's frame buffer format, i.e.
+    `profile.bits_per_pixel` bits per pixel, leftmost pixel in the high bits.
+    """
+    profile = profile or get_display_profile()
+    if profile.portrait:
+        image = image.rotate(90, expand=True)
+    return image.tobytes("raw", profile.pack_rawmode)
+
+
+def epd_unpack_image(
+    buf: t.Union[bytes, bytearray], profile: t.Optional[DisplayProfile] = None
+) -> Image.Image:
+    """Inverse of `epd_pack_image()`. The result has no palette attached."""
+    profile = profile or get_display_profile()
+    image = Image.frombytes(
+        "P", profile.native_size, bytes(buf), "raw", profile.pack_rawmode
+    )
+    if profile.portrait:
+        image = image.rotate(-90, expand=True)
+    return image
+
+
+def epd_profile(epd) -> DisplayProfile:
+    """Get the profile in `DISPLAY_PROFILES` of a display object (see `get_epd()`).
+
+    Waveshare's driver modules are named after their display (e.g.
+    `waveshare_epd.epd7in3f`), and the emulated and mock displays know which display
+    they stand in for.
+    """
+    if isinstance(epd, MockEpaperDisplay):
+        return get_display_profile(epd.name)
+    if isinstance(epd, epd_emulator.EPD):
+        return get_display_profile(epd.spec.name)
+    return get_display_profile(type(epd).__module__.rpartition(".")[2])
 
 
 def epd_get_palette(epd) -> list[int]:
-    """Get the RGB color palette for the e-Paper display based on its capabilities.
-    The resulting palette will be padded to 256 colors, for a total length of
-    3 * 256.
-    """
-    colors = ("BLACK", "WHITE", "GREEN", "BLUE", "RED", "YELLOW", "ORANGE")
-    bgr_palette = [
-        _packed_bgr_to_rgb(getattr(epd, color))
-        for color in colors
-        if hasattr(epd, color)
-    ]
-    default_color = bgr_palette[0]
-    values_per_swatch = len(default_color)
-    palette_256 = list(default_color) * 256
-    for swatch_num, color in enumerate(bgr_palette):
-        idx = values_per_swatch * swatch_num
-        palette_256[idx : idx + values_per_swatch] = color
-    return palette_256
+    """Get the RGB color palette for the e-Paper display, from its profile in
+    `DISPLAY_PROFILES`. The resulting palette will be padded to 256 colors, for a
+    total length of 3 * 256.
+    """
+    return list(epd_profile(epd).tables.palette)
 
 
 def _packed_bgr_to_rgb(val: int) -> tuple[int, ...]:
@@ -465,8 +1307,7 @@ def paletize_image(
     """
 
     # Create a palette with the colors supported by the panel
-    pal_image = Image.new("P", (1, 1))
-    pal_image.putpalette(palette)
+    pal_image = _palette_image(bytes(palette))
 
     # Convert the soruce image to the display colors with no dither
     image_paletized = img.convert("RGB").quantize(
@@ -476,6 +1317,13 @@ def paletize_image(
     return image_paletized
 
 
+@lru_cache(maxsize=8)
+def _palette_image(palette: bytes) -> Image.Image:
+    pal_image = Image.new("P", (1, 1))
+    pal_image.putpalette(palette)
+    return pal_image
+
+
 def get_font(name: str, size=None) -> ImageFont.FreeTypeFont:
     font_file, default_size = FONTS[name]
     font_path = FONT_DIR / font_file
@@ -487,6 +1335,24 @@ def get_font(name: str, size=None) -> ImageFont.FreeTypeFont:
     return ImageFont.truetype(str(FONT_DIR / font_file), size if size else default_size)
 
 
+class _ThreadFonts(threading.local):
+    def __init__(self):
+        self.fonts: dict[tuple[str, t.Optional[int]], ImageFont.FreeTypeFont] = {}
+
+
+_thread_fonts = _ThreadFonts()
+
+
+def _get_cached_font(name: str, size: t.Optional[int]) -> ImageFont.FreeTypeFont:
+    """Same as `get_font()`, but each font is only loaded once per thread, as fonts
+    can't be used by several threads at once.
+    """
+    font = _thread_fonts.fonts.get((name, size))
+    if font is None:
+        font = _thread_fonts.fonts[(name, size)] = get_font(name, size)
+    return font
+
+
 @dataclass
 class ImageSettings:
     now: arrow.Arrow
@@ -496,20 +1362,89 @@ class ImageSettings:
     moon: MoonInfo
     battery_charge_percent: t.Optional[float]
     output_palette: t.Iterable[int]
+    profile: DisplayProfile = field(default_factory=get_display_profile)
+    moon_events: t.Optional[MoonEvents] = None
+
+
+@dataclass
+class Layer:
+    """Something drawn on top of the base layer (see `ImageBuilder.get_layers()`).
+
+    Layers are kept apart from the image they're drawn on, so that they can be drawn
+    on the whole image, or on one band of it at a time (see `render_banded()`).
+    """
+
+    box: tuple[int, int, int, int]
+    """Region of the image covered by the layer, as (left, top, right, bottom)."""
+    mask: t.Optional[Image.Image] = None
+    color_index: t.Optional[int] = None
+    """If set, the layer is this palette index wherever `mask` is set."""
+    draw_rgb: t.Optional[t.Callable[[Image.Image], None]] = None
+    """Otherwise, function that draws the layer on its region of the image, in "RGB"
+    mode. The region is then paletized again.
+    """
+
+    @property
+    def height(self) -> int:
+        return self.box[3] - self.box[1]
+
+    @property
+    def rgb_bytes(self) -> int:
+        """Memory needed to draw the layer: the "RGB" region and its paletized copy."""
+        if self.draw_rgb is None:
+            return 0
+        return (self.box[2] - self.box[0]) * self.height * 5
+
+    def apply(
+        self, image: Image.Image, palette: bytes, origin: tuple[int, int] = (0, 0)
+    ):
+        """Draw the layer on a paletized image, whose top left corner is at `origin`
+        in the full image. Whatever falls outside of the image is clipped.
+        """
+        left, top = self.box[0] - origin[0], self.box[1] - origin[1]
+        if self.draw_rgb is None:
+            image.paste(self.color_index, (left, top), self.mask)
+            return
+        box = (left, top, left + self.box[2] - self.box[0], top + self.height)
+        region = image.crop(box).convert("RGB")
+        self.draw_rgb(region)
+        image.paste(paletize_image(region, palette, dither=False), box[:2])
 
 
 class ImageBuilder:
-    def __init__(self, settings: ImageSettings):
-        self.settings = settings
+    """Builds the image for the display.
 
-        # Note that you will need to create your own images and possibly change the image directory below
-        logger.info("Opening background image file")
-        self.bg_image = load_image(BACKGROUND_IMAGE)
+    The image is composed directly in the display's palette: the background and moon
+    are dithered once and cached (see `_load_base_layer()`), and each text or icon
+    is drawn on top as a layer, so that only the layers that change need to be
+    redrawn, and there is no need to quantize the whole image again at the end.
+
+    Args:
+        load_base_layer: function that gets the base layer, with the same arguments
+            as `_load_base_layer()` (the default).
+    """
+
+    def __init__(
+        self,
+        settings: ImageSettings,
+        load_base_layer: t.Optional[t.Callable[..., Image.Image]] = None,
+    ):
+        self.settings = settings
+        self.profile = settings.profile
+        self.palette = bytes(settings.output_palette)
+        self.load_base_layer = load_base_layer or _load_base_layer
 
     def build(self):
         image = self.generate_base_image()
+        for layer in self.get_layers():
+            layer.apply(image, self.palette)
+        return image
 
-        self.add_image_text(image)
+    def get_layers(self) -> list[Layer]:
+        """Get the layers to draw on top of the base layer, in order."""
+        layers = self.get_text_layers()
+        if self.settings.moon_events is not None:
+            layers += self.get_moon_events_layers()
 
         # Draw battery low indicator (if applicable)
         battery_charge_percent = self.settings.battery_charge_percent
@@ -518,14 +1453,9 @@ class ImageBuilder:
                 logger.info(f"Battery level is {battery_charge_percent:.1f}%.")
             else:
                 logger.warning(f"Battery low ({battery_charge_percent:.1f}%).")
-                self.add_image_battery_indicator(image)
+                layers.append(self.get_battery_indicator_layer())
 
-        image = paletize_image(
-            image,
-            self.settings.output_palette,
-            dither=False,  # don't dither fonts or battery indicator
-        )
-        return image
+        return layers
 
     @property
     def x_center(self):
@@ -537,11 +1467,11 @@ class ImageBuilder:
 
     @property
     def x_margin(self):
-        return DISPLAY_MARGINS[0]
+        return self.profile.margins[0]
 
     @property
     def y_margin(self):
-        return DISPLAY_MARGINS[1]
+        return self.profile.margins[1]
 
     @property
     def left(self):
@@ -549,7 +1479,7 @@ class ImageBuilder:
 
     @property
     def right(self):
-        return self.bg_image.width - self.x_margin
+        return self.profile.width - self.x_margin
 
     @property
     def top(self):
@@ -557,79 +1487,293 @@ class ImageBuilder:
 
     @property
     def bottom(self):
-        return self.bg_image.height - self.y_margin
+        return self.profile.height - self.y_margin
+
+    @property
+    def moon_img_path(self) -> Path:
+        return get_moon_img_path(
+            self.settings.moon.normalized_age, self.settings.moon.text
+        )
+
+    @property
+    def moon_coords(self) -> tuple[int, int]:
+        moon_size = self.profile.moon_size_px
+        return (
+            self.x_center - int(moon_size / 2),
+            self.y_center - int(moon_size / 2) + 20,
+        )
 
     def generate_base_image(self):
         """Generate image containing background and moon (no text)
 
-        The result will be reduced to the given output palette and dithered, but it
-        will be in "RGB" mode(i.e., not "P" mode) for further processing.
+        The result is reduced to the given output palette and dithered, in "P" mode.
         """
-        # Draw moon
-        normalized_age = self.settings.moon.normalized_age
-        text = self.settings.moon.text
-        moon_img_size = (MOON_SIZE_PX, MOON_SIZE_PX)
-        moon_img = load_image(get_moon_img_path(normalized_age, text))
-        moon_img = moon_img.resize(moon_img_size)
-        moon_coords = (
-            self.x_center - int(moon_img.width / 2),
-            self.y_center - int(moon_img.height / 2) + 20,
+        base_layer = self.load_base_layer(
+            self.profile, self.palette, self.moon_img_path, self.moon_coords
         )
+        return base_layer.copy()
 
-        image = self.bg_image.copy()
-        image.paste(moon_img, moon_coords, moon_img)
-
-        image = paletize_image(image, self.settings.output_palette, dither=True)
-        return image.convert("RGB")
-
-    def add_image_text(self, image: Image.Image):
-        quotation_font = get_font("quote", self.settings.font_size)
-        credit_font = get_font("credit")
-        date_and_phase_font = get_font("date_and_phase")
+    def base_layer_file(self) -> Path:
+        """Get a file with the pixels of the base layer, one palette index per byte,
+        so that it can be read a few rows at a time. It's made from the base layer
+        the first time it's needed.
+        """
+        args = (self.profile, self.palette, self.moon_img_path, self.moon_coords)
+        raw_file = _base_layer_cache_file(*args).with_suffix(".raw")
+        if not raw_file.exists() or raw_file.stat().st_size != (
+            self.profile.width * self.profile.height
+        ):
+            logger.info(f"Saving raw base layer to {raw_file}")
+            # bypass the in-memory cache, to not keep the whole frame around
+            base_layer = _load_base_layer.__wrapped__(*args)
+            raw_file.parent.mkdir(parents=True, exist_ok=True)
+            raw_file.write_bytes(base_layer.tobytes())
+        return raw_file
+
+    def text_layer(
+        self,
+        xy: tuple[int, int],
+        text: str,
+        font_name: str,
+        font_size: t.Optional[int] = None,
+        fill: int = 0,
+        **kwargs,
+    ) -> Layer:
+        """Make a layer with text. Drawing it on a paletized image gives the same
+        result as drawing the text with `ImageDraw.text()` on the image in "RGB"
+        mode and paletizing it again.
+
+        Args:
+            fill: color, as a packed BGR value.
+            kwargs: passed on to `ImageDraw.text()`.
+        """
+        fontmode = "L" if FONT_ANTIALIASING else "1"
+        position, mask = _text_layer(
+            text, font_name, font_size, xy, fontmode, tuple(sorted(kwargs.items()))
+        )
+        color = _packed_bgr_to_rgb(fill)
+        box = (*position, position[0] + mask.width, position[1] + mask.height)
+        if fontmode == "1" and self.palette == self.profile.tables.palette:
+            # Without antialiasing, all the text's pixels are the same palette color
+            return Layer(box, mask, self.profile.tables.nearest_index(color))
+        return self.rgb_layer(box, lambda region: region.paste(color, (0, 0), mask))
+
+    def rgb_layer(
+        self,
+        box: tuple[int, int, int, int],
+        draw: t.Callable[[Image.Image], None],
+    ) -> Layer:
+        """Make a layer that is drawn in "RGB" mode, for layers that aren't made of
+        palette colors (e.g. antialiased text, or an icon).
+
+        Args:
+            box: region of the image, as (left, top, right, bottom).
+            draw: function that draws on the region, which will be an "RGB" image
+                the size of the box.
+        """
+        return Layer(box, draw_rgb=draw)
 
+    def get_text_layers(self) -> list[Layer]:
         # Grabs today's date and formats it for display
         date_to_show = self.settings.now.strftime("%A, %B %-d")
 
-        draw = ImageDraw.Draw(image)
-        draw.fontmode = "L" if FONT_ANTIALIASING else "1"
         # Draw quote and credit
-        draw.text(
-            (self.x_center, self.top + 5),
-            self.settings.quotation_text,
-            font=quotation_font,
-            fill=0,
-            anchor="mt",
-        )
-        if self.settings.credit_text:
-            draw.text(
-                (self.right - 5, self.top + 40),
-                f"\N{HORIZONTAL BAR} {self.settings.credit_text}",
-                font=credit_font,
+        layers = [
+            self.text_layer(
+                (self.x_center, self.top + 5),
+                self.settings.quotation_text,
+                "quote",
+                self.settings.font_size,
                 fill=0,
-                anchor="rm",
+                anchor="mt",
+            )
+        ]
+        if self.settings.credit_text:
+            layers.append(
+                self.text_layer(
+                    (self.right - 5, self.top + 40),
+                    f"\N{HORIZONTAL BAR} {self.settings.credit_text}",
+                    "credit",
+                    fill=0,
+                    anchor="rm",
+                )
             )
 
         # Draw date
-        draw.text(
-            (self.left + 10, self.bottom - 38),
-            date_to_show,
-            font=date_and_phase_font,
-            fill=WHITE,
-            anchor="lt",
+        layers.append(
+            self.text_layer(
+                (self.left + 10, self.bottom - 38),
+                date_to_show,
+                "date_and_phase",
+                fill=WHITE,
+                anchor="lt",
+            )
         )
         # Draw moon phase
-        draw.text(
-            (self.right - 10, self.bottom - 38),
-            self.settings.moon.text,
-            font=date_and_phase_font,
-            fill=WHITE,
-            anchor="rt",
+        layers.append(
+            self.text_layer(
+                (self.right - 10, self.bottom - 38),
+                self.settings.moon.text,
+                "date_and_phase",
+                fill=WHITE,
+                anchor="rt",
+            )
+        )
+        return layers
+
+    def get_moon_events_layers(self) -> list[Layer]:
+        events = self.settings.moon_events
+        assert events is not None
+
+        def time_text(event: t.Optional[arrow.Arrow]) -> str:
+            return event.strftime("%-I:%M %p") if event else "\N{EM DASH}"
+
+        altitude = events.nightfall_altitude
+        altitude_text = (
+            "\N{EM DASH}" if altitude is None else f"{altitude:.0f}\N{DEGREE SIGN}"
+        )
+
+        # Draw rise/set above the date, and transit/altitude above the moon phase
+        return [
+            self.text_layer(
+                (self.left + 10, self.bottom - 44),
+                f"Moonrise {time_text(events.rise)}\nMoonset {time_text(events.set)}",
+                "credit",
+                fill=WHITE,
+                anchor="ld",
+            ),
+            self.text_layer(
+                (self.right - 10, self.bottom - 44),
+                f"Transit {time_text(events.transit)}\n"
+                f"Altitude at dusk {altitude_text}",
+                "credit",
+                fill=WHITE,
+                anchor="rd",
+                align="right",
+            ),
+        ]
+
+    def get_battery_indicator_layer(self) -> Layer:
+        battery_img = _load_battery_indicator()
+        left, top = (self.left + 10, self.top + 64)
+        box = (left, top, left + battery_img.width, top + battery_img.height)
+        return self.rgb_layer(
+            box, lambda region: region.paste(battery_img, (0, 0), battery_img)
         )
 
-    def add_image_battery_indicator(self, image: Image.Image):
-        battery_img = load_image(BATTERY_INDICATOR_IMAGE)
-        coords = (self.left + 10, self.top + 64)
-        image.paste(battery_img, coords, battery_img)
+
+@lru_cache(maxsize=2)
+def _load_background(profile: DisplayProfile) -> Image.Image:
+    # Note that you will need to create your own images and possibly change the image directory below
+    logger.info("Opening background image file")
+    bg_image = load_image(profile.background_image)
+    if bg_image.size != profile.size:
+        bg_image = bg_image.resize(profile.size, Image.Resampling.NEAREST)
+    bg_image.load()  # so that it can be shared between threads
+    return bg_image
+
+
+@lru_cache(maxsize=1)
+def _load_battery_indicator() -> Image.Image:
+    battery_img = load_image(BATTERY_INDICATOR_IMAGE)
+    battery_img.load()
+    return battery_img
+
+
+@lru_cache(maxsize=4)
+def _load_base_layer(
+    profile: DisplayProfile,
+    palette: bytes,
+    moon_img_path: Path,
+    moon_coords: tuple[int, int],
+) -> Image.Image:
+    """Get the background with the moon pasted on top, dithered to the palette.
+
+    There are only a few dozen moon images, so these are saved in `CACHE_DIR` and
+    only need to be dithered once.
+    """
+    cache_file = _base_layer_cache_file(profile, palette, moon_img_path, moon_coords)
+    if cache_file.exists():
+        with Image.open(cache_file) as image:
+            image.load()
+        if image.mode == "P" and image.size == profile.size:
+            return image
+        logger.warning(f"Ignoring invalid base layer {cache_file}")
+
+    # Draw moon
+    moon_img_size = (profile.moon_size_px, profile.moon_size_px)
+    moon_img = load_image(moon_img_path)
+    moon_img = moon_img.resize(moon_img_size)
+
+    image = _load_background(profile).copy()
+    image.paste(moon_img, moon_coords, moon_img)
+    image = paletize_image(image, palette, dither=True)
+
+    # saved under another name first, so that it's never read half written
+    temp_file = cache_file.with_name(f"{cache_file.name}.{threading.get_ident()}")
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        image.save(temp_file, "PNG", compress_level=1)
+        temp_file.replace(cache_file)
+    except OSError:
+        logger.exception(f"Unable to save base layer to {cache_file}")
+    return image
+
+
+def _base_layer_cache_file(
+    profile: DisplayProfile,
+    palette: bytes,
+    moon_img_path: Path,
+    moon_coords: tuple[int, int],
+) -> Path:
+    key = repr(
+        (
+            profile.size,
+            profile.background_image.name,
+            profile.moon_size_px,
+            moon_img_path.name,
+            moon_coords,
+        )
+    )
+    digest = hashlib.blake2b(key.encode() + palette, digest_size=8).hexdigest()
+    return CACHE_DIR / "base-layers" / f"{profile.name}-{digest}.png"
+
+
+_TEXT_PADDING = 2
+"""Extra pixels around text layers, in case glyphs reach outside the text's bounding
+box.
+"""
+
+
+@lru_cache(maxsize=32)
+def _text_layer(
+    text: str,
+    font_name: str,
+    font_size: t.Optional[int],
+    xy: tuple[int, int],
+    fontmode: str,
+    options: tuple[tuple[str, t.Any], ...],
+) -> tuple[tuple[int, int], Image.Image]:
+    """Rasterize text into a mask, as `ImageDraw.text()` would draw it.
+
+    Returns:
+        The position of the mask's top left corner, and the mask.
+    """
+    font = _get_cached_font(font_name, font_size)
+    mask_mode = "1" if fontmode == "1" else "L"
+    draw = ImageDraw.Draw(Image.new(mask_mode, (1, 1)))
+    draw.fontmode = fontmode
+    left, top, right, bottom = draw.textbbox(xy, text, font=font, **dict(options))
+    left = math.floor(left) - _TEXT_PADDING
+    top = math.floor(top) - _TEXT_PADDING
+    width = math.ceil(right) + _TEXT_PADDING - left
+    height = math.ceil(bottom) + _TEXT_PADDING - top
+
+    mask = Image.new(mask_mode, (width, height))
+    draw = ImageDraw.Draw(mask)
+    draw.fontmode = fontmode
+    draw.text((xy[0] - left, xy[1] - top), text, font=font, fill=255, **dict(options))
+    return (left, top), mask
 
 
 def generate_image(
@@ -640,6 +1784,8 @@ def generate_image(
     moon_info: MoonInfo,
     battery_charge_percent: t.Optional[float],
     output_palette: t.Iterable[int],
+    profile: t.Optional[DisplayProfile] = None,
+    moon_events: t.Optional[MoonEvents] = None,
 ) -> Image.Image:
     settings = ImageSettings(
         now,
@@ -649,10 +1795,187 @@ def generate_image(
         moon_info,
         battery_charge_percent,
         output_palette,
+        profile or get_display_profile(),
+        moon_events,
     )
+    return get_renderer().render(settings)
+
+
+class Renderer:
+    """Renders frames over and over, e.g. for previews or for a frame server.
+
+    What doesn't change from one frame to the next is only loaded once: the
+    display's palette tables, the background, the icons and the fonts (once per
+    thread), and the base layer for each moon image, which is kept in memory. It can
+    be used from several threads at once, and Pillow releases the GIL for most of
+    the drawing.
+
+    Usage:
+
+        renderer = Renderer()
+        image = renderer.render(settings)
+        for frame in renderer.render_many(all_settings, pack=True):
+            ...
+
+    Args:
+        profile: display whose assets are loaded right away (by default
+            `WAVESHARE_DISPLAY`). Frames for other displays can still be rendered.
+    """
+
+    def __init__(self, profile: t.Optional[DisplayProfile] = None):
+        profile = profile or get_display_profile()
+        profile.tables  # noqa: B018
+        _load_background(profile)
+        _load_battery_indicator()
+        for name, (_, size) in FONTS.items():
+            _get_cached_font(name, size)
+        self._base_layers: dict[tuple, Image.Image] = {}
+        self._base_layer_locks: dict[tuple, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _load_base_layer(self, *args) -> Image.Image:
+        """Thread-safe `_load_base_layer()`, without a limit on the cache size. Each
+        base layer is only made once, even when several threads need it at once.
+        """
+        base_layer = self._base_layers.get(args)
+        if base_layer is not None:
+            return base_layer
+        with self._lock:
+            lock = self._base_layer_locks.setdefault(args, threading.Lock())
+        with lock:
+            base_layer = self._base_layers.get(args)
+            if base_layer is None:
+                base_layer = _load_base_layer.__wrapped__(*args)
+                self._base_layers[args] = base_layer
+        return base_layer
+
+    def render(
+        self, settings: ImageSettings, pack: bool = False
+    ) -> t.Union[Image.Image, bytes]:
+        """Render the image for `settings`, in "P" mode, or packed into the display's
+        frame buffer format if `pack` is True.
+        """
+        image = ImageBuilder(settings, self._load_base_layer).build()
+        if pack:
+            return epd_pack_image(image, settings.profile)
+        return image
+
+    def render_many(
+        self,
+        settings: t.Iterable[ImageSettings],
+        threads: t.Optional[int] = None,
+        pack: bool = False,
+    ) -> t.Iterator[t.Union[Image.Image, bytes]]:
+        """Render the frames for each of `settings` on `threads` threads (by default
+        one per CPU), and yield them in order. Only a few frames are rendered ahead
+        of the one yielded, so `settings` may be a long iterator.
+        """
+        threads = threads or os.cpu_count() or 1
+        pending: collections.deque[Future] = collections.deque()
+        with ThreadPoolExecutor(threads) as executor:
+            for frame_settings in settings:
+                pending.append(executor.submit(self.render, frame_settings, pack))
+                if len(pending) >= 2 * threads:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+
+@lru_cache(maxsize=1)
+def get_renderer() -> Renderer:
+    """Get the renderer shared by `generate_image()` and `render_frame_buffer()`."""
+    return Renderer()
+
+
+_ENCODER_BUFFER_BYTES = 65536
+"""`Image.tobytes()` encodes into chunks of at least this size."""
+
+
+def band_height(profile: DisplayProfile, budget: int, reserved: int = 0) -> int:
+    """Number of image rows per band for `render_banded()` to stay within `budget`
+    bytes, of which `reserved` are needed for drawing layers.
+    """
+    reserved += max(_ENCODER_BUFFER_BYTES, max(profile.size) * 4)
+    bytes_per_pixel = profile.bits_per_pixel / 8
+    # rows read from the base layer file, the band image, and the packed band
+    row_bytes = profile.width * (2 + bytes_per_pixel)
+    # portrait displays also need the band rotated, and packed again
+    row_bytes += profile.width * (1 + bytes_per_pixel) if profile.portrait else 0
+    rows = int((budget - reserved) // row_bytes)
+    if profile.portrait:
+        # each band has to be a whole number of bytes of the display's native rows
+        rows -= rows % (8 // math.gcd(8, profile.bits_per_pixel))
+    if rows < 1:
+        msg = f"memory budget of {budget} bytes is too small for {profile.name}"
+        raise ValueError(msg)
+    return rows
+
+
+def render_banded(
+    settings: ImageSettings,
+    budget: int,
+    out: t.Optional[bytearray] = None,
+) -> bytearray:
+    """Render the frame straight into the display's frame buffer, one horizontal
+    band at a time, so that the whole image is never in memory.
+
+    Each band goes through the same steps as a whole image: its rows of the base
+    layer are read from a file (see `ImageBuilder.base_layer_file()`), the layers
+    that overlap it are drawn on it, and it's packed into the frame buffer. The
+    result is the same as `epd_pack_image(ImageBuilder(settings).build())`.
+
+    Args:
+        budget: maximum memory used for rendering, in bytes, not counting the frame
+            buffer and the text masks. Note that the base layer is dithered as a
+            whole the first time it's needed, before the budget applies.
+        out: frame buffer to render into, e.g. to reuse it for every frame.
+    """
+    profile = settings.profile
+    width, height = profile.size
+    bits_per_pixel = profile.bits_per_pixel
+    frame_bytes = width * height * bits_per_pixel // 8
+    if out is None:
+        out = bytearray(frame_bytes)
+    elif len(out) != frame_bytes:
+        msg = f"frame buffer is {len(out)} bytes, expected {frame_bytes}"
+        raise ValueError(msg)
+
     builder = ImageBuilder(settings)
-    image = builder.build()
-    return image
+    layers = builder.get_layers()
+    base_layer_file = builder.base_layer_file()
+    rows = band_height(profile, budget, max((la.rgb_bytes for la in layers), default=0))
+    logger.info(f"Rendering {width}x{height} frame in bands of {rows} rows")
+
+    # for portrait displays, each band is a range of columns in the native frame
+    native_row_bytes = height * bits_per_pixel // 8
+    band_buf = bytearray(width * rows)
+    with base_layer_file.open("rb") as f:
+        for top in range(0, height, rows):
+            band_rows = min(rows, height - top)
+            band_data = memoryview(band_buf)[: width * band_rows]
+            f.readinto(band_data)
+            band = Image.frombytes("P", (width, band_rows), band_data)
+            band.putpalette(builder.palette)
+            for layer in layers:
+                if layer.box[1] < top + band_rows and layer.box[3] > top:
+                    layer.apply(band, builder.palette, (0, top))
+
+            if not profile.portrait:
+                start = top * width * bits_per_pixel // 8
+                packed = band.tobytes("raw", profile.pack_rawmode)
+                out[start : start + len(packed)] = packed
+                continue
+            packed = memoryview(
+                band.rotate(90, expand=True).tobytes("raw", profile.pack_rawmode)
+            )
+            start = top * bits_per_pixel // 8
+            band_row_bytes = band_rows * bits_per_pixel // 8
+            for row in range(width):
+                offset = row * native_row_bytes + start
+                out[offset : offset + band_row_bytes] = packed[
+                    row * band_row_bytes : (row + 1) * band_row_bytes
+                ]
+    return out
 
 
 def load_quotations() -> list[list[str]]:
@@ -676,7 +1999,12 @@ def load_quotations() -> list[list[str]]:
     return rows
 
 
-def get_banner_text(now: arrow.Arrow):
+def get_banner_text(now: arrow.Arrow, rng: t.Optional[random.Random] = None):
+    """Get the quotation, credit and font size for the given day.
+
+    The quotation is chosen at random. Pass a seeded `rng` to make the choice
+    reproducible (e.g. the frame server seeds it with the device ID and date).
+    """
     day = now.date().day
     month = now.date().month
 
@@ -690,7 +2018,7 @@ def get_banner_text(now: arrow.Arrow):
     else:
         rows = load_quotations()
         # Choose a random row
-        random_row = secrets.choice(rows)
+        random_row = rng.choice(rows) if rng else secrets.choice(rows)
         # set the variables to print the text later
         quotation_text, credit_text = random_row
         font_size = get_font_size_for_quote(quotation_text)
@@ -763,6 +2091,570 @@ def get_battery_charge_percent() -> t.Union[float, None]:
     return charge_pct
 
 
+# ------------- POWER PLANNER ----------------
+
+
+@dataclass(frozen=True)
+class BatteryReading:
+    time: int
+    """Unix time of the reading."""
+    charge_percent: float
+    voltage: float
+    plan: int = 0
+    """Index in `POWER_PLANS` of the plan chosen for the run."""
+
+
+_BATTERY_RECORD = struct.Struct("<IHHB")
+"""Battery history record: Unix time, charge in hundredths of a percent, voltage in
+millivolts, and power plan index.
+"""
+
+
+def read_battery() -> t.Optional[BatteryReading]:
+    """Read the battery's charge and voltage, and nothing else (see
+    `get_battery_charge_percent()` for the details).
+    """
+    ps = get_pisugar_server()
+    if not ps:
+        logger.warning("PiSugar server not found. Skipping battery check.")
+        return None
+    return BatteryReading(
+        arrow.utcnow().int_timestamp, ps.get_battery_level(), ps.get_battery_voltage()
+    )
+
+
+def load_battery_history() -> list[BatteryReading]:
+    try:
+        data = BATTERY_HISTORY_FILE.read_bytes()
+    except FileNotFoundError:
+        return []
+    # ignore a record that was only partly written
+    data = data[: len(data) - len(data) % _BATTERY_RECORD.size]
+    return [
+        BatteryReading(time, charge / 100, voltage / 1000, plan)
+        for time, charge, voltage, plan in _BATTERY_RECORD.iter_unpack(data)
+    ]
+
+
+def record_battery_reading(reading: BatteryReading) -> None:
+    """Append a reading to the battery history, which keeps the last
+    `BATTERY_HISTORY_SIZE` runs. Only the new record is written, except when the
+    file has grown to twice that size, and is trimmed.
+    """
+    record = _BATTERY_RECORD.pack(
+        reading.time,
+        round(reading.charge_percent * 100),
+        round(reading.voltage * 1000),
+        reading.plan,
+    )
+    max_size = 2 * BATTERY_HISTORY_SIZE * _BATTERY_RECORD.size
+    try:
+        BATTERY_HISTORY_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with BATTERY_HISTORY_FILE.open("ab") as f:
+            size = f.tell()
+            # drop a record that was only partly written
+            if size % _BATTERY_RECORD.size:
+                size = f.truncate(size - size % _BATTERY_RECORD.size)
+            f.write(record)
+        if size + len(record) > max_size:
+            data = BATTERY_HISTORY_FILE.read_bytes()
+            keep = BATTERY_HISTORY_SIZE * _BATTERY_RECORD.size
+            BATTERY_HISTORY_FILE.write_bytes(data[-keep:])
+    except OSError:
+        logger.exception(f"Unable to record battery reading in {BATTERY_HISTORY_FILE}")
+
+
+@dataclass(frozen=True)
+class BatteryForecast:
+    drain_percent_per_day: float
+    days_left: float
+
+    def charge_at(self, charge_percent: float, days: float) -> float:
+        """Forecast charge in `days` days, given the charge now."""
+        return charge_percent - self.drain_percent_per_day * days
+
+
+def forecast_battery(history: list[BatteryReading]) -> t.Optional[BatteryForecast]:
+    """Forecast how long the battery will last, by fitting a line to its charge since
+    it was last charged (over at most `BATTERY_FORECAST_DAYS`).
+
+    Returns None if there isn't at least a day of history to go on, or if the
+    battery isn't discharging.
+    """
+    if not history:
+        return None
+    start = history[-1].time - BATTERY_FORECAST_DAYS * 86400
+    readings: list[BatteryReading] = []
+    for reading in reversed(history):
+        if reading.time < start:
+            break
+        # stop at the last time the battery was charged
+        if readings and reading.charge_percent < readings[-1].charge_percent - 1:
+            break
+        readings.append(reading)
+    if len(readings) < 3 or readings[0].time - readings[-1].time < 86400:
+        return None
+
+    mean_time = sum(r.time for r in readings) / len(readings)
+    mean_charge = sum(r.charge_percent for r in readings) / len(readings)
+    covariance = sum(
+        (r.time - mean_time) * (r.charge_percent - mean_charge) for r in readings
+    )
+    variance = sum((r.time - mean_time) ** 2 for r in readings)
+    drain = -covariance / variance * 86400
+    if drain <= 0:
+        return None
+    return BatteryForecast(drain, readings[0].charge_percent / drain)
+
+
+@dataclass(frozen=True)
+class PowerPlan:
+    """How much work a run does, depending on the battery (see
+    `choose_power_plan()`).
+    """
+
+    name: str
+    min_charge_percent: float
+    min_days_left: float
+    """The plan is only used if the battery has at least this much charge, and isn't
+    forecast to run out in fewer than this many days.
+    """
+    prerender_days: int
+    """Number of days of frames to render ahead of time, so that cheaper plans can
+    show them without rendering (see `prerender_frames()`).
+    """
+    battery_details: bool
+    """Whether to query and log the battery's current, charging status, etc."""
+    final_battery_check: bool
+    """Whether to check the battery again after updating the display."""
+    clear_before_display: bool
+    """Whether to clear the display before showing the new frame. Skipping it saves
+    a refresh, but may leave some ghosting.
+    """
+    wake_interval_days: int
+    """Days until the next scheduled wake up, from 1 to 7 (see
+    `set_wake_interval()`).
+    """
+
+    def estimated_cost_mah(self, render: bool) -> float:
+        """Estimated battery charge used by a run (see `RUN_COSTS_MAH`).
+
+        Args:
+            render: whether the frame has to be rendered.
+        """
+        steps = {
+            "boot": True,
+            "display": True,
+            "render": render,
+            "clear": self.clear_before_display,
+            "battery_details": self.battery_details,
+            "battery_check": self.final_battery_check,
+        }
+        return sum(RUN_COSTS_MAH[step] for step, used in steps.items() if used)
+
+
+POWER_PLANS = (
+    PowerPlan(
+        name="full",
+        min_charge_percent=40,
+        min_days_left=14,
+        prerender_days=7,
+        battery_details=True,
+        final_battery_check=True,
+        clear_before_display=True,
+        wake_interval_days=1,
+    ),
+    PowerPlan(
+        name="economy",
+        min_charge_percent=15,
+        min_days_left=4,
+        prerender_days=0,
+        battery_details=False,
+        final_battery_check=False,
+        clear_before_display=False,
+        wake_interval_days=1,
+    ),
+    PowerPlan(
+        name="critical",
+        min_charge_percent=0,
+        min_days_left=0,
+        prerender_days=0,
+        battery_details=False,
+        final_battery_check=False,
+        clear_before_display=False,
+        wake_interval_days=2,
+    ),
+)
+"""Power plans, from the most to the least expensive. Each run uses the first plan
+whose thresholds are met.
+"""
+
+
+def choose_power_plan(
+    charge_percent: t.Optional[float], forecast: t.Optional[BatteryForecast]
+) -> PowerPlan:
+    if charge_percent is None:
+        # no battery to save, e.g. when running without a PiSugar
+        return POWER_PLANS[0]
+    for plan in POWER_PLANS:
+        if charge_percent >= plan.min_charge_percent and (
+            forecast is None or forecast.days_left >= plan.min_days_left
+        ):
+            return plan
+    return POWER_PLANS[-1]
+
+
+def wake_weekday_repeat(now: arrow.Arrow, days: int) -> int:
+    """PiSugar RTC alarm repeat mask (bit 0 is Sunday) to wake up `days` days from
+    now.
+    """
+    if days <= 1:
+        return 0b1111111
+    return 1 << (now.shift(days=min(days, 7)).isoweekday() % 7)
+
+
+def wake_time_path() -> Path:
+    """File where the configured time of the scheduled wake up is kept while
+    `schedule_next_update()` moves it.
+    """
+    return CACHE_DIR / "wake-time.txt"
+
+
+def load_wake_time() -> t.Optional[datetime.datetime]:
+    """Get the configured time of the scheduled wake up, if it was moved."""
+    try:
+        return datetime.datetime.fromisoformat(wake_time_path().read_text().strip())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        logger.exception(f"Unable to read the wake up time in {wake_time_path()}")
+        return None
+
+
+def set_wake_interval(now: arrow.Arrow, days: int) -> None:
+    """Change which days the PiSugar's scheduled wake up repeats on, so that the
+    next wake up is in `days` days, at the same time of day as configured. If the
+    wake up was moved by `schedule_next_update()`, it's moved back to that time.
+    """
+    ps = get_pisugar_server()
+    if not ps:
+        logger.warning("PiSugar server not found. Could not set the wake interval.")
+        return
+    if not ps.get_rtc_alarm_enabled():
+        logger.info("Scheduled wake up is disabled, leaving it as is")
+        return
+    weekday_repeat = wake_weekday_repeat(now, days)
+    wake_time = load_wake_time()
+    if wake_time is None and ps.get_rtc_alarm_repeat() == weekday_repeat:
+        return
+    logger.info(f"Waking up again in {days} day(s)")
+    ps.rtc_alarm_set(wake_time or ps.get_rtc_alarm_time(), weekday_repeat)
+    if wake_time is not None:
+        wake_time_path().unlink(missing_ok=True)
+
+
+def next_update_time(now: arrow.Arrow) -> arrow.Arrow:
+    """Time of the next update with `SUB_DAILY_UPDATES`: the next moonrise or local
+    midnight, whichever comes first.
+    """
+    midnight = now.shift(days=1).floor("day")
+    moonrises = (get_moon_events(day).rise for day in (now, midnight))
+    soon = now.shift(minutes=1)
+    return min([midnight, *(rise for rise in moonrises if rise and rise > soon)])
+
+
+def schedule_next_update(now: arrow.Arrow) -> None:
+    """Move the PiSugar's scheduled wake up to the time of the next update (see
+    `next_update_time()`).
+
+    The wake up still repeats every day, so if a boot fails before scheduling the
+    next one, the Pi still wakes up the next day. The configured time is kept (see
+    `wake_time_path()`), for `set_wake_interval()` to go back to.
+    """
+    ps = get_pisugar_server()
+    if not ps:
+        logger.warning("PiSugar server not found. Could not schedule next update.")
+        return
+    when = next_update_time(now)
+    logger.info(f"Next update at {when}")
+    if not wake_time_path().exists():
+        try:
+            wake_time_path().parent.mkdir(parents=True, exist_ok=True)
+            wake_time_path().write_text(ps.get_rtc_alarm_time().isoformat())
+        except OSError:
+            logger.exception(f"Unable to save the wake up time to {wake_time_path()}")
+    ps.rtc_alarm_set(when.datetime, wake_weekday_repeat(now, 1))
+
+
+# ------------- FRAME SERVER CLIENT ----------------
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix domain socket."""
+
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+def frame_server_connection(url: str, timeout: float) -> http.client.HTTPConnection:
+    """Open a connection to a frame server given as "http://host:port" or
+    "unix:///path/to/socket".
+    """
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme == "unix":
+        return _UnixHTTPConnection(parsed.path, timeout)
+    if parsed.scheme == "http":
+        return http.client.HTTPConnection(
+            parsed.hostname or "localhost", parsed.port, timeout=timeout
+        )
+    msg = f"unsupported frame server URL {url!r}"
+    raise ValueError(msg)
+
+
+@lru_cache(maxsize=1)
+def _local_timezone_name() -> t.Optional[str]:
+    """IANA name of the system's time zone, from where /etc/localtime points to."""
+    parts = Path("/etc/localtime").resolve().parts
+    if "zoneinfo" not in parts:
+        return None
+    return "/".join(parts[parts.index("zoneinfo") + 1 :]) or None
+
+
+def timezone_name(now: arrow.Arrow) -> str:
+    """Name of the time zone of `now` that another machine can render frames in:
+    its IANA name when it's known, or else its UTC offset, e.g. "+02:00".
+    """
+    name = getattr(now.tzinfo, "key", None)
+    if name is None and now.utcoffset() == now.to("local").utcoffset():
+        name = _local_timezone_name()
+    return name or now.format("ZZ")
+
+
+def frame_server_path(
+    device_id: str, date: t.Any, low_battery: bool, display: str, tz: str
+) -> str:
+    quoted_id = urllib.parse.quote(device_id, safe="")
+    query = urllib.parse.urlencode(
+        {"low_battery": int(low_battery), "display": display, "tz": tz}
+    )
+    return f"/frames/{quoted_id}/{date.isoformat()}?{query}"
+
+
+def fetch_frame(
+    epd,
+    now: arrow.Arrow,
+    low_battery: bool,
+    url: t.Optional[str] = None,
+    device_id: t.Optional[str] = None,
+) -> t.Union[bytes, None]:
+    """Fetch the packed frame buffer for the given day from the frame server, for
+    the display and in the time zone of `now`.
+
+    The last frame received is kept in `CACHE_DIR`, and its ETag is sent along with
+    the request so the server can skip sending it again if it hasn't changed. Frames
+    rendered for another display or time zone are rejected.
+
+    Returns None if there is no frame server configured, or if the frame couldn't be
+    fetched, in which case the caller should render the frame itself.
+    """
+    url = url or FRAME_SERVER_URL
+    device_id = device_id or DEVICE_ID
+    if not url:
+        return None
+
+    profile = epd_profile(epd)
+    expected_size = profile.buffer_size
+    tz = timezone_name(now)
+    path = frame_server_path(device_id, now.date(), low_battery, profile.name, tz)
+    cache_file = CACHE_DIR / "last-frame.bin"
+    etag_file = CACHE_DIR / "last-frame.etag"
+    headers = {}
+    if cache_file.exists() and etag_file.exists():
+        headers["If-None-Match"] = etag_file.read_text()
+
+    logger.info(f"Fetching frame from {url}{path}")
+    try:
+        conn = frame_server_connection(url, FRAME_SERVER_TIMEOUT)
+        try:
+            conn.request("GET", path, headers=headers)
+            resp = conn.getresponse()
+            body = resp.read()
+        finally:
+            conn.close()
+
+        if resp.status == http.client.NOT_MODIFIED:
+            logger.info("Frame not modified since last fetch, using cached copy")
+            body = cache_file.read_bytes()
+        elif resp.status == http.client.OK:
+            rendered_for = (
+                resp.getheader("X-Frame-Display"),
+                resp.getheader("X-Frame-Timezone"),
+            )
+            if rendered_for != (profile.name, tz):
+                logger.error(
+                    f"Frame from server is for {rendered_for}, expected "
+                    f"{(profile.name, tz)}. Rendering locally."
+                )
+                return None
+            etag = resp.getheader("ETag")
+            if etag and len(body) == expected_size:
+                CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                cache_file.write_bytes(body)
+                etag_file.write_text(etag)
+        else:
+            logger.error(f"Frame server returned {resp.status} {resp.reason}")
+            return None
+    except (OSError, http.client.HTTPException, ValueError):
+        logger.exception(
+            "Unable to get a frame from the frame server. Rendering locally."
+        )
+        return None
+
+    if len(body) != expected_size:
+        logger.error(
+            f"Frame from server is {len(body)} bytes, expected {expected_size}. "
+            "Rendering locally."
+        )
+        return None
+    return body
+
+
+# ------------- PRE-RENDERED FRAMES ----------------
+
+
+def frame_settings(
+    now: arrow.Arrow,
+    low_battery: bool,
+    profile: t.Optional[DisplayProfile] = None,
+    device_id: t.Optional[str] = None,
+) -> ImageSettings:
+    """Get the settings for the frame for the day of `now`.
+
+    The quote is picked at random, seeded with the device and the date, so that the
+    same day's frame is the same wherever and whenever it's rendered (e.g. ahead of
+    time, or on the frame server).
+    """
+    profile = profile or get_display_profile()
+    device_id = device_id or DEVICE_ID
+    rng = random.Random(f"{device_id}/{now.date().isoformat()}")
+    quotation_text, credit_text, font_size = get_banner_text(now, rng)
+    return ImageSettings(
+        now,
+        quotation_text,
+        credit_text,
+        font_size,
+        get_moon_phase(now),
+        float(BATTERY_LOW_THRESHOLD) if low_battery else None,
+        list(profile.tables.palette),
+        profile,
+        get_moon_events(now) if SHOW_MOON_EVENTS else None,
+    )
+
+
+def render_frame_buffer(
+    now: arrow.Arrow,
+    low_battery: bool,
+    profile: t.Optional[DisplayProfile] = None,
+    device_id: t.Optional[str] = None,
+) -> bytes:
+    """Render the frame for the day of `now`, packed for the display (see
+    `frame_settings()`).
+    """
+    settings = frame_settings(now, low_battery, profile, device_id)
+    if RENDER_MEMORY_BUDGET:
+        return bytes(render_banded(settings, RENDER_MEMORY_BUDGET))
+    return get_renderer().render(settings, pack=True)
+
+
+def prerendered_frame_path(date: t.Any, low_battery: bool) -> Path:
+    suffix = "-low-battery" if low_battery else ""
+    return CACHE_DIR / "frames" / f"{date.isoformat()}{suffix}.bin"
+
+
+def load_prerendered_frame(
+    epd, now: arrow.Arrow, low_battery: bool
+) -> t.Union[bytes, None]:
+    """Get the frame for the day of `now` if it was rendered ahead of time."""
+    frame_file = prerendered_frame_path(now.date(), low_battery)
+    expected_size = epd_profile(epd).buffer_size
+    if not frame_file.exists():
+        return None
+    frame = frame_file.read_bytes()
+    if len(frame) != expected_size:
+        logger.warning(f"Ignoring invalid pre-rendered frame {frame_file}")
+        return None
+    logger.info(f"Using pre-rendered frame {frame_file}")
+    return frame
+
+
+def prerender_frames(
+    now: arrow.Arrow,
+    days: int,
+    charge_percent: t.Optional[float],
+    forecast: t.Optional[BatteryForecast],
+) -> None:
+    """Render the frames for the next `days` days that haven't been rendered yet,
+    and delete the frames of days that are past.
+
+    The battery indicator is drawn on the frames of the days when the battery is
+    forecast to be low.
+    """
+    frame_dir = CACHE_DIR / "frames"
+    today = now.date().isoformat()
+    for frame_file in frame_dir.glob("*.bin"):
+        if frame_file.name[:10] < today:
+            frame_file.unlink()
+
+    for day in range(1, days + 1):
+        date = now.shift(days=day)
+        low_battery = charge_percent is not None and (
+            (forecast.charge_at(charge_percent, day) if forecast else charge_percent)
+            <= BATTERY_LOW_THRESHOLD
+        )
+        frame_file = prerendered_frame_path(date.date(), low_battery)
+        if frame_file.exists():
+            continue
+        logger.info(f"Pre-rendering frame for {date.date()}")
+        frame = render_frame_buffer(date, low_battery)
+        try:
+            frame_file.parent.mkdir(parents=True, exist_ok=True)
+            frame_file.write_bytes(frame)
+        except OSError:
+            logger.exception(f"Unable to save pre-rendered frame to {frame_file}")
+            return
+
+
+# ------------- FRAME ARCHIVE ----------------
+
+
+def archive_frame(epd_buf: t.Union[bytes, bytearray]) -> None:
+    """Add a frame that was just shown to the archive in `FRAME_ARCHIVE_DIR`."""
+    start = time.perf_counter()
+    archive = frame_archive.FrameArchive(FRAME_ARCHIVE_DIR)
+    try:
+        entry = archive.append(bytes(epd_buf), arrow.utcnow().int_timestamp)
+        stats = archive.stats()
+    except (OSError, frame_archive.ArchiveError):
+        logger.exception(f"Unable to archive the frame in {FRAME_ARCHIVE_DIR}")
+        return
+    kind = "keyframe"
+    if not entry.is_keyframe:
+        kind = f"difference with frame {entry.reference}"
+    logger.info(
+        f"Archived frame {entry.number} ({kind}, {entry.length / 1000:.1f} kB, "
+        f"{entry.size / entry.length:.0f}x smaller) in "
+        f"{(time.perf_counter() - start) * 1000:.0f} ms. Archive: {stats.frames} "
+        f"frames, {stats.stored_bytes / 1000:.0f} kB, {stats.ratio:.1f}x smaller"
+    )
+
+
 # ------------- Logging ----------------
 
 
@@ -788,30 +2680,99 @@ class InterceptHandler(logging.Handler):
 
 # ------------- MAIN -------------------
 
-if __name__ == "__main__":
-    logging.basicConfig(handlers=[InterceptHandler()], level=0, force=True)
 
+def main() -> None:
+    """Update the display, as is done once per boot."""
     sync_rtc_to_system_clock()
-    charge_pct = get_battery_charge_percent()
-
     now = arrow.now()
+    battery = read_battery()
+    charge_pct = battery.charge_percent if battery else None
+    low_battery = charge_pct is not None and int(charge_pct) <= BATTERY_LOW_THRESHOLD
+
+    # Pick how much work to do based on the battery
+    forecast = None
+    if battery:
+        forecast = forecast_battery([*load_battery_history(), battery])
+    plan = choose_power_plan(charge_pct, forecast)
+    if battery:
+        record_battery_reading(replace(battery, plan=POWER_PLANS.index(plan)))
+    # frames rendered ahead of time, or by the frame server, are for the whole day
+    daily_frames = not SUB_DAILY_UPDATES
+    render = not daily_frames or not (
+        FRAME_SERVER_URL or prerendered_frame_path(now.date(), low_battery).exists()
+    )
+    battery_text = "no battery"
+    if charge_pct is not None:
+        battery_text = f"battery at {charge_pct:.0f}%"
+    if forecast:
+        battery_text += (
+            f", {forecast.days_left:.1f} days left at "
+            f"{forecast.drain_percent_per_day:.2f}%/day"
+        )
+    logger.info(
+        f"Power plan: {plan.name} ({battery_text}), estimated cost "
+        f"{plan.estimated_cost_mah(render):.1f} mAh per run"
+    )
+    if plan.battery_details:
+        get_battery_charge_percent()
+
     moon_info = get_moon_phase(now)
+    moon_events = get_moon_events(now) if SHOW_MOON_EVENTS else None
     logger.info(f"Date: {now}")
     logger.info(f"{moon_info}")
-
-    quotation_text, credit_text, font_size = get_banner_text(now)
+    logger.info(f"{moon_events}")
 
     epd = get_epd()
-    output_palette = epd_get_palette(epd)
-    image = generate_image(
-        now,
-        quotation_text,
-        credit_text,
-        font_size,
-        moon_info,
-        charge_pct,
-        output_palette,
-    )
-    epd_update_image(epd, image)
+    frame_buf = None
+    if daily_frames:
+        frame_buf = load_prerendered_frame(epd, now, low_battery)
+    if daily_frames and frame_buf is None:
+        frame_buf = fetch_frame(epd, now, low_battery)
+    if frame_buf is not None:
+        epd_display_buffer(epd, frame_buf, plan.clear_before_display)
+    else:
+        quotation_text, credit_text, font_size = get_banner_text(now)
+
+        output_palette = epd_get_palette(epd)
+        if RENDER_MEMORY_BUDGET:
+            settings = ImageSettings(
+                now,
+                quotation_text,
+                credit_text,
+                font_size,
+                moon_info,
+                charge_pct,
+                output_palette,
+                moon_events=moon_events,
+            )
+            epd_display_buffer(
+                epd,
+                render_banded(settings, RENDER_MEMORY_BUDGET),
+                plan.clear_before_display,
+            )
+        else:
+            image = generate_image(
+                now,
+                quotation_text,
+                credit_text,
+                font_size,
+                moon_info,
+                charge_pct,
+                output_palette,
+                moon_events=moon_events,
+            )
+            epd_update_image(epd, image, plan.clear_before_display)
+
+    if plan.prerender_days and daily_frames and not FRAME_SERVER_URL:
+        prerender_frames(now, plan.prerender_days, charge_pct, forecast)
+    if battery and SUB_DAILY_UPDATES and plan.wake_interval_days == 1:
+        schedule_next_update(now)
+    elif battery:
+        set_wake_interval(now, plan.wake_interval_days)
+    if plan.final_battery_check:
+        get_battery_charge_percent()
 
-    get_battery_charge_percent()
+
+if __name__ == "__main__":
+    logging.basicConfig(handlers=[InterceptHandler()], level=0, force=True)
+    main()
@@ -0,0 +1,80 @@
+"""Compare the export formats, and rendering frames while saving them as PNG the way
+the test scripts used to (`Image.save()` with the default compression), with
+rendering them while a `FrameWriter` saves them in the background.
+
+    python tests/bench-export.py
+"""
+
+import io
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import arrow
+
+libdir = Path(__file__).parent.parent
+if libdir.exists():
+    sys.path.append(str(libdir))
+
+import frame_export
+import moon_pi
+
+DAYS = 60
+
+
+def bench(label, func, frames):
+    start = time.perf_counter()
+    size = func(frames)
+    elapsed = time.perf_counter() - start
+    size_text = f"{size / len(frames) / 1000:8.0f} kB/frame" if size else ""
+    print(f"{label:<32} {elapsed / len(frames) * 1000:7.1f} ms/frame {size_text}")
+    return elapsed
+
+
+def pil_save(frames):
+    size = 0
+    for frame in frames:
+        data = io.BytesIO()
+        frame.save(data, "PNG")
+        size += len(data.getvalue())
+    return size
+
+
+def encode(exporter):
+    return lambda frames: sum(len(exporter.encode(frame)) for frame in frames)
+
+
+if __name__ == "__main__":
+    moon_pi.logger.remove()
+    first_day = arrow.get(2024, 1, 1, 12, tzinfo="US/Pacific")
+    days = arrow.Arrow.range("day", first_day, limit=DAYS)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        moon_pi.CACHE_DIR = tmpdir
+        all_settings = [moon_pi.frame_settings(day, False) for day in days]
+        renderer = moon_pi.Renderer()
+        frames = list(renderer.render_many(all_settings))
+
+        print("Encoding")
+        bench("Image.save(), PNG level 6", pil_save, frames)
+        for name in frame_export.EXPORTERS:
+            bench(name, encode(frame_export.get_exporter(name)), frames)
+        bench("png, level 9", encode(frame_export.PngExporter(9)), frames)
+
+        def render_and_save(all_settings):
+            for n, settings in enumerate(all_settings):
+                renderer.render(settings).save(tmpdir / f"sync-{n}.png")
+
+        def render_and_write(all_settings):
+            exporter = frame_export.PngExporter()
+            path = tmpdir / "writer-{n}.png"
+            with frame_export.FrameWriter(exporter, path) as writer:
+                for settings in all_settings:
+                    writer.write(renderer.render(settings))
+
+        print("Rendering and saving")
+        sync = bench("Image.save()", render_and_save, all_settings)
+        writer = bench("FrameWriter, PNG level 1", render_and_write, all_settings)
+    print(f"speedup: {sync / writer:.1f}x")
@@ -0,0 +1,68 @@
+"""Archive a year of frames with a few keyframe intervals and compression levels, and
+compare the size of the archive, and the time to append and get back a frame, with
+saving each frame as a PNG.
+
+    python tests/bench-frame-archive.py
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import arrow
+
+libdir = Path(__file__).parent.parent
+if libdir.exists():
+    sys.path.append(str(libdir))
+
+import frame_archive
+import frame_export
+import moon_pi
+
+DAYS = 365
+
+
+def bench(label, frames, times, **kwargs):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        archive = frame_archive.FrameArchive(Path(tmpdir), **kwargs)
+        start = time.perf_counter()
+        for n, frame in enumerate(frames):
+            archive.append(frame, times[n])
+        append_ms = (time.perf_counter() - start) / len(frames) * 1000
+        start = time.perf_counter()
+        for when in times:
+            archive.get(when)
+        get_ms = (time.perf_counter() - start) / len(frames) * 1000
+        stats = archive.stats()
+    print(
+        f"{label:<24} {stats.stored_bytes / stats.frames / 1000:6.1f} kB/frame "
+        f"{stats.ratio:6.1f}x {append_ms:7.1f} ms/append {get_ms:7.1f} ms/get"
+    )
+
+
+if __name__ == "__main__":
+    moon_pi.logger.remove()
+    first_day = arrow.get(2024, 1, 1, 12, tzinfo="US/Pacific")
+    days = list(arrow.Arrow.range("day", first_day, limit=DAYS))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        moon_pi.CACHE_DIR = Path(tmpdir)
+        all_settings = [moon_pi.frame_settings(day, False) for day in days]
+        renderer = moon_pi.Renderer()
+        frames = list(renderer.render_many(all_settings, pack=True))
+    times = [day.int_timestamp for day in days]
+
+    profile = moon_pi.get_display_profile()
+    png = frame_export.PngExporter(6)
+    png_size = 0
+    for frame in frames:
+        image = moon_pi.epd_unpack_image(frame, profile)
+        image.putpalette(profile.tables.palette)
+        png_size += len(png.encode(image))
+    print(f"{'PNG per frame':<24} {png_size / len(frames) / 1000:6.1f} kB/frame")
+
+    for max_deltas in (10, 30, 90):
+        bench(f"at most {max_deltas} deltas", frames, times, max_deltas=max_deltas)
+    for level in (1, 9):
+        bench(f"compression level {level}", frames, times, compress_level=level)
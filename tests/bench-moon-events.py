@@ -0,0 +1,53 @@
+"""Compare looking up moon events in the yearly table with computing them directly
+with ephem.
+
+    python tests/bench-moon-events.py
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import arrow
+
+libdir = Path(__file__).parent.parent
+if libdir.exists():
+    sys.path.append(str(libdir))
+
+import moon_pi
+
+DAYS = 365
+
+
+def bench(label, func, days):
+    start = time.perf_counter()
+    for day in days:
+        func(day)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {1e3 * elapsed / len(days):10.4f} ms/day")
+    return elapsed
+
+
+if __name__ == "__main__":
+    moon_pi.logger.remove()
+    first_day = arrow.get(2024, 1, 1, tzinfo="US/Pacific")
+    days = list(arrow.Arrow.range("day", first_day, limit=DAYS))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        moon_pi.CACHE_DIR = Path(tmpdir)
+
+        start = time.perf_counter()
+        moon_pi.get_moon_events(first_day)
+        print(f"{'build table (one year)':<28} {time.perf_counter() - start:10.4f} s")
+
+        moon_pi._load_moon_events_table.cache_clear()
+        start = time.perf_counter()
+        moon_pi.get_moon_events(first_day)
+        print(
+            f"{'load table from disk':<28} {1e3 * (time.perf_counter() - start):10.4f} ms"
+        )
+
+        direct = bench("ephem (direct)", moon_pi.compute_moon_events, days)
+        lookup = bench("table lookup", moon_pi.get_moon_events, days)
+    print(f"speedup: {direct / lookup:.0f}x")
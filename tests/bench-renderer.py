@@ -0,0 +1,64 @@
+"""Compare rendering a year of frames with a new `ImageBuilder` for each frame, with
+a `Renderer`, and with a `Renderer` on several threads.
+
+    python tests/bench-renderer.py
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import arrow
+
+libdir = Path(__file__).parent.parent
+if libdir.exists():
+    sys.path.append(str(libdir))
+
+import moon_pi
+
+DAYS = 365
+
+
+def bench(label, render, all_settings):
+    start = time.perf_counter()
+    render(all_settings)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {len(all_settings) / elapsed:10.1f} frames/s")
+    return elapsed
+
+
+def image_builder(all_settings):
+    for settings in all_settings:
+        moon_pi.ImageBuilder(settings).build()
+
+
+if __name__ == "__main__":
+    moon_pi.logger.remove()
+    first_day = arrow.get(2024, 1, 1, 12, tzinfo="US/Pacific")
+    days = arrow.Arrow.range("day", first_day, limit=DAYS)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        moon_pi.CACHE_DIR = Path(tmpdir)
+        all_settings = [moon_pi.frame_settings(day, False) for day in days]
+        renderer = moon_pi.Renderer()
+        # dither each moon image once, so that it's cached on disk for every run
+        for _ in renderer.render_many(all_settings):
+            pass
+
+        renderer = moon_pi.Renderer()
+        builder = bench("ImageBuilder per frame", image_builder, all_settings)
+        single = bench(
+            "Renderer",
+            lambda all_settings: [renderer.render(s) for s in all_settings],
+            all_settings,
+        )
+        for threads in (2, 4, 8):
+            bench(
+                f"Renderer, {threads} threads",
+                lambda all_settings: list(
+                    renderer.render_many(all_settings, threads)  # noqa: B023
+                ),
+                all_settings,
+            )
+    print(f"speedup on one thread: {builder / single:.1f}x")
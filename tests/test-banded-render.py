@@ -0,0 +1,93 @@
+"""Check that rendering in bands gives the same frame buffer as rendering the whole
+image, and that it stays within its memory budget.
+
+Note that tracemalloc only sees memory allocated by Python, not the pixels of
+Pillow images, which `band_height()` accounts for separately.
+"""
+
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+import arrow
+
+libdir = Path(__file__).parent.parent
+if libdir.exists():
+    sys.path.append(str(libdir))
+
+import moon_pi
+
+BUDGET = 128_000
+
+
+def make_settings(profile_name, battery=None):
+    now = arrow.get(2024, 9, 17, 21, tzinfo="US/Pacific")
+    profile = moon_pi.get_display_profile(profile_name)
+    return moon_pi.ImageSettings(
+        now,
+        "The moon is a friend for the lonesome to talk to.",
+        "Carl Sandburg",
+        20,
+        moon_pi.get_moon_phase(now),
+        battery,
+        list(profile.tables.palette),
+        profile,
+        moon_pi.get_moon_events(now),
+    )
+
+
+def render_peak(render):
+    tracemalloc.start()
+    try:
+        render()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def check_profile(profile_name):
+    settings = make_settings(profile_name, battery=5.0)
+    expected = moon_pi.epd_pack_image(
+        moon_pi.ImageBuilder(settings).build(), settings.profile
+    )
+    out = bytearray(len(expected))
+    assert moon_pi.render_banded(settings, BUDGET, out) == expected
+
+    banded_peak = render_peak(lambda: moon_pi.render_banded(settings, BUDGET, out))
+    full_peak = render_peak(
+        lambda: moon_pi.epd_pack_image(
+            moon_pi.ImageBuilder(settings).build(), settings.profile
+        )
+    )
+    assert banded_peak <= BUDGET, banded_peak
+    assert full_peak > BUDGET, full_peak
+
+
+def test_banded_render_800x480():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        moon_pi.CACHE_DIR = Path(tmpdir)
+        check_profile("epd7in3f")
+
+
+def test_banded_render_1600x1200():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        moon_pi.CACHE_DIR = Path(tmpdir)
+        check_profile("epd13in3e")
+
+
+def test_budget_too_small():
+    profile = moon_pi.get_display_profile("epd13in3e")
+    try:
+        moon_pi.band_height(profile, 10_000)
+    except ValueError:
+        pass
+    else:
+        msg = "expected ValueError"
+        raise AssertionError(msg)
+
+
+if __name__ == "__main__":
+    test_banded_render_800x480()
+    test_banded_render_1600x1200()
+    test_budget_too_small()
@@ -0,0 +1,170 @@
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+import arrow
+from loguru import logger
+
+libdir = Path(__file__).parent.parent
+if libdir.exists():
+    sys.path.append(str(libdir))
+
+import boot_simulator
+import epd_emulator
+import frame_archive
+import moon_pi
+
+START = arrow.get(2024, 1, 1, tzinfo="local")
+
+
+def test_daily_boots():
+    discharge = boot_simulator.DischargeModel(capacity_mah=1_000_000)
+    result = boot_simulator.simulate(60, START, discharge)
+    assert result.boots == result.refreshes == 60
+    assert result.frames_skipped == 0
+    assert result.plans == {"full": 60}
+    assert result.clears == 60
+    assert result.flat_after_days is None
+
+    energy = boot_simulator.EnergyModel()
+    assert result.boot_mah > 60 * (energy.boot_mah + energy.refresh_mah)
+    assert abs(result.standby_mah - 60 * 24 * discharge.standby_ma) < 1e-6
+    assert result.energy_mah == result.boot_mah + result.standby_mah
+
+
+def test_battery_runs_out():
+    discharge = boot_simulator.DischargeModel(capacity_mah=400)
+    result = boot_simulator.simulate(60, START, discharge)
+    assert result.flat_after_days is not None
+    assert result.final_charge_percent == 0
+    # the power plans get cheaper as the battery drains
+    assert set(result.plans) == {"full", "economy", "critical"}
+    assert result.frames_skipped == 60 - result.refreshes > 0
+    assert result.clears == result.plans["full"]
+
+
+def test_recharge():
+    discharge = boot_simulator.DischargeModel(capacity_mah=400, recharge_at_percent=10)
+    result = boot_simulator.simulate(60, START, discharge)
+    assert result.recharges > 0
+    assert result.flat_after_days is None
+    assert result.final_charge_percent > 10
+
+
+def test_sub_daily_updates():
+    discharge = boot_simulator.DischargeModel(capacity_mah=1_000_000)
+    moon_pi.SUB_DAILY_UPDATES = True
+    try:
+        result = boot_simulator.simulate(30, START, discharge)
+    finally:
+        moon_pi.SUB_DAILY_UPDATES = False
+    # woken up at midnight and at moonrise
+    assert result.boots > 50
+    assert result.frames_skipped == 0
+
+
+def test_boots_start_cold():
+    """Nothing kept in memory by a boot is reused by the next one."""
+    discharge = boot_simulator.DischargeModel(capacity_mah=1_000_000)
+    load_display_tables = moon_pi.load_display_tables
+    with mock.patch.object(
+        moon_pi, "load_display_tables", wraps=load_display_tables
+    ) as load:
+        result = boot_simulator.simulate(5, START, discharge)
+    assert result.boots == 5
+    assert load.call_count >= result.boots
+    # the display is busy for several seconds with each refresh and clear
+    assert result.display_seconds > 5 * (result.refreshes + result.clears)
+
+
+def test_display_waits_on_emulated_clock():
+    """The busy periods logged by each boot are measured on the emulated clock."""
+    discharge = boot_simulator.DischargeModel(capacity_mah=1_000_000)
+    messages = []
+    handler = logger.add(messages.append, format="{message}", level="INFO")
+    try:
+        boot_simulator.simulate(2, START, discharge)
+    finally:
+        logger.remove(handler)
+    summaries = [m for m in messages if m.startswith("Display busy periods")]
+    assert len(summaries) == 2
+    for summary in summaries:
+        assert "refresh 0.000s" not in summary
+        assert "recovered per refresh" in summary
+
+
+def test_unrendered_frames_are_blank():
+    """Frames that aren't really rendered are blank, rather than another day's, and
+    aren't archived.
+    """
+    discharge = boot_simulator.DischargeModel(capacity_mah=1_000_000)
+    shown = []
+    epd_display_buffer = moon_pi.epd_display_buffer
+
+    def record(epd, epd_buf, clear=True):
+        shown.append(bytes(epd_buf))
+        epd_display_buffer(epd, epd_buf, clear)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        archive_dir = Path(tmpdir)
+        patches = mock.patch.multiple(
+            moon_pi, FRAME_ARCHIVE_DIR=archive_dir, epd_display_buffer=record
+        )
+        with patches:
+            # the first frame with each moon image is always rendered
+            boot_simulator.simulate(45, START, discharge, render_every=3)
+        archived = frame_archive.FrameArchive(archive_dir).stats().frames
+    rendered = [frame for frame in shown if frame.strip(b"\0")]
+    assert len(shown) == 45
+    assert 0 < len(rendered) < len(shown)
+    assert len(set(rendered)) == len(rendered)
+    assert archived == len(rendered)
+
+
+def test_boot_without_deep_sleep():
+    """A boot that leaves the display powered after refreshing it fails."""
+    discharge = boot_simulator.DischargeModel(capacity_mah=1_000_000)
+    with mock.patch.object(moon_pi, "epd_sleep", lambda epd: None):
+        try:
+            boot_simulator.simulate(1, START, discharge)
+        except epd_emulator.ProtocolError:
+            pass
+        else:
+            msg = "expected ProtocolError"
+            raise AssertionError(msg)
+
+
+def test_virtual_clock():
+    clock = boot_simulator.VirtualClock(START)
+    with clock.running():
+        assert arrow.now() == START
+        assert arrow.utcnow() == START
+        clock.now = START.shift(days=400)
+        assert arrow.now().date() == START.shift(days=400).date()
+    assert arrow.now() != START
+
+
+def test_years_in_seconds():
+    discharge = boot_simulator.DischargeModel(recharge_at_percent=10)
+    start = time.perf_counter()
+    result = boot_simulator.simulate(2 * 365, START, discharge)
+    elapsed = time.perf_counter() - start
+    print(result.summary())
+    print(f"Simulated in {elapsed:.1f}s")
+    assert result.boots > 600
+    assert elapsed < 60
+
+
+if __name__ == "__main__":
+    test_daily_boots()
+    test_battery_runs_out()
+    test_recharge()
+    test_sub_daily_updates()
+    test_boots_start_cold()
+    test_display_waits_on_emulated_clock()
+    test_unrendered_frames_are_blank()
+    test_boot_without_deep_sleep()
+    test_virtual_clock()
+    test_years_in_seconds()
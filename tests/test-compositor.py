@@ -0,0 +1,171 @@
+"""Check that composing images in palette space gives exactly the same pixels as
+the original pipeline, which composed in RGB and quantized the whole image twice.
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+import arrow
+from PIL import Image, ImageDraw
+
+libdir = Path(__file__).parent.parent
+if libdir.exists():
+    sys.path.append(str(libdir))
+
+import moon_pi
+
+
+def reference_image(settings: moon_pi.ImageSettings) -> Image.Image:
+    """The original `ImageBuilder.build()`"""
+    builder = moon_pi.ImageBuilder(settings)
+    profile = settings.profile
+    palette = settings.output_palette
+
+    bg_image = moon_pi.load_image(profile.background_image)
+    if bg_image.size != profile.size:
+        bg_image = bg_image.resize(profile.size, Image.Resampling.NEAREST)
+    moon_img = moon_pi.load_image(
+        moon_pi.get_moon_img_path(settings.moon.normalized_age, settings.moon.text)
+    )
+    moon_img = moon_img.resize((profile.moon_size_px, profile.moon_size_px))
+    moon_coords = (
+        builder.x_center - int(moon_img.width / 2),
+        builder.y_center - int(moon_img.height / 2) + 20,
+    )
+    image = bg_image.copy()
+    image.paste(moon_img, moon_coords, moon_img)
+    image = moon_pi.paletize_image(image, palette, dither=True).convert("RGB")
+
+    draw = ImageDraw.Draw(image)
+    draw.fontmode = "L" if moon_pi.FONT_ANTIALIASING else "1"
+    draw.text(
+        (builder.x_center, builder.top + 5),
+        settings.quotation_text,
+        font=moon_pi.get_font("quote", settings.font_size),
+        fill=0,
+        anchor="mt",
+    )
+    if settings.credit_text:
+        draw.text(
+            (builder.right - 5, builder.top + 40),
+            f"\N{HORIZONTAL BAR} {settings.credit_text}",
+            font=moon_pi.get_font("credit"),
+            fill=0,
+            anchor="rm",
+        )
+    date_and_phase_font = moon_pi.get_font("date_and_phase")
+    draw.text(
+        (builder.left + 10, builder.bottom - 38),
+        settings.now.strftime("%A, %B %-d"),
+        font=date_and_phase_font,
+        fill=moon_pi.WHITE,
+        anchor="lt",
+    )
+    draw.text(
+        (builder.right - 10, builder.bottom - 38),
+        settings.moon.text,
+        font=date_and_phase_font,
+        fill=moon_pi.WHITE,
+        anchor="rt",
+    )
+    if settings.moon_events:
+        events = settings.moon_events
+        draw.text(
+            (builder.left + 10, builder.bottom - 44),
+            f"Moonrise {events.rise.strftime('%-I:%M %p')}\n"
+            f"Moonset {events.set.strftime('%-I:%M %p')}",
+            font=moon_pi.get_font("credit"),
+            fill=moon_pi.WHITE,
+            anchor="ld",
+        )
+        draw.text(
+            (builder.right - 10, builder.bottom - 44),
+            f"Transit {events.transit.strftime('%-I:%M %p')}\n"
+            f"Altitude at dusk {events.nightfall_altitude:.0f}\N{DEGREE SIGN}",
+            font=moon_pi.get_font("credit"),
+            fill=moon_pi.WHITE,
+            anchor="rd",
+            align="right",
+        )
+    if settings.battery_charge_percent is not None:
+        battery_img = moon_pi.load_image(moon_pi.BATTERY_INDICATOR_IMAGE)
+        image.paste(battery_img, (builder.left + 10, builder.top + 64), battery_img)
+
+    return moon_pi.paletize_image(image, palette, dither=False)
+
+
+def check(settings: moon_pi.ImageSettings):
+    expected = reference_image(settings)
+    actual = moon_pi.ImageBuilder(settings).build()
+    assert actual.mode == "P"
+    assert actual.getpalette() == expected.getpalette()
+    assert actual.tobytes() == expected.tobytes(), settings
+
+
+def make_settings(now, quote, credit, battery=None, profile=None, moon_events=None):
+    profile = profile or moon_pi.get_display_profile()
+    return moon_pi.ImageSettings(
+        now,
+        quote,
+        credit,
+        moon_pi.get_font_size_for_quote(quote),
+        moon_pi.get_moon_phase(now),
+        battery,
+        list(profile.tables.palette),
+        profile,
+        moon_events,
+    )
+
+
+def test_quotes():
+    now = arrow.get(2024, 9, 17, tzinfo="US/Pacific")
+    for quote, credit in moon_pi.load_quotations():
+        check(make_settings(now, quote, credit))
+
+
+def test_phases_and_battery():
+    start = arrow.get(2023, 11, 5, tzinfo="US/Pacific")
+    for idx, now in enumerate(arrow.Arrow.range("day", start, limit=31)):
+        battery = 10 if idx % 3 == 0 else None
+        check(make_settings(now, "Happy Birthday!", "", battery))
+
+
+def test_base_layer_from_disk():
+    now = arrow.get(2024, 1, 1, tzinfo="US/Pacific")
+    settings = make_settings(now, "The moon is my mother.", "Sylvia Plath", 10)
+    check(settings)
+    moon_pi._load_base_layer.cache_clear()
+    check(settings)
+
+
+def test_moon_events_layer():
+    now = arrow.get(2024, 3, 10, tzinfo="US/Pacific")
+    events = moon_pi.compute_moon_events(now)
+    check(make_settings(now, "Happy Birthday!", "", moon_events=events))
+
+
+def test_antialiasing():
+    moon_pi.FONT_ANTIALIASING = True
+    try:
+        now = arrow.get(2024, 5, 31, tzinfo="US/Pacific")
+        check(make_settings(now, "The moon is my mother.", "Sylvia Plath", 10))
+    finally:
+        moon_pi.FONT_ANTIALIASING = False
+
+
+def test_large_display():
+    profile = moon_pi.get_display_profile("epd13in3e")
+    now = arrow.get(2024, 9, 17, tzinfo="US/Pacific")
+    check(make_settings(now, "The moon is my mother.", "Sylvia Plath", 10, profile))
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmpdir:
+        moon_pi.CACHE_DIR = Path(tmpdir)
+        test_quotes()
+        test_phases_and_battery()
+        test_base_layer_from_disk()
+        test_moon_events_layer()
+        test_antialiasing()
+        test_large_display()
@@ -0,0 +1,90 @@
+import random
+import sys
+from pathlib import Path
+
+from PIL import Image
+
+libdir = Path(__file__).parent.parent
+if libdir.exists():
+    sys.path.append(str(libdir))
+
+import moon_pi
+
+
+def test_nearest_index_matches_quantize():
+    rng = random.Random(1)
+    colors = [tuple(rng.randrange(256) for _ in range(3)) for _ in range(10_000)]
+    for profile in moon_pi.DISPLAY_PROFILES.values():
+        tables = profile.tables
+        img = Image.new("RGB", (len(colors), 1))
+        img.putdata(colors)
+        expected = img.quantize(
+            palette=tables.palette_image, dither=Image.Dither.NONE
+        ).tobytes()
+        actual = bytes(tables.nearest_index(color) for color in colors)
+        assert actual == expected, profile.name
+
+
+def test_pack_round_trip():
+    rng = random.Random(2)
+    for profile in moon_pi.DISPLAY_PROFILES.values():
+        img = Image.new("P", profile.size)
+        img.frombytes(
+            bytes(
+                rng.randrange(len(profile.colors))
+                for _ in range(img.width * img.height)
+            )
+        )
+        buf = moon_pi.epd_pack_image(img, profile)
+        assert len(buf) * 8 == img.width * img.height * profile.bits_per_pixel
+        assert moon_pi.epd_unpack_image(buf, profile).tobytes() == img.tobytes()
+
+
+def test_palette_matches_driver_colors():
+    palette = moon_pi.get_display_profile("epd7in3f").tables.palette
+    assert palette[:21] == bytes(
+        [
+            0,
+            0,
+            0,
+            255,
+            255,
+            255,
+            0,
+            255,
+            0,
+            0,
+            0,
+            255,
+            255,
+            0,
+            0,
+            255,
+            255,
+            0,
+            255,
+            128,
+            0,
+        ]
+    )
+    assert palette[21:] == bytes(3 * 249)
+
+
+def test_epd_profile():
+    """The palette and buffer size are those of the display object's own profile."""
+    emulated = moon_pi.MockEpaperLibrary().epaper("epd7in3f").EPD()
+    assert moon_pi.epd_profile(emulated).name == "epd7in3f"
+    for name in ("epd7in3e", "epd5in65f"):
+        epd = moon_pi.MockEpaperDisplay(name)
+        profile = moon_pi.get_display_profile(name)
+        assert moon_pi.epd_profile(epd) is profile
+        assert moon_pi.epd_get_palette(epd) == list(profile.tables.palette)
+    driver = type("EPD", (), {"__module__": "waveshare_epd.epd13in3e"})()
+    assert moon_pi.epd_profile(driver).name == "epd13in3e"
+
+
+if __name__ == "__main__":
+    test_nearest_index_matches_quantize()
+    test_pack_round_trip()
+    test_palette_matches_driver_colors()
+    test_epd_profile()
@@ -0,0 +1,196 @@
+import sys
+import time
+import types
+from pathlib import Path
+
+libdir = Path(__file__).parent.parent
+if libdir.exists():
+    sys.path.append(str(libdir))
+
+import epd_busy
+
+DURATIONS = {None: 0.02, 0x04: 0.05, 0x12: 0.3, 0x02: 0.03}
+"""How long each command keeps the fake display busy, in seconds."""
+
+
+class FakeEPD:
+    """Mimics the parts of the epd7in3f driver that wait for the display."""
+
+    busy_pin = 24
+
+    def __init__(self, line: epd_busy.FakeBusyLine):
+        self.line = line
+
+    def reset(self):
+        self.line.busy_for(DURATIONS[None])
+
+    def send_command(self, command):
+        self.line.busy_for(DURATIONS.get(command, 0))
+
+    def send_data(self, data):
+        pass
+
+    def ReadBusyH(self):
+        while self.line.is_busy():
+            time.sleep(0.005)
+
+    def init(self):
+        self.reset()
+        self.ReadBusyH()
+
+    def TurnOnDisplay(self):
+        self.send_command(0x04)
+        self.ReadBusyH()
+        self.send_command(0x12)
+        self.send_data(0x00)
+        self.ReadBusyH()
+        self.send_command(0x02)
+        self.send_data(0x00)
+        self.ReadBusyH()
+
+
+class FakeClock:
+    """Time that only passes when it's slept, like an emulated display's clock."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+def run_refresh(line):
+    epd = FakeEPD(line)
+    waiter = epd_busy.BusyWaiter(line)
+    epd_busy.install(epd, waiter)
+    epd.init()
+    epd.TurnOnDisplay()
+    assert epd_busy.get_waiter(epd) is waiter
+    return waiter
+
+
+def test_edge_wait():
+    waiter = run_refresh(epd_busy.FakeBusyLine(edges=True))
+    names = [period.name for period in waiter.periods]
+    assert names == ["reset", "power on", "refresh", "power off"]
+    assert waiter.refreshes == 1
+    for i, expected in enumerate(DURATIONS.values()):
+        period = waiter.periods[i]
+        assert period.edge
+        assert expected - 0.001 <= period.seconds < expected + 0.005
+        assert 0 <= period.latency < 0.005
+        assert period.recovered_seconds == epd_busy.DRIVER_LATENCY - period.latency
+    summary = waiter.summary()
+    assert "4 of 4 measured" in summary
+    assert "recovered per refresh compared to polling every 5ms" in summary
+
+
+def test_polling_fallback():
+    line = epd_busy.FakeBusyLine(edges=False)
+    waiter = run_refresh(line)
+    assert len(waiter.periods) == 4
+    for i, expected in enumerate(DURATIONS.values()):
+        period = waiter.periods[i]
+        assert not period.edge
+        assert period.latency is None
+        # the polling interval is a fraction of the time spent busy, and never
+        # longer than the drivers'
+        assert period.poll_interval <= epd_busy.DRIVER_POLL_INTERVAL
+        assert expected <= period.seconds < expected * 1.05 + 0.005
+    assert "measured" not in waiter.summary()
+
+
+def test_polling_backs_off():
+    """A long busy period is polled only a few more times than by the drivers."""
+    line = epd_busy.FakeBusyLine(edges=False)
+    seconds = DURATIONS[0x12]
+    line.busy_for(seconds)
+    epd_busy.BusyWaiter(line).wait()
+    # the interval reaches the drivers' after `poll_backoff` times it
+    assert line.reads <= seconds / epd_busy.DRIVER_POLL_INTERVAL + 15
+
+
+def test_injected_clock():
+    """A whole refresh is waited for on the injected clock, without waiting."""
+    clock = FakeClock()
+    reads = []
+
+    def digital_read(pin):
+        reads.append(clock.now)
+        return int(clock.now >= 27)
+
+    line = epd_busy.PolledBusyLine(digital_read, 24)
+    waiter = epd_busy.BusyWaiter(line, clock=clock, sleep=clock.sleep)
+    period = waiter.wait()
+    assert 27 <= period.seconds < 27 + epd_busy.DRIVER_POLL_INTERVAL
+    assert period.poll_interval == epd_busy.DRIVER_POLL_INTERVAL
+    assert len(reads) <= 27 / epd_busy.DRIVER_POLL_INTERVAL + 15
+
+
+def test_timeout():
+    line = epd_busy.FakeBusyLine(edges=False)
+    line.busy_for(10)
+    waiter = epd_busy.BusyWaiter(line, timeout=0.05)
+    try:
+        waiter.wait()
+    except TimeoutError:
+        pass
+    else:
+        msg = "expected TimeoutError"
+        raise AssertionError(msg)
+    assert not waiter.periods
+
+
+def test_idle_before_wait():
+    """A line that went high before the wait isn't counted as noticed late."""
+    line = epd_busy.FakeBusyLine(edges=True)
+    waiter = epd_busy.BusyWaiter(line)
+    assert waiter.wait().latency is None
+
+
+def test_max_poll_interval():
+    line = epd_busy.FakeBusyLine(edges=False)
+    try:
+        epd_busy.BusyWaiter(line, max_poll_interval=0.05)
+    except ValueError:
+        pass
+    else:
+        msg = "expected ValueError"
+        raise AssertionError(msg)
+    try:
+        epd_busy.BusyLine()
+    except TypeError:
+        pass
+    else:
+        msg = "expected TypeError"
+        raise AssertionError(msg)
+
+
+def test_busy_line_from_epdconfig():
+    button = types.SimpleNamespace(value=1, wait_for_active=lambda timeout: True)
+    epdconfig = types.SimpleNamespace(
+        implementation=types.SimpleNamespace(GPIO_BUSY_PIN=button),
+        digital_read=lambda pin: 1,
+    )
+    line = epd_busy.busy_line_from_epdconfig(epdconfig, 24)
+    assert isinstance(line, epd_busy.GpiozeroBusyLine)
+    assert not line.is_busy() and line.wait_for_idle(1)
+
+    epdconfig = types.SimpleNamespace(digital_read=lambda pin: 0)
+    line = epd_busy.busy_line_from_epdconfig(epdconfig, 24)
+    assert isinstance(line, epd_busy.PolledBusyLine)
+    assert line.is_busy() and line.wait_for_idle(1) is None
+
+
+if __name__ == "__main__":
+    test_edge_wait()
+    test_polling_fallback()
+    test_polling_backs_off()
+    test_injected_clock()
+    test_timeout()
+    test_idle_before_wait()
+    test_max_poll_interval()
+    test_busy_line_from_epdconfig()
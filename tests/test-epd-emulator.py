@@ -0,0 +1,173 @@
+import random
+import sys
+from pathlib import Path
+from unittest import mock
+
+import arrow
+from PIL import Image
+
+libdir = Path(__file__).parent.parent
+if libdir.exists():
+    sys.path.append(str(libdir))
+
+import epd_busy
+import epd_emulator
+import moon_pi
+
+SPEC = epd_emulator.PANELS["epd7in3f"]
+DELAYS = 0.042 + 0.03 + 2.0
+"""Delays in the driver's reset, init and sleep, in seconds. The display is busy
+for less time after the reset than the driver waits.
+"""
+REFRESH_SECONDS = 0.1 + 27.0 + 0.03
+"""Time the display is busy powering on, refreshing and powering off."""
+
+
+def random_frame(seed: int) -> bytes:
+    rng = random.Random(seed)
+    image = Image.new("P", (SPEC.width, SPEC.height))
+    image.putdata(
+        [rng.randrange(len(SPEC.palette)) for _ in range(image.width * image.height)]
+    )
+    return image.tobytes("raw", "P;4")
+
+
+def new_display(**kwargs):
+    module = epd_emulator.EmulatedEpaperLibrary(**kwargs).epaper("epd7in3f")
+    return module.EPD(), module.controller
+
+
+def assert_raises_protocol_error(func, *args):
+    try:
+        func(*args)
+    except epd_emulator.ProtocolError:
+        pass
+    else:
+        raise AssertionError
+
+
+def test_display_round_trip():
+    epd, controller = new_display()
+    epd.init()
+    frame = random_frame(1)
+    epd.display(frame)
+    epd.sleep()
+    assert controller.refreshes == 1
+    assert controller.image.tobytes("raw", "P;4") == frame
+    assert controller.asleep
+
+    assert [p.seconds for p in controller.busy_periods] == [0.01, 0.1, 27.0, 0.03]
+    assert (
+        abs(controller.spi_seconds - SPEC.frame_bytes * 8 / epd_emulator.SPI_HZ) < 0.001
+    )
+    # the driver polls the BUSY line every 5 ms, so it notices a bit late
+    expected = REFRESH_SECONDS + controller.spi_seconds + DELAYS
+    assert expected - 1e-9 <= controller.clock < expected + 3 * 0.005
+
+
+def test_getbuffer():
+    epd, controller = new_display()
+    image = Image.new("RGB", (SPEC.width, SPEC.height), (255, 128, 0))
+    image.paste((0, 0, 255), (0, 0, 100, 100))
+    epd.init()
+    epd.display(epd.getbuffer(image.rotate(-90, expand=True)))
+    epd.sleep()
+    decoded = controller.image.convert("RGB")
+    assert decoded.getpixel((0, 0)) == (0, 0, 255)
+    assert decoded.getpixel((799, 479)) == (255, 128, 0)
+
+
+def test_moon_pi_update():
+    library = epd_emulator.EmulatedEpaperLibrary()
+    with library, mock.patch.object(moon_pi, "epaper", library):
+        moon_pi.get_epd.cache_clear()
+        try:
+            epd = moon_pi.get_epd()
+            frame = moon_pi.render_frame_buffer(arrow.get(2024, 9, 17, 12), False)
+            moon_pi.epd_display_buffer(epd, frame, clear=True)
+        finally:
+            moon_pi.get_epd.cache_clear()
+    controller = library.epaper("epd7in3f").controller
+    assert controller.refreshes == 2
+    assert controller.image.tobytes("raw", "P;4") == frame
+    names = [period.name for period in epd_busy.get_waiter(epd).periods]
+    assert names == ["reset"] + ["power on", "refresh", "power off"] * 2
+    # unlike the driver's polling, waiting for the BUSY line's edge takes no longer
+    # than the display is busy
+    expected = 2 * REFRESH_SECONDS + controller.spi_seconds + DELAYS
+    assert abs(controller.clock - expected) < 1e-4
+    print(controller.summary())
+
+
+def test_protocol_errors():
+    frame = random_frame(2)
+
+    # refresh before init
+    epd, _ = new_display()
+    epd.epdconfig.module_init()
+    assert_raises_protocol_error(epd.display, frame)
+
+    # command while busy
+    epd, _ = new_display()
+    epd.init()
+    epd.send_command(epd_emulator.DATA_START)
+    epd.send_data2(frame)
+    epd.send_command(epd_emulator.POWER_ON)
+    assert_raises_protocol_error(epd.send_command, epd_emulator.REFRESH)
+
+    # refresh while powered off
+    epd, _ = new_display()
+    epd.init()
+    epd.send_command(epd_emulator.DATA_START)
+    epd.send_data2(frame)
+    assert_raises_protocol_error(epd.send_command, epd_emulator.REFRESH)
+
+    # truncated frame, and invalid color codes
+    epd, _ = new_display()
+    epd.init()
+    assert_raises_protocol_error(epd.display, frame[:-1])
+    epd, _ = new_display()
+    epd.init()
+    assert_raises_protocol_error(epd.display, bytes([0x77]) * SPEC.frame_bytes)
+
+    # not put to sleep after a refresh, by the end of the run, even if the display
+    # was reset in between
+    library = epd_emulator.EmulatedEpaperLibrary()
+    epd = library.epaper("epd7in3f").EPD()
+    epd.init()
+    epd.display(frame)
+    epd.init()
+    assert_raises_protocol_error(library.finish)
+    assert_raises_protocol_error(library.__exit__, None, None, None)
+    assert_raises_protocol_error(epd.epdconfig.module_exit)
+
+    # display after sleep, without waking the display up with init()
+    epd.sleep()
+    epd.epdconfig.module_init()
+    assert_raises_protocol_error(epd.display, frame)
+    epd.init()
+    epd.display(frame)
+    epd.sleep()
+    library.finish()
+
+
+def test_measured_busy_seconds():
+    periods = [
+        epd_busy.BusyPeriod(epd_busy.REFRESH_COMMAND, seconds, 0.0, True)
+        for seconds in (20.0, 22.0)
+    ]
+    busy_seconds = epd_emulator.measured_busy_seconds(periods)
+    assert busy_seconds == {epd_busy.REFRESH_COMMAND: 21.0}
+    epd, controller = new_display(busy_seconds=busy_seconds)
+    epd.init()
+    epd.Clear()
+    epd.sleep()
+    assert [p.seconds for p in controller.busy_periods] == [0.01, 0.1, 21.0, 0.03]
+
+
+if __name__ == "__main__":
+    test_display_round_trip()
+    test_getbuffer()
+    test_moon_pi_update()
+    test_protocol_errors()
+    test_measured_busy_seconds()
@@ -0,0 +1,186 @@
+import random
+import sys
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import arrow
+import pytest
+
+libdir = Path(__file__).parent.parent
+if libdir.exists():
+    sys.path.append(str(libdir))
+
+import epd_emulator
+import frame_archive
+import moon_pi
+
+DAY = 24 * 3600
+
+
+def changing_frames(count: int, size: int = 4000) -> list[bytes]:
+    """Random frame, followed by copies with a few bytes changed each time."""
+    rng = random.Random(count)
+    frame = bytearray(rng.randrange(256) for _ in range(size))
+    frames = []
+    for _ in range(count):
+        start = rng.randrange(size - 100)
+        frame[start : start + 100] = bytes(rng.randrange(256) for _ in range(100))
+        frames.append(bytes(frame))
+    return frames
+
+
+def test_append_and_get():
+    frames = changing_frames(12)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        archive = frame_archive.FrameArchive(Path(tmpdir), max_deltas=5)
+        assert archive.get(0) is None
+        assert archive.stats().ratio == 0
+        entries = [archive.append(frame, n * DAY) for n, frame in enumerate(frames)]
+        assert entries[0].is_keyframe
+        assert all(not entry.is_keyframe for entry in entries[1:6])
+        # at most 5 differences from a keyframe
+        assert entries[6].reference in (0, 6)
+        assert max(len(frame_archive._chain(entry, entries)) for entry in entries) == 6
+        assert archive.entries() == entries
+        # differences are much smaller than keyframes
+        assert entries[1].length < entries[0].length / 4
+
+        for n, frame in enumerate(frames):
+            assert archive.get(n * DAY) == frame
+            assert archive.get(n * DAY + DAY - 1) == frame
+        assert archive.get(-1) is None
+
+        stats = archive.stats()
+        assert stats.frames == 12
+        assert stats.frame_bytes == 12 * 4000
+        assert stats.ratio > 2
+
+        # reopened, and shown again later the same day
+        archive = frame_archive.FrameArchive(Path(tmpdir), max_deltas=5)
+        archive.append(frames[0], 11 * DAY + 1)
+        assert archive.get(11 * DAY) == frames[11]
+        assert archive.get(12 * DAY) == frames[0]
+        with pytest.raises(
+            frame_archive.ArchiveError, match="before the last archived frame"
+        ):
+            archive.append(frames[0], 11 * DAY)
+
+
+def test_lunation_reference():
+    """A frame is stored as its difference with the frame from a lunation before,
+    rather than the previous frame, when that's closer.
+    """
+    month = frame_archive.SYNODIC_MONTH_SECONDS
+    frames = changing_frames(3)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        archive = frame_archive.FrameArchive(Path(tmpdir))
+        archive.append(frames[0], 0)
+        for n in range(1, 29):
+            archive.append(bytes(255 - b for b in frames[n % 2 + 1]), n * DAY)
+        entry = archive.append(frames[0][:-1] + b"\0", month + 1)
+        assert entry.reference == 0
+        assert entry.length < 100
+        assert archive.get(month + 1) == frames[0][:-1] + b"\0"
+
+
+def test_keyframe_on_new_size():
+    frames = changing_frames(2)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        archive = frame_archive.FrameArchive(Path(tmpdir))
+        archive.append(frames[0], 0)
+        entry = archive.append(frames[1][:1000], DAY)
+        assert entry.is_keyframe
+        assert archive.get(DAY) == frames[1][:1000]
+
+
+def test_partly_written():
+    frames = changing_frames(3)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        archive = frame_archive.FrameArchive(Path(tmpdir))
+        archive.append(frames[0], 0)
+        archive.append(frames[1], DAY)
+        # power lost while writing the index
+        with archive.index_path.open("r+b") as f:
+            f.truncate(archive.index_path.stat().st_size - 3)
+        assert len(archive.entries()) == 1
+        entry = archive.append(frames[2], 2 * DAY)
+        assert entry.number == 1
+        assert archive.get(DAY) == frames[0]
+        assert archive.get(2 * DAY) == frames[2]
+
+
+def test_corrupt():
+    frames = changing_frames(4)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        archive = frame_archive.FrameArchive(Path(tmpdir))
+        entries = [archive.append(frame, n * DAY) for n, frame in enumerate(frames[:3])]
+        with archive.frames_path.open("r+b") as f:
+            f.seek(entries[1].offset)
+            f.write(b"garbage")
+        assert archive.get(0) == frames[0]
+        for time in (DAY, 2 * DAY):
+            with pytest.raises(frame_archive.ArchiveError, match="frame 1 is corrupt"):
+                archive.get(time)
+        # frames that can't be got back aren't used as references
+        entry = archive.append(frames[3], 3 * DAY)
+        assert entry.reference in (0, 3)
+        assert archive.get(3 * DAY) == frames[3]
+
+        # a truncated frames file
+        with archive.frames_path.open("r+b") as f:
+            f.truncate(entry.offset + 1)
+        with pytest.raises(frame_archive.ArchiveError, match="frame 3 is missing"):
+            archive.get(3 * DAY)
+
+        # a reference to a later frame, which would never end
+        record = frame_archive._INDEX_RECORD
+        with archive.index_path.open("r+b") as f:
+            f.seek(record.size)
+            f.write(record.pack(DAY, entries[1].offset, entries[1].length, 4000, 3))
+        with pytest.raises(frame_archive.ArchiveError, match="refers to a later"):
+            archive.get(DAY)
+
+        archive.frames_path.unlink()
+        with pytest.raises(frame_archive.ArchiveError, match="is missing"):
+            archive.get(0)
+
+
+def test_display_update():
+    library = epd_emulator.EmulatedEpaperLibrary()
+    frames = {
+        day: moon_pi.render_frame_buffer(arrow.get(2024, 9, day, 12), False)
+        for day in (18, 19)
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with mock.patch.multiple(
+            moon_pi, epaper=library, FRAME_ARCHIVE_DIR=Path(tmpdir)
+        ):
+            for day, frame in frames.items():
+                with mock.patch("arrow.utcnow", return_value=arrow.get(2024, 9, day)):
+                    moon_pi.get_epd.cache_clear()
+                    try:
+                        moon_pi.epd_display_buffer(moon_pi.get_epd(), frame)
+                    finally:
+                        moon_pi.get_epd.cache_clear()
+            # the clock went back: the frame is still shown, but not archived
+            with mock.patch("arrow.utcnow", return_value=arrow.get(2024, 9, 1)):
+                moon_pi.get_epd.cache_clear()
+                try:
+                    moon_pi.epd_display_buffer(moon_pi.get_epd(), frames[18])
+                finally:
+                    moon_pi.get_epd.cache_clear()
+        archive = frame_archive.FrameArchive(Path(tmpdir))
+        assert len(archive.entries()) == 2
+        assert archive.get(arrow.get(2024, 9, 18, 23).int_timestamp) == frames[18]
+        assert archive.get(arrow.get(2024, 9, 20).int_timestamp) == frames[19]
+        assert archive.stats().ratio > 5
+
+
+if __name__ == "__main__":
+    test_append_and_get()
+    test_lunation_reference()
+    test_keyframe_on_new_size()
+    test_partly_written()
+    test_corrupt()
+    test_display_update()
@@ -0,0 +1,158 @@
+import io
+import random
+import sys
+import tempfile
+import threading
+from pathlib import Path
+from unittest import mock
+
+import arrow
+import pytest
+from PIL import Image
+
+libdir = Path(__file__).parent.parent
+if libdir.exists():
+    sys.path.append(str(libdir))
+
+import epd_emulator
+import frame_export
+import moon_pi
+
+PROFILE = moon_pi.get_display_profile("epd7in3f")
+WIDTH, HEIGHT = PROFILE.native_size
+
+
+def random_frame(seed: int) -> Image.Image:
+    rng = random.Random(seed)
+    pixels = bytes(rng.randrange(7) for _ in range(WIDTH * HEIGHT))
+    image = Image.frombytes("P", (WIDTH, HEIGHT), pixels)
+    image.putpalette(PROFILE.tables.palette)
+    return image
+
+
+def test_formats():
+    frame = random_frame(0)
+    raw = frame_export.get_exporter("raw").encode(frame)
+    assert raw == frame.tobytes()
+    assert len(raw) == WIDTH * HEIGHT
+
+    for name, mode in (("ppm", "RGB"), ("pgm", "L"), ("png", "P")):
+        data = frame_export.get_exporter(name).encode(frame)
+        with Image.open(io.BytesIO(data)) as image:
+            assert image.mode == mode
+            assert image.tobytes() == frame.convert(mode).tobytes()
+
+    smaller = frame_export.get_exporter("png", compress_level=9).encode(frame)
+    assert len(smaller) < len(frame_export.PngExporter().encode(frame))
+    with pytest.raises(ValueError, match="compression level"):
+        frame_export.get_exporter("png", compress_level=10)
+    with pytest.raises(ValueError, match="unknown export format"):
+        frame_export.get_exporter("gif")
+    with pytest.raises(ValueError, match="palette images"):
+        frame_export.RawExporter().encode(frame.convert("RGB"))
+
+
+def test_write_files():
+    frames = [random_frame(seed) for seed in range(3)]
+    exporter = frame_export.PpmExporter()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        with frame_export.FrameWriter(exporter, tmpdir / "{n:02}.ppm") as writer:
+            for frame in frames:
+                writer.write(frame)
+            writer.write(frames[0], tmpdir / "first.ppm")
+            writer.flush()
+            assert sorted(path.name for path in tmpdir.iterdir()) == [
+                "00.ppm",
+                "01.ppm",
+                "02.ppm",
+                "first.ppm",
+            ]
+        assert writer.frames == 4
+        for n, frame in enumerate(frames):
+            assert (tmpdir / f"{n:02}.ppm").read_bytes() == exporter.encode(frame)
+        assert (tmpdir / "first.ppm").read_bytes() == exporter.encode(frames[0])
+
+        with pytest.raises(ValueError, match="closed"):
+            writer.write(frames[0])
+
+
+def test_write_stream():
+    frames = [random_frame(seed) for seed in range(4)]
+    stream = io.BytesIO()
+    with frame_export.FrameWriter(frame_export.RawExporter(), stream=stream) as writer:
+        for frame in frames:
+            writer.write(frame)
+    data = stream.getvalue()
+    size = WIDTH * HEIGHT
+    assert [data[i : i + size] for i in range(0, len(data), size)] == [
+        frame.tobytes() for frame in frames
+    ]
+
+
+def test_write_in_background():
+    """Frames are encoded on the writer's thread, and errors are raised later."""
+    encoded = threading.Event()
+    threads = []
+
+    class SlowExporter(frame_export.RawExporter):
+        def encode(self, image):
+            threads.append(threading.current_thread())
+            encoded.wait(5)
+            return super().encode(image)
+
+    stream = io.BytesIO()
+    writer = frame_export.FrameWriter(SlowExporter(), stream=stream, queue_size=2)
+    writer.write(random_frame(0))
+    assert stream.getvalue() == b""
+    encoded.set()
+    writer.close()
+    assert threads[0] is not threading.current_thread()
+    assert len(stream.getvalue()) == WIDTH * HEIGHT
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        writer = frame_export.FrameWriter(frame_export.RawExporter())
+        with pytest.raises(ValueError, match="without a path"):
+            writer.write(random_frame(0))
+        writer.write(random_frame(0), Path(tmpdir) / "missing" / "frame.raw")
+        with pytest.raises(FileNotFoundError):
+            writer.flush()
+        writer.write(random_frame(0), Path(tmpdir) / "frame.raw")
+        writer.close()
+        assert (Path(tmpdir) / "frame.raw").exists()
+
+
+def test_emulated_display():
+    now = arrow.get(2024, 9, 18, 12, tzinfo="US/Pacific")
+    frame = moon_pi.render_frame_buffer(now, False)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        moon_pi.get_frame_writer.cache_clear()
+        with mock.patch.multiple(
+            moon_pi,
+            epaper=moon_pi.MockEpaperLibrary(),
+            CACHE_DIR=Path(tmpdir),
+            HEADLESS_EXPORT_FORMAT="raw",
+            HEADLESS_EXPORT_PATH=str(Path(tmpdir) / "frame-{n}.raw"),
+        ):
+            moon_pi.get_epd.cache_clear()
+            try:
+                moon_pi.epd_display_buffer(moon_pi.get_epd(), frame, clear=True)
+            finally:
+                moon_pi.get_epd.cache_clear()
+            moon_pi.get_frame_writer().close()
+            moon_pi.get_frame_writer.cache_clear()
+        # cleared to white (color 1), then the frame
+        assert set((Path(tmpdir) / "frame-0.raw").read_bytes()) == {1}
+        shown = Image.frombytes("P", (WIDTH, HEIGHT), frame, "raw", "P;4")
+        assert (Path(tmpdir) / "frame-1.raw").read_bytes() == shown.tobytes()
+    assert isinstance(
+        moon_pi.MockEpaperLibrary().epaper("epd7in3f"), epd_emulator.EmulatedEPaper
+    )
+
+
+if __name__ == "__main__":
+    test_formats()
+    test_write_files()
+    test_write_stream()
+    test_write_in_background()
+    test_emulated_display()
@@ -0,0 +1,250 @@
+import datetime
+import socketserver
+import sys
+import tempfile
+import threading
+from dataclasses import replace
+from pathlib import Path
+from unittest import mock
+
+import arrow
+
+libdir = Path(__file__).parent.parent
+if libdir.exists():
+    sys.path.append(str(libdir))
+
+import frame_server
+import moon_pi
+
+WIDTH, HEIGHT = 800, 480
+
+
+def fake_renderer(key):
+    fill = key.date.toordinal() % 7
+    return frame_server.Frame(
+        bytes([fill << 4 | fill]) * (WIDTH * HEIGHT // 2),
+        WIDTH,
+        HEIGHT,
+        key.display,
+        key.tz,
+    )
+
+
+def start_tcp_server(fs):
+    httpd = frame_server.TCPFrameHTTPServer(("127.0.0.1", 0), fs)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    host, port = httpd.server_address[:2]
+    return httpd, f"http://{host}:{port}"
+
+
+def start_raw_server(response: bytes):
+    """Server that answers every request with `response`, as is."""
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            self.request.recv(65536)
+            self.request.sendall(response)
+
+    server = socketserver.TCPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+
+def test_cache_lru():
+    cache = frame_server.FrameCache(max_entries=2)
+    keys = [frame_server.FrameKey("dev", datetime.date(2024, 1, d)) for d in (1, 2, 3)]
+    cache.put(keys[0], fake_renderer(keys[0]))
+    cache.put(keys[1], fake_renderer(keys[1]))
+    assert cache.get(keys[0]) is not None  # keys[0] is now most recently used
+    cache.put(keys[2], fake_renderer(keys[2]))
+    assert keys[1] not in cache
+    assert keys[0] in cache and keys[2] in cache
+
+
+def test_prefetch_next_day():
+    fs = frame_server.FrameServer(fake_renderer)
+    key = frame_server.FrameKey("dev", datetime.date(2024, 1, 1))
+    fs.get_frame(key)
+    future = fs.precompute(key.next_day())
+    if future:
+        future.result()
+    assert key.next_day() in fs.cache
+    fs.shutdown()
+
+
+def test_fetch_frame_tcp():
+    fs = frame_server.FrameServer(fake_renderer, prefetch=False)
+    httpd, url = start_tcp_server(fs)
+    epd = moon_pi.epaper.epaper(moon_pi.WAVESHARE_DISPLAY).EPD()
+    now = arrow.get(2024, 1, 1)
+    with (
+        tempfile.TemporaryDirectory() as tmpdir,
+        mock.patch.object(moon_pi, "CACHE_DIR", Path(tmpdir)),
+    ):
+        buf = moon_pi.fetch_frame(epd, now, False, url=url, device_id="moon pi/1")
+        assert buf == fake_renderer(frame_server.FrameKey("x", now.date())).data
+
+        # second fetch is answered with 304 and served from the local cache
+        buf_again = moon_pi.fetch_frame(epd, now, False, url=url, device_id="moon pi/1")
+        assert buf_again == buf
+        assert fs.cache.hits == 1
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_fetch_frame_display_and_tz():
+    """Frames are requested for the device's display and time zone, and frames
+    rendered for others are rejected.
+    """
+    keys = []
+
+    def recording_renderer(key):
+        keys.append(key)
+        return fake_renderer(key)
+
+    def wrong_display_renderer(key):
+        return replace(fake_renderer(key), display="epd5in65f")
+
+    epd = moon_pi.epaper.epaper(moon_pi.WAVESHARE_DISPLAY).EPD()
+    now = arrow.get(2024, 1, 1, 23, tzinfo="US/Pacific")
+    for renderer, fetched in (
+        (recording_renderer, True),
+        (wrong_display_renderer, False),
+    ):
+        fs = frame_server.FrameServer(renderer, prefetch=False)
+        httpd, url = start_tcp_server(fs)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with mock.patch.object(moon_pi, "CACHE_DIR", Path(tmpdir)):
+                buf = moon_pi.fetch_frame(epd, now, False, url=url, device_id="dev")
+            assert (buf is not None) == fetched
+            assert (Path(tmpdir) / "last-frame.bin").exists() == fetched
+        httpd.shutdown()
+        httpd.server_close()
+    assert keys == [
+        frame_server.FrameKey(
+            "dev",
+            datetime.date(2024, 1, 1),
+            False,
+            moon_pi.WAVESHARE_DISPLAY,
+            "US/Pacific",
+        )
+    ]
+
+
+def test_bad_requests():
+    fs = frame_server.FrameServer(fake_renderer, prefetch=False)
+    httpd, url = start_tcp_server(fs)
+    for path in (
+        "/frames/dev/2024-01-01?low_battery=0",
+        "/frames/dev/2024-01-01?display=epd7in3f",
+        "/frames/dev/2024-01-01?display=epd0in0&tz=UTC",
+        "/frames/dev/2024-01-01?display=epd7in3f&tz=Nowhere/Atlantis",
+        "/frames/dev/2024-13-01?display=epd7in3f&tz=UTC",
+    ):
+        conn = moon_pi.frame_server_connection(url, 5)
+        conn.request("GET", path)
+        assert conn.getresponse().status == 400, path
+        conn.close()
+    assert not fs.cache
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_timezone_name():
+    assert moon_pi.timezone_name(arrow.get(2024, 1, 1, tzinfo="US/Pacific")) == (
+        "US/Pacific"
+    )
+    assert moon_pi.timezone_name(arrow.get(2024, 1, 1, tzinfo="+05:45")) == "+05:45"
+    local = moon_pi.timezone_name(arrow.now())
+    assert arrow.now(local).utcoffset() == arrow.now().utcoffset()
+
+
+def test_fetch_frame_unix_socket():
+    fs = frame_server.FrameServer(fake_renderer, prefetch=False)
+    epd = moon_pi.epaper.epaper(moon_pi.WAVESHARE_DISPLAY).EPD()
+    with (
+        tempfile.TemporaryDirectory() as tmpdir,
+        mock.patch.object(moon_pi, "CACHE_DIR", Path(tmpdir)),
+    ):
+        socket_path = Path(tmpdir) / "frames.sock"
+        httpd = frame_server.UnixFrameHTTPServer(socket_path, fs)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        buf = moon_pi.fetch_frame(
+            epd,
+            arrow.get(2024, 1, 2),
+            True,
+            url=f"unix://{socket_path}",
+            device_id="dev",
+        )
+        assert buf is not None and len(buf) == WIDTH * HEIGHT // 2
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_fetch_frame_unreachable():
+    epd = moon_pi.epaper.epaper(moon_pi.WAVESHARE_DISPLAY).EPD()
+    with (
+        tempfile.TemporaryDirectory() as tmpdir,
+        mock.patch.object(moon_pi, "CACHE_DIR", Path(tmpdir)),
+    ):
+        buf = moon_pi.fetch_frame(
+            epd, arrow.get(2024, 1, 1), False, url=f"unix://{tmpdir}/none.sock"
+        )
+    assert buf is None
+
+
+def test_fetch_frame_bad_response():
+    """Anything but a valid frame falls back to rendering locally."""
+    epd = moon_pi.epaper.epaper(moon_pi.WAVESHARE_DISPLAY).EPD()
+    responses = [
+        b"",  # RemoteDisconnected
+        b"garbage\r\n\r\n",  # BadStatusLine
+        b"HTTP/1.1 200 OK\r\nContent-Length: 192000\r\n\r\nshort",  # IncompleteRead
+        b"HTTP/1.1 200 OK\r\nETag: x\r\nContent-Length: 5\r\n\r\nshort",
+        # nothing cached to fall back on
+        b"HTTP/1.1 304 Not Modified\r\n\r\n",
+    ]
+    for response in responses:
+        server, url = start_raw_server(response)
+        with (
+            tempfile.TemporaryDirectory() as tmpdir,
+            mock.patch.object(moon_pi, "CACHE_DIR", Path(tmpdir)),
+        ):
+            assert (
+                moon_pi.fetch_frame(epd, arrow.get(2024, 1, 1), False, url=url) is None
+            )
+            assert not (Path(tmpdir) / "last-frame.bin").exists()
+        server.shutdown()
+        server.server_close()
+
+
+def test_render_frame_matches_local():
+    key = frame_server.FrameKey(
+        "dev", datetime.date(2024, 9, 17), display="epd7in3f", tz="Asia/Tokyo"
+    )
+    profile = moon_pi.get_display_profile("epd7in3f")
+    with (
+        tempfile.TemporaryDirectory() as tmpdir,
+        mock.patch.object(moon_pi, "CACHE_DIR", Path(tmpdir)),
+    ):
+        frame = frame_server.render_frame(key)
+        now = arrow.get(key.date, tzinfo="Asia/Tokyo")
+        settings = moon_pi.frame_settings(now, False, profile, "dev")
+        local = moon_pi.ImageBuilder(settings).build()
+    assert frame.data == moon_pi.epd_pack_image(local, profile)
+    assert (frame.width, frame.height) == profile.native_size
+    assert (frame.display, frame.tz) == ("epd7in3f", "Asia/Tokyo")
+
+
+if __name__ == "__main__":
+    test_cache_lru()
+    test_prefetch_next_day()
+    test_fetch_frame_tcp()
+    test_fetch_frame_display_and_tz()
+    test_bad_requests()
+    test_timezone_name()
+    test_fetch_frame_unix_socket()
+    test_fetch_frame_unreachable()
+    test_fetch_frame_bad_response()
+    test_render_frame_matches_local()
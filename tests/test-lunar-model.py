@@ -0,0 +1,175 @@
+"""Check the analytic lunar model against ephem."""
+
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+import arrow
+import ephem
+
+libdir = Path(__file__).parent.parent
+if libdir.exists():
+    sys.path.append(str(libdir))
+
+import lunar_model
+import moon_pi
+
+PHASE_TOLERANCE = 0.02
+"""Illuminated fraction, in percent."""
+DISTANCE_TOLERANCE = 15 / lunar_model.AU_KM
+"""Distance to the earth, in AU."""
+EVENT_TOLERANCE = 60 / 86400
+"""Times of the new, full and quarter moons, in days."""
+SPRITE_BOUNDARY_TOLERANCE = 1e-4
+"""How close to the boundary between two moon images (as a fraction of a lunation,
+about 4 minutes) the normalized age may be for the models to pick different ones.
+"""
+
+EVENTS = [
+    "previous_new_moon",
+    "next_new_moon",
+    "next_first_quarter_moon",
+    "next_full_moon",
+    "next_last_quarter_moon",
+    "previous_full_moon",
+]
+
+
+def test_matches_ephem():
+    rng = random.Random(1)
+    start = ephem.Date("1970/1/1")
+    for _ in range(500):
+        date = ephem.Date(start + rng.uniform(0, 100 * 365.25))
+        moon = ephem.Moon(date)
+        assert abs(lunar_model.phase(date) - moon.phase) < PHASE_TOLERANCE
+        assert (
+            abs(lunar_model.earth_distance(date) - moon.earth_distance)
+            < DISTANCE_TOLERANCE
+        )
+        for event in EVENTS:
+            expected = getattr(ephem, event)(date)
+            assert abs(getattr(lunar_model, event)(date) - expected) < EVENT_TOLERANCE
+
+
+def test_vectorized():
+    dates = [ephem.Date("2024/9/17") + i / 7 for i in range(100)]
+    phases = lunar_model.phase(dates)
+    distances = lunar_model.earth_distance(dates)
+    assert len(phases) == len(distances) == len(dates)
+    for i, date in enumerate(dates):
+        assert abs(phases[i] - lunar_model.phase(date)) < 1e-9
+        assert abs(distances[i] - lunar_model.earth_distance(date)) < 1e-15
+
+
+def test_labels_and_sprites_agree():
+    """Every day over several decades, at local noon in California, as on the
+    display, both models must show the same phase text and moon image.
+    """
+    start = ephem.Date("1990/1/1 20:00")
+    days = round(60 * 365.25)
+    boundary_cases = 0
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with mock.patch.object(moon_pi, "CACHE_DIR", Path(tmpdir)):
+            for day in range(days):
+                date = ephem.Date(start + day)
+                expected = moon_pi.get_lunation(date, "ephem")
+                actual = moon_pi.get_lunation(date, "analytic")
+                text = expected.phase_text(date)
+                assert actual.phase_text(date) == text, ephem.Date(date)
+
+                age = expected.normalized_age(date)
+                sprite = moon_pi.get_moon_img_path(age, text)
+                if (
+                    moon_pi.get_moon_img_path(actual.normalized_age(date), text)
+                    != sprite
+                ):
+                    images = len(moon_pi._moon_images(moon_pi.IMAGE_DIR / "moon"))
+                    offset = age * images % 1
+                    assert abs(offset - 0.5) * images < SPRITE_BOUNDARY_TOLERANCE
+                    boundary_cases += 1
+    print(f"{boundary_cases} of {days} days right at the boundary between images")
+    assert boundary_cases <= 2
+
+
+def test_fit_time():
+    date = ephem.Date("2024/9/17 12:00")
+    for name in ("ephem", "analytic"):
+        start = time.perf_counter()
+        for i in range(20):
+            moon_pi.fit_lunation(ephem.Date(date + i * 30), name)
+        print(
+            f"{name}: {(time.perf_counter() - start) / 20 * 1000:.1f} ms per lunation"
+        )
+
+
+def test_dates_like_ephem():
+    rng = random.Random(2)
+    for _ in range(1000):
+        date = ephem.Date(rng.uniform(0, 200 * 365.25))
+        dt = date.datetime()
+        assert abs(lunar_model.from_datetime(dt) - date) < 1e-9
+        assert abs((lunar_model.to_datetime(date) - dt).total_seconds()) < 0.001
+    dt = arrow.get(2024, 9, 18, 12, tzinfo="US/Pacific").datetime
+    assert abs(lunar_model.from_datetime(dt) - ephem.Date(dt)) < 1e-9
+
+
+BOOT = """
+import sys
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, sys.argv[1])
+import moon_pi
+
+moon_pi.logger.remove()
+with mock.patch.multiple(
+    moon_pi,
+    CACHE_DIR=Path("cache"),
+    HEADLESS_EXPORT_PATH="frame.png",
+    LUNAR_MODEL="analytic",
+):
+    moon_pi.main()
+print("ephem" in sys.modules)
+"""
+"""Boots once, in the current directory, with the analytic lunar model."""
+
+
+def test_boot_without_ephem():
+    """ephem isn't imported when booting with the analytic model, once the moon
+    events table has been computed (with ephem) on the first boot.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        loaded = [
+            subprocess.run(  # noqa: S603
+                [sys.executable, "-c", BOOT, str(libdir.resolve())],
+                cwd=tmpdir,
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout.split()[-1]
+            for _ in range(2)
+        ]
+    assert loaded == ["True", "False"]
+
+
+def test_unknown_model():
+    try:
+        moon_pi.get_lunar_model("vsop")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError
+
+
+if __name__ == "__main__":
+    test_matches_ephem()
+    test_vectorized()
+    test_labels_and_sprites_agree()
+    test_fit_time()
+    test_dates_like_ephem()
+    test_boot_without_ephem()
+    test_unknown_model()
@@ -0,0 +1,171 @@
+"""Check the per-lunation Chebyshev series against ephem."""
+
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+import arrow
+import ephem
+
+libdir = Path(__file__).parent.parent
+if libdir.exists():
+    sys.path.append(str(libdir))
+
+import moon_pi
+
+PHASE_TOLERANCE = 1e-3
+"""Illuminated fraction, in percent."""
+DISTANCE_TOLERANCE = 1e-8
+"""Distance to the earth, in AU (about 1.5 km)."""
+
+
+def reference_phase_text(date: ephem.Date) -> str:
+    """Phase text computed with ephem for every date, as `get_moon_phase()` used to."""
+    cycle_start, cycle_end = moon_pi._get_moon_cycle_range(date)
+    full = ephem.next_full_moon(cycle_start)
+    if abs(date - full) <= 0.5:
+        if ephem.Moon(date).earth_distance <= moon_pi.SUPERMOON_DISTANCE_AU:
+            return "Supermoon"
+        previous_full = ephem.previous_full_moon(cycle_start).datetime()
+        if date.datetime().month == previous_full.month:
+            return "Blue Moon"
+    quarter_dates = [
+        cycle_start,
+        ephem.next_first_quarter_moon(cycle_start),
+        full,
+        ephem.next_last_quarter_moon(cycle_start),
+        cycle_end,
+    ]
+    for idx, quarter_date in enumerate(quarter_dates):
+        if abs(date - quarter_date) <= 0.5:
+            return moon_pi.MOON_QUARTERS[idx % 4]
+    for idx, quarter_date in enumerate(quarter_dates[1:]):
+        if date < quarter_date:
+            return moon_pi.MOON_PHASES[idx]
+    return moon_pi.MOON_PHASES[-1]
+
+
+def test_matches_ephem():
+    rng = random.Random(1)
+    start = ephem.Date("2023/1/1")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        moon_pi.CACHE_DIR = Path(tmpdir)
+        for _ in range(1500):
+            date = ephem.Date(start + rng.uniform(0, 4 * 365))
+            lunation = moon_pi.get_lunation(date)
+            moon = ephem.Moon(date)
+            assert abs(lunation.phase_percent(date) - moon.phase) < PHASE_TOLERANCE
+            assert (
+                abs(lunation.earth_distance(date) - moon.earth_distance)
+                < DISTANCE_TOLERANCE
+            )
+            cycle_start, cycle_end = moon_pi._get_moon_cycle_range(date)
+            age = (date - cycle_start) / (cycle_end - cycle_start)
+            assert abs(lunation.normalized_age(date) - age) < 1e-6
+            assert lunation.phase_text(date) == reference_phase_text(date), date
+
+
+def test_special_moons():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        moon_pi.CACHE_DIR = Path(tmpdir)
+        for date, text in (
+            ("2024/9/18 02:34", "Supermoon"),
+            # a blue moon that is also a supermoon
+            ("2023/8/31 01:35", "Supermoon"),
+            ("2026/5/31 08:45", "Blue Moon"),
+            ("2025/6/11 07:44", "Full Moon"),
+        ):
+            date = ephem.Date(date)
+            assert moon_pi.get_lunation(date).phase_text(date) == text
+
+
+def test_saved_lunations():
+    date = ephem.Date("2024/9/17 12:00")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        moon_pi.CACHE_DIR = Path(tmpdir)
+        lunation = moon_pi.get_lunation(date)
+        moon_pi.get_lunation(ephem.Date(date + 30))
+        moon_pi._load_lunations.cache_clear()
+
+        fit_lunation = moon_pi.fit_lunation
+        moon_pi.fit_lunation = None  # must not be needed
+        try:
+            assert moon_pi.get_lunation(date) == lunation
+        finally:
+            moon_pi.fit_lunation = fit_lunation
+
+
+def test_concurrent_lunations():
+    """Lunations fitted from several threads at once are all saved, once."""
+    start = ephem.Date("2024/1/1")
+    dates = [ephem.Date(start + day / 2) for day in range(365 * 2)]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        moon_pi.CACHE_DIR = Path(tmpdir)
+        moon_pi._load_lunations.cache_clear()
+        fit_lunation = moon_pi.fit_lunation
+
+        def slow_fit_lunation(*args):
+            # give the other threads time to need the same lunation
+            time.sleep(0.01)
+            return fit_lunation(*args)
+
+        with mock.patch.object(moon_pi, "fit_lunation", slow_fit_lunation):
+            with ThreadPoolExecutor(8) as executor:
+                lunations = list(executor.map(moon_pi.get_lunation, dates))
+        fitted = sorted({lunation.start: lunation for lunation in lunations}.items())
+        moon_pi._load_lunations.cache_clear()
+        lunations_file = moon_pi._lunations_path(moon_pi.LUNAR_MODEL)
+        starts, saved = moon_pi._load_lunations(lunations_file)
+        assert saved == [lunation for _, lunation in fitted]
+        assert starts == sorted(set(starts))
+        assert not list(Path(tmpdir).glob("*.bin.*"))
+
+
+def test_evaluation_time():
+    date = ephem.Date("2024/9/17 12:00")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        moon_pi.CACHE_DIR = Path(tmpdir)
+        moon_pi.get_lunation(date)
+        count = 10_000
+        start = time.perf_counter()
+        for i in range(count):
+            d = date + i / count
+            lunation = moon_pi.get_lunation(d)
+            lunation.phase_percent(d)
+            lunation.earth_distance(d)
+        per_call = (time.perf_counter() - start) / count
+    print(f"{per_call * 1e6:.1f} us per evaluation")
+    assert per_call < 100e-6
+
+
+def test_sub_daily_updates():
+    now = arrow.get(2024, 9, 20, 8, tzinfo="US/Pacific")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        moon_pi.CACHE_DIR = Path(tmpdir)
+        moonrise = moon_pi.get_moon_events(now).rise
+        assert now < moonrise < now.shift(days=1).floor("day")
+        assert moon_pi.next_update_time(now) == moonrise
+        assert moon_pi.next_update_time(moonrise) == now.shift(days=1).floor("day")
+
+        moon_pi.SUB_DAILY_UPDATES = True
+        try:
+            morning = moon_pi.get_moon_phase(now)
+            evening = moon_pi.get_moon_phase(moonrise)
+        finally:
+            moon_pi.SUB_DAILY_UPDATES = False
+        assert evening.normalized_age > morning.normalized_age
+        noon = moon_pi.get_moon_phase(now)
+        assert morning.normalized_age < noon.normalized_age < evening.normalized_age
+
+
+if __name__ == "__main__":
+    test_matches_ephem()
+    test_special_moons()
+    test_saved_lunations()
+    test_concurrent_lunations()
+    test_evaluation_time()
+    test_sub_daily_updates()
@@ -0,0 +1,55 @@
+import sys
+import tempfile
+from pathlib import Path
+
+import arrow
+
+libdir = Path(__file__).parent.parent
+if libdir.exists():
+    sys.path.append(str(libdir))
+
+import moon_pi
+
+
+def assert_close(table_value, direct_value):
+    if direct_value is None:
+        assert table_value is None
+    else:
+        assert abs((table_value - direct_value).total_seconds()) <= 30
+
+
+def test_table_matches_ephem():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        moon_pi.CACHE_DIR = Path(tmpdir)
+        start = arrow.get(2024, 1, 1, tzinfo="US/Pacific")
+        # include both DST transitions
+        days = list(arrow.Arrow.range("day", start, limit=366))[::7]
+        days += [arrow.get(2024, 3, 10, tzinfo="US/Pacific")]
+        days += [arrow.get(2024, 11, 3, tzinfo="US/Pacific")]
+        for day in days:
+            direct = moon_pi.compute_moon_events(day)
+            table = moon_pi.get_moon_events(day.shift(hours=15))
+            assert_close(table.rise, direct.rise)
+            assert_close(table.set, direct.set)
+            assert_close(table.transit, direct.transit)
+            assert_close(table.nightfall, direct.nightfall)
+            assert abs(table.nightfall_altitude - direct.nightfall_altitude) < 0.01
+        assert (Path(tmpdir) / "moon-events").exists()
+
+
+def test_table_rebuilt_for_other_time_zone():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        moon_pi.CACHE_DIR = Path(tmpdir)
+        day = arrow.get(2024, 6, 1, tzinfo="US/Pacific")
+        pacific = moon_pi.get_moon_events(day)
+        eastern = moon_pi.get_moon_events(day.replace(tzinfo="US/Eastern"))
+        assert eastern.rise.utcoffset() != pacific.rise.utcoffset()
+        assert_close(
+            eastern.rise,
+            moon_pi.compute_moon_events(day.replace(tzinfo="US/Eastern")).rise,
+        )
+
+
+if __name__ == "__main__":
+    test_table_matches_ephem()
+    test_table_rebuilt_for_other_time_zone()
@@ -8,10 +8,12 @@ libdir = Path(__file__).parent.parent
 if libdir.exists():
     sys.path.append(str(libdir))
 
+import frame_export
 import moon_pi
 
 BASE_DIR = Path(__file__).parent
 OUT_DIR = BASE_DIR / "output"
+WRITER = frame_export.FrameWriter(frame_export.PngExporter())
 
 
 def test_phases(palette):
@@ -34,7 +36,7 @@ def test_phases(palette):
             100,
             palette,
         )
-        img.save(str(OUT_DIR / f"phase-{idx}.png"))
+        WRITER.write(img, OUT_DIR / f"phase-{idx}.png")
 
 
 def test_supermoon(palette):
@@ -54,7 +56,7 @@ def test_supermoon(palette):
         100,
         palette,
     )
-    img.save(str(OUT_DIR / "test-supermoon.png"))
+    WRITER.write(img, OUT_DIR / "test-supermoon.png")
 
 
 def test_blue_moon(palette):
@@ -74,7 +76,7 @@ def test_blue_moon(palette):
         100,
         palette,
     )
-    img.save(str(OUT_DIR / "test-blue-moon.png"))
+    WRITER.write(img, OUT_DIR / "test-blue-moon.png")
 
 
 def test_next_supermoon():
@@ -114,3 +116,4 @@ if __name__ == "__main__":
     test_blue_moon(output_palette)
     test_supermoon(output_palette)
     test_phases(output_palette)
+    WRITER.close()
@@ -0,0 +1,145 @@
+import sys
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import arrow
+
+libdir = Path(__file__).parent.parent
+if libdir.exists():
+    sys.path.append(str(libdir))
+
+import boot_simulator
+import moon_pi
+
+DAY = 86400
+
+
+def discharge(days, start_charge, drain_per_day, runs_per_day=1):
+    start = arrow.get(2024, 9, 1).int_timestamp
+    return [
+        moon_pi.BatteryReading(
+            start + run * DAY // runs_per_day,
+            start_charge - drain_per_day * run / runs_per_day,
+            3.9,
+        )
+        for run in range(days * runs_per_day)
+    ]
+
+
+def test_battery_history():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        moon_pi.BATTERY_HISTORY_FILE = Path(tmpdir) / "battery-history.bin"
+        moon_pi.BATTERY_HISTORY_SIZE = 10
+        readings = discharge(25, 100, 2)
+        for reading in readings:
+            moon_pi.record_battery_reading(reading)
+        history = moon_pi.load_battery_history()
+        assert 10 <= len(history) <= 20
+        assert history == readings[-len(history) :]
+
+        # a partly written record is dropped
+        with moon_pi.BATTERY_HISTORY_FILE.open("ab") as f:
+            f.write(b"\x01\x02")
+        assert moon_pi.load_battery_history() == history
+        moon_pi.record_battery_reading(readings[0])
+        assert moon_pi.load_battery_history()[-1] == readings[0]
+
+
+def test_forecast():
+    forecast = moon_pi.forecast_battery(discharge(10, 90, 3, runs_per_day=4))
+    assert forecast is not None
+    assert abs(forecast.drain_percent_per_day - 3) < 1e-6
+    last_charge = 90 - 3 * (10 * 4 - 1) / 4
+    assert abs(forecast.days_left - last_charge / 3) < 1e-6
+
+    # only the readings since the battery was last charged count
+    history = discharge(10, 95, 5) + discharge(3, 100, 1)
+    history[-3:] = [
+        moon_pi.BatteryReading(r.time + 20 * DAY, r.charge_percent, r.voltage)
+        for r in history[-3:]
+    ]
+    assert abs(moon_pi.forecast_battery(history).drain_percent_per_day - 1) < 1e-6
+
+    assert moon_pi.forecast_battery(discharge(1, 90, 3, runs_per_day=4)) is None
+    assert moon_pi.forecast_battery(discharge(5, 50, -2)) is None
+
+
+def test_choose_power_plan():
+    names = {
+        (None, None): "full",
+        (90, None): "full",
+        (90, 30): "full",
+        (90, 10): "economy",
+        (30, None): "economy",
+        (30, 2): "critical",
+        (10, None): "critical",
+    }
+    for (charge, days_left), name in names.items():
+        forecast = moon_pi.BatteryForecast(1, days_left) if days_left else None
+        plan = moon_pi.choose_power_plan(charge, forecast)
+        assert plan.name == name, (charge, days_left, plan.name)
+
+    full, economy, critical = moon_pi.POWER_PLANS
+    assert full.estimated_cost_mah(True) > economy.estimated_cost_mah(True)
+    assert economy.estimated_cost_mah(True) > economy.estimated_cost_mah(False)
+
+
+def test_wake_weekday_repeat():
+    monday = arrow.get(2024, 9, 16)
+    assert moon_pi.wake_weekday_repeat(monday, 1) == 0b1111111
+    assert moon_pi.wake_weekday_repeat(monday, 2) == 1 << 3  # Wednesday
+    assert moon_pi.wake_weekday_repeat(monday, 7) == 1 << 1  # Monday
+
+
+def test_schedule_next_update():
+    """Sub-daily updates move the daily wake up, and it's moved back afterwards."""
+    pisugar = boot_simulator.FakePiSugar(boot_simulator.DischargeModel())
+    configured = pisugar.alarm_time
+    now = arrow.get(2024, 9, 16, 12, tzinfo="local")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        patches = mock.patch.multiple(
+            moon_pi, CACHE_DIR=Path(tmpdir), get_pisugar_server=lambda: pisugar
+        )
+        with patches:
+            moon_pi.schedule_next_update(now)
+            when = moon_pi.next_update_time(now)
+            assert pisugar.next_wake_up(now) == when
+            # if that boot fails, the Pi still wakes up the next day
+            assert pisugar.next_wake_up(when) == when.shift(days=1)
+            moon_pi.schedule_next_update(when)
+            assert pisugar.alarm_repeat == moon_pi.wake_weekday_repeat(now, 1)
+
+            moon_pi.set_wake_interval(now, 2)
+            assert pisugar.alarm_time == configured
+            assert pisugar.alarm_repeat == moon_pi.wake_weekday_repeat(now, 2)
+            assert not moon_pi.wake_time_path().exists()
+
+
+def test_prerender_frames():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        moon_pi.CACHE_DIR = Path(tmpdir)
+        epd = moon_pi.epaper.epaper(moon_pi.WAVESHARE_DISPLAY).EPD()
+        now = arrow.get(2024, 9, 16, 9, tzinfo="US/Pacific")
+        stale = moon_pi.prerendered_frame_path(now.shift(days=-1).date(), False)
+        stale.parent.mkdir(parents=True)
+        stale.write_bytes(b"")
+
+        # the battery is forecast to be low on the second day
+        forecast = moon_pi.BatteryForecast(4, 7)
+        moon_pi.prerender_frames(now, 2, 25, forecast)
+        assert not stale.exists()
+        tomorrow = now.shift(days=1)
+        frame = moon_pi.load_prerendered_frame(epd, tomorrow, False)
+        assert frame == moon_pi.render_frame_buffer(tomorrow, False)
+        assert moon_pi.load_prerendered_frame(epd, now.shift(days=2), True)
+        assert moon_pi.load_prerendered_frame(epd, now.shift(days=2), False) is None
+
+
+if __name__ == "__main__":
+    test_battery_history()
+    test_forecast()
+    test_choose_power_plan()
+    test_wake_weekday_repeat()
+    test_schedule_next_update()
+    test_prerender_frames()
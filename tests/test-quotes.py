@@ -7,10 +7,12 @@ libdir = Path(__file__).parent.parent
 if libdir.exists():
     sys.path.append(str(libdir))
 
+import frame_export
 import moon_pi
 
 BASE_DIR = Path(__file__).parent
 OUT_DIR = BASE_DIR / "output"
+WRITER = frame_export.FrameWriter(frame_export.PngExporter())
 
 
 def test_quotes(now, palette):
@@ -31,7 +33,7 @@ def test_quotes(now, palette):
             100,
             palette,
         )
-        img.save(str(OUT_DIR / f"test-quote-{idx}.png"))
+        WRITER.write(img, OUT_DIR / f"test-quote-{idx}.png")
 
 
 def test_bday(palette):
@@ -49,7 +51,7 @@ def test_bday(palette):
         100,
         palette,
     )
-    img.save(str(OUT_DIR / "test-img-bday.png"))
+    WRITER.write(img, OUT_DIR / "test-img-bday.png")
 
 
 def test_low_battery(now, palette):
@@ -65,7 +67,7 @@ def test_low_battery(now, palette):
         19,
         palette,
     )
-    img.save(str(OUT_DIR / "test-img-low-battery.png"))
+    WRITER.write(img, OUT_DIR / "test-img-low-battery.png")
 
 
 if __name__ == "__main__":
@@ -78,3 +80,4 @@ if __name__ == "__main__":
 
     test_bday(output_palette)
     test_low_battery(now, output_palette)
+    WRITER.close()
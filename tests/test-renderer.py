@@ -0,0 +1,86 @@
+import sys
+import tempfile
+import threading
+from pathlib import Path
+from unittest import mock
+
+import arrow
+
+libdir = Path(__file__).parent.parent
+if libdir.exists():
+    sys.path.append(str(libdir))
+
+import moon_pi
+
+START = arrow.get(2024, 9, 1, 12, tzinfo="US/Pacific")
+
+
+def all_settings(days: int) -> list[moon_pi.ImageSettings]:
+    return [
+        moon_pi.frame_settings(START.shift(days=day), day % 5 == 0)
+        for day in range(days)
+    ]
+
+
+def test_same_as_image_builder():
+    with (
+        tempfile.TemporaryDirectory() as tmpdir,
+        mock.patch.object(moon_pi, "CACHE_DIR", Path(tmpdir)),
+    ):
+        renderer = moon_pi.Renderer()
+        for settings in all_settings(3):
+            expected = moon_pi.ImageBuilder(settings).build()
+            assert renderer.render(settings).tobytes() == expected.tobytes()
+            assert renderer.render(settings, pack=True) == moon_pi.epd_pack_image(
+                expected, settings.profile
+            )
+
+
+def test_render_many():
+    settings = all_settings(40)
+    with (
+        tempfile.TemporaryDirectory() as tmpdir,
+        mock.patch.object(moon_pi, "CACHE_DIR", Path(tmpdir)),
+    ):
+        renderer = moon_pi.Renderer()
+        expected = [renderer.render(s, pack=True) for s in settings]
+        assert list(renderer.render_many(settings, threads=4, pack=True)) == expected
+        # from an iterator, on one thread
+        frames = renderer.render_many(iter(settings[:3]), threads=1)
+        assert [frame.tobytes() for frame in frames] == [
+            renderer.render(s).tobytes() for s in settings[:3]
+        ]
+
+
+def test_base_layer_made_once():
+    settings = all_settings(1)[0]
+    with (
+        tempfile.TemporaryDirectory() as tmpdir,
+        mock.patch.object(moon_pi, "CACHE_DIR", Path(tmpdir)),
+    ):
+        renderer = moon_pi.Renderer()
+        load = moon_pi._load_base_layer.__wrapped__
+        barrier = threading.Barrier(8)
+        frames = []
+
+        def render():
+            barrier.wait()
+            frames.append(renderer.render(settings, pack=True))
+
+        with mock.patch.object(
+            moon_pi._load_base_layer, "__wrapped__", wraps=load
+        ) as made:
+            threads = [threading.Thread(target=render) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        assert made.call_count == 1
+        assert len(frames) == 8
+        assert len(set(frames)) == 1
+
+
+if __name__ == "__main__":
+    test_same_as_image_builder()
+    test_render_many()
+    test_base_layer_made_once()